@@ -0,0 +1,90 @@
+"""
+Compare the per-item Python transforms in svc_juniper_lib.juniper with the NumPy transforms in
+svc_juniper_lib.columnar on synthetic MX tables of aggregation-router size.
+
+    python benchmarks/columnar_transforms.py --units 50000 --ports 2000 --routes 20000
+"""
+import argparse
+import random
+import time
+
+from svc_juniper_lib import columnar
+from svc_juniper_lib import juniper
+
+OPTICS = ['SFP+-10G-LR', 'SFP-LX10', 'SFP+-10G-SR', 'SFP-SX', 'SFP-T', 'XFP-10G-LR', 'QSFP+-40G-LR4']
+
+
+def logical_items(count, rng):
+    """MXLogicalTable style items."""
+    media = ['xe-%d/%d/%d', 'ge-%d/%d/%d', 'ms-%d/%d/%d', 'lo%d%d%d']
+    items = []
+    for i in range(count):
+        physical = rng.choice(media) % (i % 8, i % 4, i % 24)
+        description = rng.choice([None, '', 'SVC: CUSTOMER %d' % i])
+        items.append(('%s.%d' % (physical, rng.randint(0, 4200)), [('description', description), ('link_address', None)]))
+    return items
+
+
+def physical_items(count, rng):
+    """MXPhysicalTable and MXChassisHardware style items."""
+    ports, sfp = [], []
+    for i in range(count):
+        fpc, pic, port = i // 40, (i // 10) % 4, i % 10
+        optic = rng.choice(OPTICS)
+        media = 'xe-' if '10G' in optic else 'ge-'
+        ports.append(('%s%d/%d/%d' % (media, fpc, pic, port),
+                      [('description', rng.choice([None, 'PORT %d' % i])), ('speed', rng.choice(['10Gbps', '1000mbps', None]))]))
+        if rng.random() < 0.8:
+            sfp.append(('Xcvr %d' % port, [('serial_number', 'S%d' % i), ('description', optic), ('sub_sub_module', 'PIC %d' % pic),
+                                           ('sub_module', 'MIC %d' % pic), ('chassis_module', 'FPC %d' % fpc)]))
+    return ports, sfp
+
+
+def route_items(count, logical, rng):
+    """Site public route table items and the logical interface descriptions they join to."""
+    names = [key for key, value in logical] + ['unknown.0']
+    routes = []
+    for i in range(count):
+        via = rng.choice(names)
+        routes.append(('10.%d.%d.%d/32' % (i >> 16 & 255, i >> 8 & 255, i & 255),
+                       [('route_table', 'inet.0'), ('local_interface', None), ('next_hop', via),
+                        ('next_hop_service', None), ('next_hop_type', rng.choice([None, None, 'Router']))]))
+    return routes, dict((key, value[0][1]) for key, value in logical)
+
+
+def measure(label, loop, vectorized, repeat):
+    timings = []
+    for transform in (loop, vectorized):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = transform()
+        timings.append(((time.perf_counter() - start) / repeat, result))
+    (loop_seconds, expected), (columnar_seconds, (actual, columns)) = timings
+    print('%-22s loop %8.4fs  columnar %8.4fs  speedup %5.1fx  equal %s'
+          % (label, loop_seconds, columnar_seconds, loop_seconds / columnar_seconds, expected == actual))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--units', type=int, default=50000)
+    parser.add_argument('--ports', type=int, default=2000)
+    parser.add_argument('--routes', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    logical = logical_items(args.units, rng)
+    ports, sfp = physical_items(args.ports, rng)
+    routes, descriptions = route_items(args.routes, logical, rng)
+
+    measure('interface vlans', lambda: juniper._mx_interface_vlans(logical),
+            lambda: columnar.mx_interface_vlans(logical), args.repeat)
+    measure('mx interfaces', lambda: juniper._mx_interfaces(ports, sfp),
+            lambda: columnar.mx_interfaces(ports, sfp), args.repeat)
+    measure('ipv4 public routes', lambda: juniper._mx_ipv4_public_routes(routes, descriptions),
+            lambda: columnar.mx_ipv4_public_routes(routes, descriptions), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
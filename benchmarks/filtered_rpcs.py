@@ -0,0 +1,102 @@
+"""
+Compare the full Junos tables used by svc_juniper_lib with their server-side filtered variants.
+
+Record the RPC replies of both variants from a live device once:
+
+    python benchmarks/filtered_rpcs.py record --host br1-svc.at1.example.com --user svc --role mx --fixtures fixtures/at1-br1
+
+then compare reply size, recorded RPC time, local parse/transform time and output equality offline:
+
+    python benchmarks/filtered_rpcs.py compare --role mx --fixtures fixtures/at1-br1
+
+The password is read from the JUNOS_PASSWORD environment variable or prompted for.
+"""
+import argparse
+import getpass
+import json
+import os
+import time
+
+from lxml import etree
+
+from svc_juniper_lib import juniper
+from svc_juniper_lib import metrics
+from svc_juniper_lib import sessions
+
+# (name, full tables, filtered tables, transform taking the fetched tables)
+CASES = {
+    'mx': [
+        ('interface vlans', [juniper.MXLogicalTable], [juniper.MXLogicalTerseTable, juniper.MXLogicalDescriptionTable],
+         lambda tables: juniper._mx_interface_vlans(juniper._logical_items(*tables))),
+        ('physical interfaces', [juniper.MXPhysicalTable], [juniper.MXPhysicalBriefTable],
+         lambda tables: dict(tables[0].items())),
+        ('routing instances', [juniper.MXRouteInstance], [juniper.MXRouteInstanceConfigTable],
+         lambda tables: juniper._instances(tables[0].items(), 'site')),
+    ],
+    'qfx': [
+        ('vlans', [juniper.QFXVlanTable], [juniper.QFXVlanConfigTable],
+         lambda tables: juniper._qfx_vlans(juniper._vlan_config_items(tables[0]) if isinstance(tables[0], juniper.QFXVlanConfigTable)
+                                           else tables[0].items())),
+        ('physical interfaces', [juniper.QFXEXPhysicalTable], [juniper.QFXEXPhysicalBriefTable],
+         lambda tables: dict(tables[0].items())),
+    ],
+}
+CASES['ex'] = CASES['qfx'][1:]
+
+
+def record(args):
+    password = os.environ.get('JUNOS_PASSWORD') or getpass.getpass()
+    os.makedirs(args.fixtures, exist_ok=True)
+    recorder = metrics.MetricsRecorder()
+    metrics.set_metrics_sink(recorder)
+    dev = sessions.open_device(args.host, args.user, password)
+    try:
+        for name, full, filtered, transform in CASES[args.role]:
+            for table in full + filtered:
+                fetched = metrics.get_table(table(dev))
+                etree.ElementTree(fetched.xml).write(os.path.join(args.fixtures, table.__name__ + '.xml'))
+    finally:
+        dev.close()
+    rpc_times = dict((r['table'], r['seconds']) for r in recorder.records if r['phase'] == 'rpc')
+    with open(os.path.join(args.fixtures, 'rpc_times.json'), 'w') as f:
+        json.dump(rpc_times, f, indent=2)
+
+
+def compare(args):
+    with open(os.path.join(args.fixtures, 'rpc_times.json')) as f:
+        rpc_times = json.load(f)
+    print('%-20s %-8s %12s %10s %10s  %s' % ('case', 'variant', 'reply bytes', 'rpc s', 'parse s', 'equal'))
+    for name, full, filtered, transform in CASES[args.role]:
+        outputs = {}
+        for variant, tables in (('full', full), ('filtered', filtered)):
+            paths = [os.path.join(args.fixtures, table.__name__ + '.xml') for table in tables]
+            reply_bytes = sum(os.path.getsize(path) for path in paths)
+            rpc_seconds = sum(rpc_times.get(table.__name__, 0.0) for table in tables)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                outputs[variant] = transform([table(path=path).get() for table, path in zip(tables, paths)])
+            parse_seconds = (time.perf_counter() - start) / args.repeat
+            equal = '' if variant == 'full' else str(outputs['full'] == outputs['filtered'])
+            print('%-20s %-8s %12d %10.3f %10.4f  %s' % (name, variant, reply_bytes, rpc_seconds, parse_seconds, equal))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record_parser = subparsers.add_parser('record')
+    record_parser.add_argument('--host', required=True)
+    record_parser.add_argument('--user', required=True)
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('--repeat', type=int, default=5)
+    for sub in (record_parser, compare_parser):
+        sub.add_argument('--role', choices=sorted(CASES), required=True)
+        sub.add_argument('--fixtures', required=True)
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Compare PyEZ Table/View evaluation with the single pass parser in svc_juniper_lib.parsers on large RPC replies.
+
+Replies are generated synthetically, or read from the <Table>.xml files saved by `filtered_rpcs.py record`:
+
+    python benchmarks/lxml_parser.py --units 100000 --routes 20000
+    python benchmarks/lxml_parser.py --fixtures fixtures/at1-br1
+"""
+import argparse
+import os
+import random
+import time
+
+from lxml.builder import E
+
+from svc_juniper_lib import juniper
+from svc_juniper_lib import parsers
+
+OPTICS = ['SFP+-10G-LR', 'SFP-LX10', 'SFP+-10G-SR', 'SFP-SX', 'SFP-T', 'XFP-10G-LR']
+
+
+def logical_reply(count, rng):
+    """get-interface-information reply with `count` logical units spread over physical interfaces."""
+    reply = E('interface-information')
+    for i in range(0, count, 100):
+        physical = E('physical-interface', E('name', 'xe-%d/%d/%d' % (i // 9600, i // 2400 % 4, i // 100 % 24)))
+        for unit in range(i, min(i + 100, count)):
+            logical = E('logical-interface', E('name', '%s.%d' % (physical[0].text, unit % 4000 + 2)))
+            if rng.random() < 0.8:
+                logical.append(E('description', 'SVC: CUSTOMER %d' % unit))
+            logical.append(E('traffic-statistics', E('input-packets', str(unit)), E('output-packets', str(unit))))
+            physical.append(logical)
+        reply.append(physical)
+    return reply
+
+
+def port_name(i):
+    return 'xe-%d/%d/%d' % (i // 96, i // 48 % 2, i % 48)
+
+
+def physical_reply(count, rng):
+    """get-interface-information reply with `count` physical interfaces."""
+    reply = E('interface-information')
+    for i in range(count):
+        interface = E('physical-interface', E('name', port_name(i)), E('speed', rng.choice(['10Gbps', '1000mbps'])))
+        if rng.random() < 0.9:
+            interface.append(E('description', 'SVC: CUSTOMER %d' % i))
+        interface.append(E('traffic-statistics', E('input-packets', str(i)), E('output-packets', str(i))))
+        reply.append(interface)
+    return reply
+
+
+def port_chassis_reply(count, rng):
+    """MX get-chassis-inventory reply with a 10G transceiver in each of the first `count` ports of `physical_reply`."""
+    chassis = E('chassis', E('name', 'Chassis'))
+    for fpc in range(count // 96 + 1):
+        module = E('chassis-module', E('name', 'FPC %d' % fpc))
+        for pic in range(2):
+            mic = E('chassis-sub-module', E('name', 'MIC %d' % pic),
+                    E('chassis-sub-sub-module', E('name', 'PIC %d' % pic)))
+            for port in range(48):
+                if fpc * 96 + pic * 48 + port < count:
+                    mic[1].append(E('chassis-sub-sub-sub-module', E('name', 'Xcvr %d' % port),
+                                    E('serial-number', 'S%d%d%d' % (fpc, pic, port)),
+                                    E('description', rng.choice(['SFP+-10G-LR', 'SFP+-10G-SR', 'XFP-10G-LR']))))
+            module.append(mic)
+        chassis.append(module)
+    return E('chassis-inventory', chassis)
+
+
+def chassis_reply(count, rng):
+    """get-chassis-inventory reply with `count` transceivers."""
+    chassis = E('chassis', E('name', 'Chassis'))
+    for fpc in range(count // 40 + 1):
+        module = E('chassis-module', E('name', 'FPC %d' % fpc))
+        for pic in range(4):
+            mic = E('chassis-sub-module', E('name', 'MIC %d' % pic),
+                    E('chassis-sub-sub-module', E('name', 'PIC %d' % pic)))
+            for port in range(10):
+                mic[1].append(E('chassis-sub-sub-sub-module', E('name', 'Xcvr %d' % port),
+                                E('serial-number', 'S%d%d%d' % (fpc, pic, port)), E('description', rng.choice(OPTICS))))
+            module.append(mic)
+        chassis.append(module)
+    return E('chassis-inventory', chassis)
+
+
+def route_reply(count, rng):
+    """get-route-information reply with `count` routes, some of them with several next hops."""
+    table = E('route-table', E('table-name', 'inet.0'))
+    for i in range(count):
+        entry = E('rt-entry', E('nh', E('via', 'xe-0/0/%d.%d' % (i % 24, i % 4000 + 2))))
+        if rng.random() < 0.1:
+            entry.append(E('nh', E('via', 'ae0.%d' % (i % 4000 + 2))))
+        if rng.random() < 0.3:
+            entry.append(E('nh-type', 'Router'))
+        table.append(E('rt', E('rt-destination', '10.%d.%d.%d/32' % (i >> 16 & 255, i >> 8 & 255, i & 255)), entry))
+    return E('route-information', table)
+
+
+def measure(label, table, repeat):
+    timings = []
+    for engine in ('pyez', 'lxml'):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = parsers.table_items(table, engine)
+        timings.append(((time.perf_counter() - start) / repeat, result))
+    (pyez_seconds, expected), (lxml_seconds, actual) = timings
+    print('%-28s items %7d  pyez %8.4fs  lxml %8.4fs  speedup %5.1fx  equal %s'
+          % (label, len(expected), pyez_seconds, lxml_seconds, pyez_seconds / lxml_seconds, expected == actual))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--units', type=int, default=50000)
+    parser.add_argument('--ports', type=int, default=2000)
+    parser.add_argument('--routes', type=int, default=20000)
+    parser.add_argument('--fixtures', help='directory of <Table>.xml replies saved by filtered_rpcs.py record')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.fixtures:
+        for name in sorted(os.listdir(args.fixtures)):
+            table = getattr(juniper, os.path.splitext(name)[0], None)
+            if name.endswith('.xml') and table is not None:
+                measure(table.__name__, table(path=os.path.join(args.fixtures, name)).get(), args.repeat)
+        return
+
+    rng = random.Random(args.seed)
+    measure('MXLogicalTable', juniper.MXLogicalTable(xml=logical_reply(args.units, rng)), args.repeat)
+    measure('MXChassisHardware', juniper.MXChassisHardware(xml=chassis_reply(args.ports, rng)), args.repeat)
+    measure('br1svcat1corpequinixcom', juniper.br1svcat1corpequinixcom(xml=route_reply(args.routes, rng)), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
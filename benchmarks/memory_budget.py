@@ -0,0 +1,326 @@
+"""
+Measure the memory each sync function needs at fleet scale and fail when it exceeds its budget.
+
+Every planner in svc_synchronize_lib.synchronize.PLANNERS runs against a synthetic large site: device replies are
+built in memory (or read from the <Table>.xml files saved by `filtered_rpcs.py record`) and NetBox answers from a
+fake HTTP session, so the real juniper transforms and netbox parsing run unchanged. Under tracemalloc the script
+reports the peak and retained Python memory of every phase:
+
+    juniper   reading and transforming device tables (juniper_get_* calls)
+    netbox    reading and parsing NetBox objects (netbox_get_* calls)
+    plan      the whole planner, including the two phases above
+    apply     writing the planned changes
+
+    python benchmarks/memory_budget.py
+    python benchmarks/memory_budget.py --budgets benchmarks/memory_budgets.json
+    python benchmarks/memory_budget.py --interfaces 4000 --routes 8000 --route-length 26
+    python benchmarks/memory_budget.py --fixtures fixtures/at1-br1 --budget plan=200 --budget sync_netbox_mx_vrfs.netbox=20
+
+Budgets are MiB per '<sync>.<phase>' or per '<phase>' for every sync. The exit status is 1 when one is exceeded.
+memory_budgets.json holds the budgets for the default inventory sizes.
+tracemalloc only sees Python objects, the libxml2 trees behind the PyEZ tables are not included, the maximum
+resident set size of the process is printed at the end for those.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tracemalloc
+
+from lxml import etree
+from lxml.builder import E
+
+from svc_juniper_lib import juniper
+from svc_netbox_lib import netbox
+from svc_synchronize_lib import synchronize
+
+from lxml_parser import chassis_reply
+from lxml_parser import logical_reply
+from lxml_parser import physical_reply
+from lxml_parser import port_name
+
+SITE = 'at1'
+MIB = 1024.0 * 1024.0
+
+
+# --- synthetic device replies -----------------------------------------------------------------------------------
+
+def qfx_chassis_reply(count, rng):
+    """QFX/EX get-chassis-inventory reply with a 10G transceiver (matching the xe- ports) in the first `count` ports."""
+    chassis = E('chassis', E('name', 'Chassis'))
+    for fpc in range(count // 96 + 1):
+        module = E('chassis-module', E('name', 'FPC %d' % fpc))
+        for pic in range(2):
+            sub = E('chassis-sub-module', E('name', 'PIC %d' % pic))
+            for port in range(48):
+                if fpc * 96 + pic * 48 + port < count:
+                    sub.append(E('chassis-sub-sub-module', E('name', 'Xcvr %d' % port),
+                                 E('serial-number', 'S%d%d%d' % (fpc, pic, port)),
+                                 E('description', rng.choice(['SFP+-10G-LR', 'SFP+-10G-SR']))))
+            module.append(sub)
+        chassis.append(module)
+    return E('chassis-inventory', chassis)
+
+
+def vlan_reply(count):
+    """QFX get-vlan-information reply with `count` VLANs."""
+    reply = E('l2ng-l2ald-vlan-instance-information')
+    for vid in range(2, count + 2):
+        reply.append(E('l2ng-l2ald-vlan-instance-group', E('l2ng-l2rtb-vlan-name', 'VLAN_%d' % vid),
+                       E('l2ng-l2rtb-vlan-tag', str(vid))))
+    return reply
+
+
+def route_reply(count, length, units, rng):
+    """Public route table reply with `count` networks of prefix `length`, each routed to an existing unit."""
+    table = E('route-table', E('table-name', 'inet.0'))
+    size = 2 ** (32 - length)
+    for i in range(count):
+        address = 0x40000000 + i * size
+        destination = '%d.%d.%d.%d/%d' % (address >> 24, address >> 16 & 255, address >> 8 & 255, address & 255, length)
+        table.append(E('rt', E('rt-destination', destination), E('rt-entry', E('nh', E('via', rng.choice(units))))))
+    return E('route-information', table)
+
+
+def instance_reply(count, interfaces, units, rng):
+    """get-instance-information reply with `count` routing-instances of `interfaces` interfaces each."""
+    reply = E('instance-information')
+    for i in range(count):
+        instance = E('instance-core', E('instance-name', 'RI-%d' % i),
+                     E('instance-type', 'vpls' if i % 3 else 'vrf'),
+                     E('instance-vrf', E('route-distinguisher', '64.191.0.1:%d' % i)))
+        for unit in rng.sample(units, min(interfaces, len(units))):
+            instance.append(E('instance-interface', E('interface-name', unit)))
+        reply.append(instance)
+    return reply
+
+
+def device_replies(args):
+    """Serialized replies by table class name, the fetch parses them again like ncclient would."""
+    rng = random.Random(args.seed)
+    logical = logical_reply(args.units, rng)
+    units = [name.text for name in logical.iter('name') if '.' in name.text]
+    replies = {
+        'QFXVlanTable': vlan_reply(args.vlans),
+        'MXLogicalTable': logical,
+        'MXPhysicalTable': physical_reply(args.interfaces, rng),
+        'QFXEXPhysicalTable': physical_reply(args.interfaces, rng),
+        'MXChassisHardware': chassis_reply(args.interfaces, rng),
+        'QFXEXChassisHardware': qfx_chassis_reply(args.interfaces, rng),
+        juniper._PUBLIC_ROUTE_TABLES[SITE].__name__: route_reply(args.routes, args.route_length, units, rng),
+        'MXRouteInstance': instance_reply(args.vrfs, args.vrf_interfaces, units, rng),
+    }
+    replies = dict((name, etree.tostring(reply)) for name, reply in replies.items())
+    if args.fixtures:
+        for name in os.listdir(args.fixtures):
+            if name.endswith('.xml'):
+                with open(os.path.join(args.fixtures, name), 'rb') as f:
+                    replies[os.path.splitext(name)[0]] = f.read()
+    return replies
+
+
+# --- fake NetBox --------------------------------------------------------------------------------------------------
+
+class FakeResponse:
+
+    def __init__(self, body, status_code=200):
+        # a copy, so the response body is counted like the one requests would hold
+        self.content = bytes(bytearray(body))
+        self.status_code = status_code
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeSession:
+    """Answers the NetBox endpoints the sync functions read from pre-serialized bodies, and counts the writes."""
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.writes = 0
+
+    def get(self, url, headers=None, params=None):
+        path = url.split('/api/', 1)[1]
+        params = params or {}
+        if path.startswith('dcim/devices/') and path != 'dcim/devices/':
+            return FakeResponse(self.bodies['device'])
+        if path == 'dcim/devices/':
+            return FakeResponse(self.bodies['devices'])
+        if path == 'ipam/vlans/':
+            return FakeResponse(self.bodies['vlans'])
+        if path == 'dcim/interfaces/':
+            return FakeResponse(self.bodies['interfaces'])
+        return FakeResponse(self.bodies[path])
+
+    def _write(self, url, headers=None, json=None):
+        self.writes += 1
+        return FakeResponse(b'{}', 201)
+
+    post = patch = delete = _write
+
+
+def results(items):
+    return json.dumps({'count': len(items), 'next': None, 'previous': None, 'results': items}).encode()
+
+
+def netbox_bodies(args, replies):
+    """NetBox list bodies roughly matching the device replies, with a share of stale and changed objects."""
+    rng = random.Random(args.seed + 1)
+    devices = results([{'id': number, 'name': '%s-svc.%s.corp.equinix.com' % (role, SITE)}
+                       for number, role in enumerate(['br1', 'csw1', 'ls1'], 1)])
+
+    vlan_ids = list(range(2, args.vlans + 2))
+    vlans = results([{'id': i, 'vid': vid, 'description': name} for name in ('qfx', 'mx')
+                     for i, vid in enumerate(vlan_ids) if rng.random() < 0.95])
+
+    interfaces = []
+    for i in range(args.interfaces):
+        interfaces.append({'id': i, 'name': port_name(i), 'description': 'SVC: CUSTOMER %d' % i,
+                           'tags': [rng.choice(['10Gbps', '1Gbps']), rng.choice(['SMF', 'MMF', 'copper'])]})
+
+    addresses = []
+    routes = etree.fromstring(replies[juniper._PUBLIC_ROUTE_TABLES[SITE].__name__])
+    for rt in routes.iter('rt'):
+        for address in synchronize._expand_routes({rt.findtext('rt-destination'): None}):
+            if rng.random() < 0.97:
+                addresses.append({'id': len(addresses), 'address': address, 'description': 'SVC: CUSTOMER'})
+
+    vrfs = []
+    for i in range(args.vrfs):
+        vrfs.append({'id': i, 'name': 'RI-%d' % i, 'rd': '%s 64.191.0.1:%d' % (SITE, i),
+                     'custom_fields': {'type': 'vpls' if i % 3 else 'vrf', 'Site': SITE},
+                     'tags': ['ae0.%d' % unit for unit in range(args.vrf_interfaces)]})
+
+    return {
+        'devices': devices,
+        'device': json.dumps({'platform': {'name': '21.1R1'}, 'custom_fields': {'upgrade': None}}).encode(),
+        'vlans': vlans,
+        'interfaces': results(interfaces),
+        'ipam/prefixes/': results([{'prefix': '64.0.0.0/8'}]),
+        'ipam/ip-addresses/': results(addresses),
+        'ipam/vrfs/': results(vrfs),
+        'dcim/platforms/': results([{'name': '21.1R1'}, {'name': '20.4R3'}]),
+    }
+
+
+# --- tracing ------------------------------------------------------------------------------------------------------
+
+class Tracker:
+    """Peak and retained tracemalloc memory per (sync, phase), nested phases count towards the enclosing ones."""
+
+    def __init__(self):
+        self.sync = None
+        self.results = {}
+        self._stack = []
+
+    def enter(self):
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in self._stack:
+            frame['peak'] = max(frame['peak'], peak)
+        tracemalloc.reset_peak()
+        self._stack.append({'start': current, 'peak': current})
+
+    def exit(self, phase):
+        current, peak = tracemalloc.get_traced_memory()
+        frame = self._stack.pop()
+        frame['peak'] = max(frame['peak'], peak)
+        for outer in self._stack:
+            outer['peak'] = max(outer['peak'], frame['peak'])
+        result = self.results.setdefault((self.sync, phase), {'peak': 0, 'retained': 0, 'calls': 0})
+        result['peak'] = max(result['peak'], frame['peak'] - frame['start'])
+        result['retained'] += current - frame['start']
+        result['calls'] += 1
+
+    def wrap(self, phase, function):
+        def traced(*vargs, **kvargs):
+            self.enter()
+            try:
+                return function(*vargs, **kvargs)
+            finally:
+                self.exit(phase)
+        return traced
+
+
+def install(tracker, replies, session):
+    """Point the libraries at the synthetic device and NetBox, with every read wrapped in its phase."""
+    def get_tables(fqdn, username, password, tables, parallel=False):
+        fetched = []
+        for table in tables:
+            table = table[0] if isinstance(table, tuple) else table
+            fetched.append(table(xml=etree.fromstring(replies[table.__name__])))
+        return fetched
+
+    juniper._get_tables = get_tables
+    juniper.juniper_get_version = lambda fqdn, username, password, refresh=False, max_age=None: '21.2R1'
+    netbox._session = session
+    netbox.netbox_set_lookup_cache(0)
+    for module, prefix, phase in ((juniper, 'juniper_get_', 'juniper'), (netbox, 'netbox_get_', 'netbox')):
+        for name in dir(module):
+            if name.startswith(prefix):
+                setattr(module, name, tracker.wrap(phase, getattr(module, name)))
+
+
+def parse_budgets(args):
+    budgets = {}
+    if args.budgets:
+        with open(args.budgets) as f:
+            budgets.update(json.load(f))
+    for item in args.budget:
+        key, value = item.split('=', 1)
+        budgets[key] = float(value)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--interfaces', type=int, default=2000, help='physical interfaces per device')
+    parser.add_argument('--units', type=int, default=20000, help='MX logical units')
+    parser.add_argument('--vlans', type=int, default=4000)
+    parser.add_argument('--routes', type=int, default=2000, help='public networks on the MX')
+    parser.add_argument('--route-length', type=int, default=28, help='prefix length of the public networks')
+    parser.add_argument('--vrfs', type=int, default=500)
+    parser.add_argument('--vrf-interfaces', type=int, default=20, help='interfaces per routing-instance')
+    parser.add_argument('--fixtures', help='directory of <Table>.xml replies saved by filtered_rpcs.py record')
+    parser.add_argument('--budgets', help='JSON file of {"<sync>.<phase>" or "<phase>": MiB}')
+    parser.add_argument('--budget', action='append', default=[], help='<sync>.<phase>=MiB or <phase>=MiB')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # the phase peaks need tracemalloc.reset_peak, the packages themselves still run on 3.8
+    if not hasattr(tracemalloc, 'reset_peak'):
+        parser.error('memory budgets need Python 3.9 or later (tracemalloc.reset_peak)')
+    budgets = parse_budgets(args)
+    replies = device_replies(args)
+    session = FakeSession(netbox_bodies(args, replies))
+    tracker = Tracker()
+    install(tracker, replies, session)
+
+    tracemalloc.start()
+    for sync, planner in synchronize.PLANNERS.items():
+        tracker.sync = sync
+        changes = tracker.wrap('plan', planner)('token', SITE, 'username', 'password')
+        tracker.wrap('apply', synchronize.apply_changes)('token', changes)
+    tracemalloc.stop()
+
+    exceeded = []
+    print('%-36s %-8s %6s %12s %14s %10s' % ('sync', 'phase', 'calls', 'peak MiB', 'retained MiB', 'budget'))
+    for (sync, phase), result in sorted(tracker.results.items()):
+        budget = budgets.get('%s.%s' % (sync, phase), budgets.get(phase))
+        peak = result['peak'] / MIB
+        over = budget is not None and peak > budget
+        if over:
+            exceeded.append('%s.%s' % (sync, phase))
+        print('%-36s %-8s %6d %12.1f %14.1f %10s%s' % (sync, phase, result['calls'], peak, result['retained'] / MIB,
+                                                       '' if budget is None else '%.1f' % budget,
+                                                       '  EXCEEDED' if over else ''))
+    print('NetBox writes %d, max resident set %.1f MiB' % (session.writes,
+                                                            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+    if exceeded:
+        print('Budget exceeded: ' + ', '.join(exceeded))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
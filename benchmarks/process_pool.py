@@ -0,0 +1,81 @@
+"""
+Compare transforming the replies of many devices on threads (one GIL) with handing them to a process pool
+(svc_juniper_lib.offload), as a fleet sync collecting every device concurrently would:
+
+    python benchmarks/process_pool.py --devices 16 --processes 16
+    python benchmarks/process_pool.py --devices 16 --processes 16 --engine lxml
+
+Replies are synthetic, see lxml_parser.py. Fetching and the first parse (ncclient's, in the I/O thread) are not
+measured, every device's tables are already in memory; the process pool time includes serializing them and parsing
+them again in the workers.
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+from svc_juniper_lib import juniper
+from svc_juniper_lib import offload
+
+from lxml_parser import logical_reply
+from lxml_parser import physical_reply
+from lxml_parser import port_chassis_reply
+from lxml_parser import route_reply
+
+
+def device_tables(args, seed):
+    """Fetched-table stand-ins for one MX: physical ports, chassis inventory, routes and logical interfaces."""
+    rng = random.Random(seed)
+    logical = logical_reply(args.units, rng)
+    return {'ports': [juniper.MXPhysicalTable(xml=physical_reply(args.ports, rng))],
+            'sfp': [juniper.MXChassisHardware(xml=port_chassis_reply(args.ports, rng))],
+            'routes': [juniper.br1svcat1corpequinixcom(xml=route_reply(args.routes, rng))],
+            'logical': [juniper.MXLogicalTable(xml=logical)]}
+
+
+def transform_device(tables, engine):
+    return (juniper._transform('bench', 'juniper_get_mx_interfaces', juniper._mx_interfaces,
+                               [tables['ports'], tables['sfp']], engine),
+            juniper._transform('bench', 'juniper_get_mx_ipv4_public_routes', juniper._public_routes,
+                               [tables['routes'], tables['logical']], engine))
+
+
+def run(devices, engine):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+        results = list(executor.map(lambda tables: transform_device(tables, engine), devices))
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=16)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--units', type=int, default=20000)
+    parser.add_argument('--ports', type=int, default=2000)
+    parser.add_argument('--routes', type=int, default=10000)
+    parser.add_argument('--engine', default='pyez', choices=['pyez', 'lxml'])
+    args = parser.parse_args()
+
+    devices = [device_tables(args, seed) for seed in range(args.devices)]
+
+    threads_seconds, expected = run(devices, args.engine)
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        previous = offload.set_parse_pool(pool)
+        try:
+            # start the workers outside the measurement
+            list(pool.map(abs, range(args.processes)))
+            pool_seconds, actual = run(devices, args.engine)
+        finally:
+            offload.set_parse_pool(previous)
+
+    print('%d devices, %d cpus, engine %s' % (args.devices, os.cpu_count(), args.engine))
+    print('threads only            %8.2fs' % threads_seconds)
+    print('process pool (%3d)      %8.2fs  speedup %5.1fx  equal %s'
+          % (args.processes, pool_seconds, threads_seconds / pool_seconds, expected == actual))
+
+
+if __name__ == '__main__':
+    main()
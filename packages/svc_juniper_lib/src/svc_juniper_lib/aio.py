@@ -0,0 +1,352 @@
+"""
+Asyncio NETCONF collection engine: the RPCs of the PyEZ tables, for many devices at once, on one event loop over
+asyncssh instead of a blocking PyEZ Device (and its ncclient transport thread) per session
+
+    with aio.AsyncCollector(max_devices=500) as collector:
+        aio.set_collector(collector)
+        ...  # every juniper_get_* function, from any number of threads, now fetches through the collector
+
+The replies are bound to the same table classes (Table(xml=reply)), so the existing transforms are unchanged.
+"""
+import asyncio
+import itertools
+import threading
+import time
+
+from lxml import etree
+from jnpr.junos.exception import RpcError
+from jnpr.junos.jxml import remove_namespaces_and_spaces
+from jnpr.junos.rpcmeta import _RpcMetaExec
+
+from . import metrics
+from . import timeouts
+
+try:
+    import asyncssh
+except ImportError:  # optional dependency: pip install svc-juniper-lib[asyncio]
+    asyncssh = None
+
+# collector the juniper functions fetch their tables through, None uses PyEZ sessions
+_collector = None
+
+_NAMESPACE = 'urn:ietf:params:xml:ns:netconf:base:1.0'
+_BASE_10 = 'urn:ietf:params:netconf:base:1.0'
+_BASE_11 = 'urn:ietf:params:netconf:base:1.1'
+_END_OF_MESSAGE = b']]>]]>'
+_HELLO = ('<?xml version="1.0" encoding="UTF-8"?><hello xmlns="%s"><capabilities><capability>%s</capability>'
+          '<capability>%s</capability></capabilities></hello>' % (_NAMESPACE, _BASE_10, _BASE_11)).encode()
+
+
+def set_collector(collector):
+    """Install the collector every svc_juniper_lib.juniper function fetches its tables through.
+
+    Parameters
+    ----------
+    collector : AsyncCollector or None
+        Started collector, None goes back to PyEZ sessions (see `sessions.set_session_pool`).
+
+    Returns
+    -------
+    AsyncCollector or None
+        The previously installed collector.
+    """
+    global _collector
+    previous = _collector
+    _collector = collector
+    return previous
+
+
+def get_collector():
+    """Return the installed collector (or None)."""
+    return _collector
+
+
+class _Captured(Exception):
+    pass
+
+
+class _RpcRecorder:
+    """Stands in for a Device so a table's get() builds its RPC without sending it."""
+    ON_JUNOS = False
+    _use_filter = False
+    transform = None
+
+    def __init__(self):
+        # the same RPC builder a Device uses, its execute() is ours
+        self.rpc = _RpcMetaExec(self)
+
+    def execute(self, rpc_cmd, **kvargs):
+        raise _Captured(rpc_cmd)
+
+
+def rpc_request(table):
+    """Return the RPC element PyEZ sends to fetch a table.
+
+    Parameters
+    ----------
+    table : type or tuple
+        PyEZ table class, or a (table class, get() arguments) pair, see `sessions.fetch_table`.
+
+    Returns
+    -------
+    lxml.etree._Element
+        e.g. <get-interface-information><interface-name>[axg]e*</interface-name></get-interface-information>.
+    """
+    table, kvargs = table if isinstance(table, tuple) else (table, {})
+    try:
+        table(_RpcRecorder()).get(**kvargs)
+    except _Captured as captured:
+        return captured.args[0]
+    raise ValueError('%s.get() did not send an RPC' % table.__name__)
+
+
+class NetconfSession:
+    """One NETCONF session over an asyncssh connection, RPCs are sent one at a time.
+
+    Use `NetconfSession.open` to create one.
+    """
+
+    def __init__(self, host, connection, reader, writer):
+        self.host = host
+        self._connection = connection
+        self._reader = reader
+        self._writer = writer
+        self._chunked = False
+        self._message_ids = itertools.count(1)
+
+    @classmethod
+    async def open(cls, host, username, password, port=22, known_hosts=None):
+        """Connect, start the netconf subsystem and exchange hellos (base:1.1 chunked framing when offered)."""
+        connection = await asyncssh.connect(host, port=port, username=username, password=password,
+                                            known_hosts=known_hosts)
+        try:
+            writer, reader, _ = await connection.open_session(subsystem='netconf', encoding=None)
+            session = cls(host, connection, reader, writer)
+            session._send(_HELLO)
+            hello = etree.fromstring(await session._receive())
+            capabilities = [element.text for element in hello.iter('{%s}capability' % _NAMESPACE)]
+            session._chunked = _BASE_11 in capabilities
+            return session
+        except BaseException:
+            connection.close()
+            raise
+
+    def _send(self, message):
+        if self._chunked:
+            self._writer.write(b'\n#%d\n' % len(message) + message + b'\n##\n')
+        else:
+            self._writer.write(message + _END_OF_MESSAGE)
+
+    async def _receive(self):
+        if not self._chunked:
+            return (await self._reader.readuntil(_END_OF_MESSAGE))[:-len(_END_OF_MESSAGE)]
+        chunks = []
+        while True:
+            line = (await self._reader.readuntil(b'\n')).strip()
+            if not line:
+                continue
+            if line == b'##':
+                return b''.join(chunks)
+            chunks.append(await self._reader.readexactly(int(line[1:])))
+
+    async def rpc(self, request):
+        """Send one RPC and return its reply as PyEZ does: namespaces removed, the first child of <rpc-reply>.
+
+        Raises
+        ------
+        jnpr.junos.exception.RpcError
+            The reply carries an <rpc-error> of severity error.
+        """
+        message = b'<nc:rpc xmlns:nc="%s" message-id="%d">%s</nc:rpc>' % (
+            _NAMESPACE.encode(), next(self._message_ids), etree.tostring(request))
+        self._send(message)
+        reply = remove_namespaces_and_spaces(etree.fromstring(await self._receive(),
+                                                              etree.XMLParser(huge_tree=True)))
+        for error in reply.iter('rpc-error'):
+            if error.findtext('error-severity') == 'error':
+                raise RpcError(cmd=request, rsp=error)
+        return reply[0] if len(reply) else reply
+
+    async def close(self):
+        """Close the session, best effort."""
+        try:
+            self._send(b'<nc:rpc xmlns:nc="%s" message-id="%d"><nc:close-session/></nc:rpc>'
+                       % (_NAMESPACE.encode(), next(self._message_ids)))
+        except Exception:
+            pass
+        self._connection.close()
+
+
+class AsyncCollector:
+    """Fetch PyEZ tables from many devices concurrently on one asyncio event loop, running in its own thread.
+
+    Sessions are opened on first use and kept for later fetches from the same device until `close`. A session
+    found closed by the device is replaced once.
+
+    Parameters
+    ----------
+    max_devices : int, optional
+        Devices fetched from at the same time, further fetches wait.
+    per_device : int, optional
+        Sessions (RPCs in flight) per device, the tables of one fetch are spread over them.
+    port : int, optional
+        NETCONF over SSH port, 22 as for the PyEZ sessions.
+    connect_timeout : float, optional
+        Seconds allowed for the SSH and NETCONF handshake, unless a policy is installed with
+        `timeouts.set_timeout_policy`.
+    rpc_timeout : float, optional
+        Seconds allowed for one RPC, as the PyEZ Device timeout, unless a policy is installed.
+    known_hosts : optional
+        Passed to asyncssh.connect, None does not check host keys (as PyEZ with the default ssh config).
+    """
+
+    def __init__(self, max_devices=256, per_device=1, port=22, connect_timeout=30, rpc_timeout=300,
+                 known_hosts=None):
+        if asyncssh is None:
+            raise ImportError('the asyncio collector requires asyncssh, install svc-juniper-lib[asyncio]')
+        self.max_devices = max_devices
+        self.per_device = per_device
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.rpc_timeout = rpc_timeout
+        self.known_hosts = known_hosts
+        self._loop = None
+        self._thread = None
+        self._devices = None
+        self._idle = {}
+        self._limits = {}
+
+    def start(self):
+        """Start the event loop thread."""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='svc-juniper-aio', daemon=True)
+        self._thread.start()
+        self._call(self._start())
+
+    async def _start(self):
+        # created on the loop they are used on
+        self._devices = asyncio.Semaphore(self.max_devices)
+
+    def close(self):
+        """Close every session and stop the event loop thread."""
+        if self._loop is None:
+            return
+        self._call(self._close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    async def _close(self):
+        sessions = [session for idle in self._idle.values() for session in idle]
+        self._idle = {}
+        await asyncio.gather(*[session.close() for session in sessions], return_exceptions=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _call(self, coroutine):
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('AsyncCollector methods block, await the coroutines on the collector loop instead')
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _open(self, fqdn, username, password):
+        start = time.perf_counter()
+        with timeouts.budget(fqdn, timeouts.CONNECT, self.connect_timeout) as connect_timeout:
+            session = await asyncio.wait_for(
+                NetconfSession.open(fqdn, username, password, self.port, self.known_hosts), connect_timeout)
+        metrics.record(fqdn, 'Device', 'connect', time.perf_counter() - start)
+        return session
+
+    async def _rpc(self, fqdn, username, password, request, name):
+        """Send one RPC on an idle or new session of the device, within the per-device limit."""
+        key = (fqdn, username)
+        if key not in self._limits:
+            self._limits[key] = asyncio.Semaphore(self.per_device)
+            self._idle[key] = []
+        async with self._limits[key]:
+            for attempt in range(2):
+                reused = bool(self._idle[key])
+                session = self._idle[key].pop() if reused else await self._open(fqdn, username, password)
+                try:
+                    with timeouts.budget(fqdn, name, self.rpc_timeout) as rpc_timeout:
+                        reply = await asyncio.wait_for(session.rpc(request), rpc_timeout)
+                except RpcError:
+                    self._idle[key].append(session)
+                    raise
+                except timeouts.DeviceDeferred:
+                    await session.close()
+                    raise
+                except (OSError, EOFError, asyncio.IncompleteReadError, asyncssh.Error, asyncio.TimeoutError):
+                    await session.close()
+                    # a kept session the device closed meanwhile is replaced once
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                self._idle[key].append(session)
+                return reply
+
+    async def _fetch_table(self, fqdn, username, password, table):
+        table, kvargs = table if isinstance(table, tuple) else (table, {})
+        request = rpc_request((table, kvargs))
+        start = time.perf_counter()
+        try:
+            reply = await self._rpc(fqdn, username, password, request, table.__name__)
+        except RpcError as error:
+            # as sessions.fetch_table: a named item that is not configured is answered with an error
+            if kvargs and 'not found' in str(error):
+                return None
+            raise
+        fetched = table(xml=reply)
+        metrics.record(fqdn, table.__name__, 'rpc', time.perf_counter() - start,
+                       reply_bytes=len(etree.tostring(reply)), items=len(fetched))
+        return fetched
+
+    async def fetch_tables(self, fqdn, username, password, tables):
+        """Coroutine fetching tables from one device, on the collector loop. See `get_tables`."""
+        async with self._devices:
+            return list(await asyncio.gather(*[self._fetch_table(fqdn, username, password, table)
+                                               for table in tables]))
+
+    def get_tables(self, fqdn, username, password, tables):
+        """Fetch tables from one device and return them in the order requested, blocking the calling thread.
+
+        Parameters
+        ----------
+        fqdn : str
+            Hostname or IP of the device.
+        username : str
+            Username for device authentication.
+        password : str
+            Password for device authentication.
+        tables : list
+            PyEZ table classes or (table class, get() arguments) pairs, see `sessions.fetch_table`.
+
+        Returns
+        -------
+        list
+            Tables bound to their replies, None for a named item missing on the device.
+        """
+        return self._call(self.fetch_tables(fqdn, username, password, tables))
+
+    def collect(self, requests):
+        """Fetch tables from many devices concurrently.
+
+        Parameters
+        ----------
+        requests : list[tuple]
+            (fqdn, username, password, tables) per device, see `get_tables`.
+
+        Returns
+        -------
+        list
+            The fetched tables of every request in order, or the exception that stopped it.
+        """
+        async def collect():
+            return await asyncio.gather(*[self.fetch_tables(*request) for request in requests],
+                                        return_exceptions=True)
+        return self._call(collect())
@@ -0,0 +1,171 @@
+"""
+Columnar (NumPy) transforms for very large MX interface and route tables
+
+Each transform returns the same dictionary as the per-item transform in `juniper` together with the
+table as NumPy columns, ready for `pandas.DataFrame(columns)` or other vectorized analytics.
+Building the arrays from PyEZ items costs about as much as the per-item loops themselves
+(see benchmarks/columnar_transforms.py), so use this mode for the columnar output rather than for speed.
+"""
+try:
+    import numpy as np
+except ImportError:  # optional dependency: pip install svc-juniper-lib[columnar]
+    np = None
+
+# chassis hardware descriptions matched to netbox tags
+SMF_OPTICS = ['SFP+-10G-LR', 'SFP-LX10', 'QSFP+-40G-LR4', 'XFP-10G-LR']
+MMF_OPTICS = ['SFP+-10G-SR', 'SFP-SX']
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('the columnar transforms require numpy, install svc-juniper-lib[columnar]')
+
+
+def _strings(values):
+    """Return a NumPy unicode array, None values become ''."""
+    return np.array(['' if value is None else value for value in values], dtype=str)
+
+
+def _objects(values):
+    """Return a NumPy object array without letting NumPy nest list values."""
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _remove(values, substring):
+    """Vectorized `value.replace(substring, '')` (np.char.replace rejects empty arrays)."""
+    return np.char.replace(values, substring, '') if len(values) else values
+
+
+def _contains(names, *substrings):
+    """Vectorized `any(s in name for s in substrings)`."""
+    mask = np.zeros(len(names), dtype=bool)
+    for substring in substrings:
+        mask |= np.char.find(names, substring) >= 0
+    return mask
+
+
+def _lookup(keys, values, wanted):
+    """Sort-merge join: return (matched mask, values) of `wanted` looked up in `keys`. Later duplicate keys win."""
+    if len(keys) == 0 or len(wanted) == 0:
+        return np.zeros(len(wanted), dtype=bool), values[:0]
+    # reverse so np.unique keeps the last occurrence of every key
+    unique_keys, first = np.unique(keys[::-1], return_index=True)
+    unique_values = values[::-1][first]
+    index = np.minimum(np.searchsorted(unique_keys, wanted), len(unique_keys) - 1)
+    matched = unique_keys[index] == wanted
+    return matched, unique_values[index[matched]]
+
+
+def mx_interface_vlans(ports):
+    """Columnar equivalent of the MX subinterface VLAN transform.
+
+    Parameters
+    ----------
+    ports : list[tuple]
+        MXLogicalTable items.
+
+    Returns
+    -------
+    tuple[dict[int, str], dict[str, numpy.ndarray]]
+        The VLAN ID -> description mapping returned by juniper_get_mx_interface_vlans_dictionary and the
+        columns 'interface', 'vlan' and 'description'.
+    """
+    _require_numpy()
+    names = _strings([key for key, value in ports])
+    descriptions = _objects([value[0][1] for key, value in ports])
+    if not len(names):
+        return {}, {'interface': names, 'vlan': np.array([], dtype=np.int64), 'description': descriptions}
+
+    parts = np.char.partition(names, '.')
+    media = _contains(parts[:, 0], 'xe', 'ge', 'ae', 'ms')
+    interfaces, units, descriptions = parts[media, 0], parts[media, 2], descriptions[media]
+
+    vlans = units.astype(np.int64)
+    in_range = (vlans > 1) & (vlans < 4095)
+    interfaces, vlans, descriptions = interfaces[in_range], vlans[in_range], descriptions[in_range]
+    descriptions[~descriptions.astype(bool)] = 'None'
+
+    results = dict(zip(vlans.tolist(), descriptions.tolist()))
+    return results, {'interface': interfaces, 'vlan': vlans, 'description': descriptions}
+
+
+def mx_interfaces(ports, sfp):
+    """Columnar equivalent of the MX interface/optics join.
+
+    Parameters
+    ----------
+    ports : list[tuple]
+        MXPhysicalTable (or MXPhysicalBriefTable) items.
+    sfp : list[tuple]
+        MXChassisHardware items.
+
+    Returns
+    -------
+    tuple[dict[str, dict], dict[str, numpy.ndarray]]
+        The interface dictionary returned by juniper_get_mx_interfaces and the columns 'interface',
+        'description', 'speed', 'type' and 'optic' (chassis hardware description or None).
+    """
+    _require_numpy()
+    names = _strings([key for key, value in ports])
+    descriptions = _objects([value[0][1] or '' for key, value in ports])
+    speeds = _objects([value[1][1] for key, value in ports])
+
+    # change 1000mbps to 1Gbps to match Netbox tag
+    speeds[(speeds == '1000mbps') | (speeds == '1000 Mbps')] = '1Gbps'
+    types = _objects(np.where(_contains(names, 'ae'), 'lag', np.where(_contains(names, 'ge'), 'copper', 'No SFP')))
+
+    # construct interface names from fpc, pic, port and sfp description
+    optics = _strings([value[1][1] for key, value in sfp])
+    fpc = _remove(_strings([value[4][1] for key, value in sfp]), 'FPC ')
+    pic = _remove(_strings([value[2][1] for key, value in sfp]), 'PIC ')
+    port = _remove(_strings([key for key, value in sfp]), 'Xcvr ')
+    media = np.where(_contains(optics, '40G') | _contains(optics, '100G'), 'et-',
+                     np.where(_contains(optics, '10G'), 'xe-', 'ge-'))
+    sfp_names = np.char.add(np.char.add(np.char.add(np.char.add(np.char.add(media, fpc), '/'), pic), '/'), port)
+    sfp_types = np.where(np.isin(optics, SMF_OPTICS), 'SMF', np.where(np.isin(optics, MMF_OPTICS), 'MMF', 'copper'))
+
+    # join optics to ports on the constructed interface name
+    matched, joined_types = _lookup(sfp_names, sfp_types, names)
+    matched, joined_optics = _lookup(sfp_names, optics, names)
+    port_optics = _objects([None] * len(names))
+    types[matched] = joined_types
+    port_optics[matched] = joined_optics
+
+    results = dict((name, {'description': description, 'speed': speed, 'type': port_type})
+                   for name, description, speed, port_type in zip(names.tolist(), descriptions.tolist(),
+                                                                   speeds.tolist(), types.tolist()))
+    return results, {'interface': names, 'description': descriptions, 'speed': speeds, 'type': types,
+                     'optic': port_optics}
+
+
+def mx_ipv4_public_routes(routes, descriptions):
+    """Columnar equivalent of the public route to interface description join.
+
+    Parameters
+    ----------
+    routes : list[tuple]
+        Site public route table items.
+    descriptions : dict[str, str]
+        Logical interface name -> description.
+
+    Returns
+    -------
+    tuple[dict[str, str], dict[str, numpy.ndarray]]
+        The route -> description mapping returned by juniper_get_mx_ipv4_public_routes and the columns
+        'route', 'interface' and 'description'.
+    """
+    _require_numpy()
+    keys = _strings([key for key, value in routes])
+    # routes with several next hops return a list of interfaces and never match
+    via = _strings([None if isinstance(value[2][1], list) else value[2][1] for key, value in routes])
+    direct = np.array([value[3][1] is None and value[4][1] is None for key, value in routes], dtype=bool)
+
+    names = _strings(list(descriptions))
+    matched, joined = _lookup(names, _objects(list(descriptions.values())), via)
+    selected = matched & direct
+    keys, via, joined = keys[selected], via[selected], joined[direct[matched]]
+
+    results = dict(zip(keys.tolist(), joined.tolist()))
+    return results, {'route': keys, 'interface': via, 'description': joined}
@@ -0,0 +1,190 @@
+"""
+Device facts (model, version, serial) captured once per device and kept in a TTL cache
+"""
+import json
+import os
+import threading
+import time
+
+from . import sessions
+
+# facts cache: fqdn -> facts dict, optionally persisted to a JSON file
+_cache = {}
+_cache_path = None
+_ttl = 24 * 60 * 60
+_lock = threading.Lock()
+
+# age up to which facts are recent: the juniper functions capture facts older than this on the sessions they have
+# open, and the platform version syncs accept nothing older (an upgrade reboots the device, so facts read on a
+# session of the same run still hold the running version)
+RECENT = 15 * 60
+
+
+def set_facts_cache(path=None, ttl=24 * 60 * 60):
+    """Configure how long device facts are reused and where they are persisted.
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the facts are loaded from and written back to, so later processes skip the fact RPCs.
+        None keeps the cache in memory only.
+    ttl : int or float, optional
+        Seconds a cached entry is served before the device is asked again. Defaults to one day.
+
+    Returns
+    -------
+    None
+    """
+    global _cache_path, _ttl
+    with _lock:
+        _cache_path = path
+        _ttl = ttl
+        _cache.clear()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                _cache.update(json.load(f))
+
+
+def clear_facts_cache(fqdn=None):
+    """Forget the cached facts of one device, or of every device when `fqdn` is None."""
+    with _lock:
+        if fqdn is None:
+            _cache.clear()
+        else:
+            _cache.pop(fqdn, None)
+        _save()
+
+
+def _save():
+    # called with _lock held, the temporary file is per process as workers share the cache file
+    if _cache_path is None:
+        return
+    temp_path = '%s.%d.tmp' % (_cache_path, os.getpid())
+    with open(temp_path, 'w') as f:
+        json.dump(_cache, f, indent=2, sort_keys=True)
+    os.replace(temp_path, _cache_path)
+
+
+def read_facts(dev, serial=False):
+    """Read hostname, model, version and optionally the serial number of a device on an open session.
+
+    The PyEZ facts are not used: any of them pulls in the routing engine facts (several RPCs) and the serial number
+    a full get-chassis-inventory. This runs get-software-information only, the RPC the model specific version
+    functions run, and get-chassis-inventory when `serial` is asked for.
+
+    Parameters
+    ----------
+    dev : jnpr.junos.Device
+        Open device session.
+    serial : bool, optional
+        Also read the chassis serial number.
+
+    Returns
+    -------
+    dict
+        Dictionary with 'hostname', 'model', 'version', 'timestamp' (epoch seconds) and, with `serial`, 'serial'.
+    """
+    reply = dev.rpc.get_software_information()
+    # a virtual chassis answers with multi-routing-engine-results, the first member is the master
+    if reply.tag != 'software-information':
+        reply = reply.find('.//software-information')
+    version = reply.findtext('junos-version')
+    if version is None:
+        # EX2200 (Junos 12.3) reports the version in brackets in the package comments, e.g. 'JUNOS EX Software
+        # Suite [12.3R12.4]', as juniper_get_ex2200_version reads it
+        comment = reply.findtext('package-information/comment', '')
+        version = comment[comment.find('[') + 1:comment.find(']')]
+    facts = {'hostname': reply.findtext('host-name'), 'model': reply.findtext('product-model'),
+             'version': version.strip(), 'timestamp': time.time()}
+    if serial:
+        facts['serial'] = dev.rpc.get_chassis_inventory().findtext('.//chassis/serial-number')
+    return facts
+
+
+def remember(fqdn, dev, serial=False):
+    """Capture the facts of an already open session into the cache and return them.
+
+    Parameters
+    ----------
+    fqdn : str
+        Cache key for the device, the name the session was opened with.
+    dev : jnpr.junos.Device
+        Open device session.
+    serial : bool, optional
+        Also read the chassis serial number, see `read_facts`.
+
+    Returns
+    -------
+    dict
+        The device facts, see `read_facts`.
+    """
+    facts = read_facts(dev, serial)
+    with _lock:
+        _cache[fqdn] = facts
+        _save()
+    return facts
+
+
+def capture(fqdn, dev):
+    """Remember the facts of an open session unless the cached ones are younger than `RECENT`.
+
+    Called by the juniper functions on the sessions they fetch tables on, so the platform version syncs of the same
+    run find recent facts without opening a session of their own. The serial number is not read, a caller asking for
+    it reads it on its miss.
+
+    Parameters
+    ----------
+    fqdn : str
+        Cache key for the device, the name the session was opened with.
+    dev : jnpr.junos.Device
+        Open device session.
+    """
+    with _lock:
+        facts = _cache.get(fqdn)
+    if facts is None or time.time() - facts['timestamp'] >= RECENT:
+        remember(fqdn, dev)
+
+
+def get_facts(fqdn, username, password, refresh=False, dev=None, serial=False, max_age=None):
+    """Return the facts of a device, from the cache while they are younger than the TTL (and `max_age`).
+
+    Parameters
+    ----------
+    fqdn : str
+        Hostname or IP of the device.
+    username : str
+        Username for device authentication.
+    password : str
+        Password for device authentication.
+    refresh : bool, optional
+        Ignore the cached entry and read the facts from the device.
+    dev : jnpr.junos.Device, optional
+        Open session to read the facts from on a cache miss instead of opening a new one.
+    serial : bool, optional
+        Include the serial number, a cached entry without it is a miss.
+    max_age : int or float, optional
+        Seconds a cached entry may be old for this call when less than the TTL, e.g. `RECENT`.
+
+    Returns
+    -------
+    dict
+        Dictionary with 'hostname', 'model', 'version', 'timestamp' and, with `serial`, 'serial'.
+    """
+    ttl = _ttl if max_age is None else min(_ttl, max_age)
+    with _lock:
+        facts = _cache.get(fqdn)
+    if (facts is not None and not refresh and time.time() - facts['timestamp'] < ttl
+            and (not serial or 'serial' in facts)):
+        return facts
+
+    if dev is not None:
+        return remember(fqdn, dev, serial)
+    pool = sessions.get_session_pool()
+    if pool is not None:
+        with pool.session(fqdn, username, password) as dev:
+            return remember(fqdn, dev, serial)
+    dev = sessions.open_device(fqdn, username, password)
+    try:
+        return remember(fqdn, dev, serial)
+    finally:
+        dev.close()
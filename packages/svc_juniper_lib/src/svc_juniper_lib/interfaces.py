@@ -0,0 +1,126 @@
+"""
+Parsed Junos interface names, so ports are classified and joined to the chassis inventory (optics) by their
+(media, fpc, pic, port, unit) fields instead of substring checks and rebuilt name strings
+
+    >>> interfaces.parse('xe-0/1/2.100')
+    ('xe', 0, 1, 2, 100)
+    >>> interfaces.parse('ae12')
+    ('ae', None, None, 12, None)
+
+Parsed names are cached, the same names repeat on every device of a model.
+"""
+import functools
+import re
+import sys
+
+# ge-0/0/1, xe-1/2/3.100, et-0/0/48
+_SLOTTED = re.compile(r'([a-z]+)-(\d+)/(\d+)/(\d+)(?:\.(\d+))?$')
+# ae12, em0, lo0.0
+_NUMBERED = re.compile(r'([a-z]+)(\d+)(?:\.(\d+))?$')
+
+
+@functools.lru_cache(maxsize=65536)
+def parse(name):
+    """Parse an interface name into (media, fpc, pic, port, unit).
+
+    Parameters
+    ----------
+    name : str
+        Interface name, e.g. 'xe-0/1/2', 'ge-1/0/0.100', 'ae12' or 'em0'.
+
+    Returns
+    -------
+    tuple or None
+        (media, fpc, pic, port, unit) with integer fields, fpc and pic are None for numbered interfaces ('ae12') and
+        unit for physical ones. None for names of another form (channelized 'xe-0/0/0:1', 'irb', 'vme').
+    """
+    match = _SLOTTED.match(name)
+    if match is not None:
+        media, fpc, pic, port, unit = match.groups()
+        return (sys.intern(media), int(fpc), int(pic), int(port), None if unit is None else int(unit))
+    match = _NUMBERED.match(name)
+    if match is not None:
+        media, port, unit = match.groups()
+        return (sys.intern(media), None, None, int(port), None if unit is None else int(unit))
+    return None
+
+
+@functools.lru_cache(maxsize=65536)
+def media(name):
+    """Return the media of an interface name ('ge', 'xe', 'ae', 'em', ...), None if it does not parse."""
+    parsed = parse(name)
+    return None if parsed is None else parsed[0]
+
+
+@functools.lru_cache(maxsize=1024)
+def number(text):
+    """Return the number of a chassis inventory name ('FPC 0', 'PIC 1', 'Xcvr 3'), None if it has none."""
+    if text is None:
+        return None
+    _, _, digits = text.rpartition(' ')
+    return int(digits) if digits.isdigit() else None
+
+
+@functools.lru_cache(maxsize=1024)
+def optic_media(description):
+    """Return the media of the ports an optic fits: 'et' for 40G and 100G optics (QSFP), 'xe' for other 10G
+    optics, 'ge' for any other."""
+    if '40G' in description or '100G' in description:
+        return 'et'
+    return 'xe' if '10G' in description else 'ge'
+
+
+def optic_key(description, fpc, pic, xcvr):
+    """Return the (media, fpc, pic, port) key of the port an optic sits in.
+
+    Parameters
+    ----------
+    description : str
+        Chassis inventory description of the optic, e.g. 'SFP+-10G-LR', see `optic_media`.
+    fpc, pic, xcvr : str
+        Chassis inventory names of the FPC, PIC and transceiver, e.g. 'FPC 0', 'PIC 1', 'Xcvr 3'.
+
+    Returns
+    -------
+    tuple
+    """
+    return (optic_media(description), number(fpc), number(pic), number(xcvr))
+
+
+def port_index(names):
+    """Return {(media, fpc, pic, port): name} for the physical FPC/PIC/port names among `names`."""
+    index = {}
+    for name in names:
+        parsed = parse(name)
+        if parsed is not None and parsed[1] is not None and parsed[4] is None:
+            index[parsed[:4]] = name
+    return index
+
+
+def join_optics(names, optics):
+    """Join chassis inventory optics to port names with one hash join.
+
+    Parameters
+    ----------
+    names : iterable[str]
+        Port names, e.g. the keys of an interface dictionary.
+    optics : iterable[tuple]
+        (description, fpc, pic, xcvr) of every optic, see `optic_key`.
+
+    Returns
+    -------
+    tuple[list, list]
+        (port name, description) for every optic in a port of `names`, and the optics without one, as given.
+    """
+    index = port_index(names)
+    matched = []
+    unmatched = []
+    for optic in optics:
+        description, fpc, pic, xcvr = optic
+        # optic_key, inlined
+        name = index.get((optic_media(description), number(fpc), number(pic), number(xcvr)))
+        if name is None:
+            unmatched.append(optic)
+        else:
+            matched.append((name, optic[0]))
+    return matched, unmatched
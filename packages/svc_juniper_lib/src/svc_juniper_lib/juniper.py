@@ -1,11 +1,27 @@
-from jnpr.junos import Device
+import logging
+from contextlib import contextmanager
+
+from . import aio
+from . import columnar as columnar_transforms
+from . import facts as device_facts
+from . import interfaces
+from . import metrics
+from . import offload
+from . import parsers
+from . import sessions
 
 from .junos_mx_routing_instance import MXRouteInstance
+from .junos_mx_routing_instance import MXRouteInstanceConfigTable
 from .junos_mx_port_descriptions import MXPhysicalTable
 from .junos_mx_port_descriptions import MXLogicalTable
+from .junos_mx_port_descriptions import MXPhysicalBriefTable
+from .junos_mx_port_descriptions import MXLogicalTerseTable
+from .junos_mx_port_descriptions import MXLogicalDescriptionTable
 from .junos_mx_chassis_hardware_sfp import MXChassisHardware
 from .junos_qfx_vlan import QFXVlanTable
+from .junos_qfx_vlan import QFXVlanConfigTable
 from .junos_qfx_ex_port_descriptions import QFXEXPhysicalTable
+from .junos_qfx_ex_port_descriptions import QFXEXPhysicalBriefTable
 from .junos_qfx_ex_chassis_hardware_sfp import QFXEXChassisHardware
 from .junos_mx_svc_public_routes import br1svcat1corpequinixcom
 from .junos_mx_svc_public_routes import br1svcch3corpequinixcom
@@ -30,12 +46,165 @@ from .junos_qfx_version import QFXVersion
 from .junos_ex2200_version import EX2200Version
 from .junos_ex3400_version import EX3400Version
 
+logger = logging.getLogger(__name__)
+
+# site specific route tables for the SVC public IP space
+_PUBLIC_ROUTE_TABLES = {
+    'at1': br1svcat1corpequinixcom,
+    'ch3': br1svcch3corpequinixcom,
+    'da6': br1svcda6corpequinixcom,
+    'dc6': br1svcdc6corpequinixcom,
+    'la3': br1svcla3corpequinixcom,
+    'mi1': br1svcmi1corpequinixcom,
+    'ny5': br1svcny5corpequinixcom,
+    'se3': br1svcse3corpequinixcom,
+    'sv5': br1svcsv5corpequinixcom,
+    'am3': svcbr1am3corpeuequinixcom,
+    'fr4': svcbr1fr4corpeuequinixcom,
+    'ld5': svcbr1ld5corpeuequinixcom,
+    'hk2': br1svchk2apequinixcom,
+    'os1': br1svcos1apequinixcom,
+    'sg2': br1svcsg2apequinixcom,
+    'sy4': br1svcsy4apequinixcom,
+    'ty4': br1svcty4apequinixcom,
+    'tr2': br1svctr2corpequinixcom,
+}
+
+# chassis hardware descriptions matched to netbox tags, the MX also carries XFP optics
+_SMF_OPTICS = frozenset(['SFP+-10G-LR', 'SFP-LX10', 'QSFP+-40G-LR4'])
+_MX_SMF_OPTICS = _SMF_OPTICS | frozenset(['XFP-10G-LR'])
+_MMF_OPTICS = frozenset(['SFP+-10G-SR', 'SFP-SX'])
+
+
+# Open a netconf session to a juniper device, recording the time spent on the SSH/NETCONF handshake
+@contextmanager
+def _device(fqdn, username, password):
+    """Open a NETCONF session to a Juniper device and close it on exit.
+
+    Parameters
+    ----------
+    fqdn : str
+        Hostname or IP of the device.
+    username : str
+        Username for device authentication.
+    password : str
+        Password for device authentication.
+
+    Yields
+    ------
+    jnpr.junos.Device
+        The open device session.
+    """
+    dev = sessions.open_device(fqdn, username, password)
+    try:
+        yield dev
+    except Exception:
+        # a session whose RPC timed out is still busy with it, closing it must not hide the original error
+        try:
+            dev.close()
+        except Exception:
+            pass
+        raise
+    dev.close()
+
+
+# Fetch one or more tables from a juniper device, serially on one session, concurrently on a session pool or
+# through the asyncio collector
+def _get_tables(fqdn, username, password, tables, parallel=False):
+    """Fetch PyEZ tables from one device and return them in the order requested.
+
+    A table is a table class or a (table class, get() arguments) pair, see `sessions.fetch_table`. With a collector
+    installed with `aio.set_collector` the tables are fetched through it, otherwise sessions are borrowed from the
+    pool installed with `sessions.set_session_pool`, if any.
+    """
+    collector = aio.get_collector()
+    if collector is not None:
+        return collector.get_tables(fqdn, username, password, tables)
+    if parallel:
+        return sessions.get_tables(fqdn, username, password, tables, sessions.get_session_pool())
+    with _session(fqdn, username, password) as dev:
+        fetched = [sessions.fetch_table(dev, table) for table in tables]
+        # the session is open already, keep the facts for the platform version syncs (see facts.capture)
+        device_facts.capture(fqdn, dev)
+        return fetched
+
+
+# Borrow a session from the installed pool, or open one for the duration of the block
+@contextmanager
+def _session(fqdn, username, password):
+    """Yield an open session to `fqdn`, from the pool installed with `sessions.set_session_pool` if any."""
+    pool = sessions.get_session_pool()
+    if pool is not None:
+        with pool.session(fqdn, username, password) as dev:
+            yield dev
+    else:
+        with _device(fqdn, username, password) as dev:
+            yield dev
+
+
+def _fetch_groups(fqdn, username, password, groups, parallel=False):
+    """Fetch lists of tables from one device (see `_get_tables`) and return the fetched tables grouped the same way."""
+    fetched = iter(_get_tables(fqdn, username, password, [table for group in groups for table in group], parallel))
+    return [[next(fetched) for table in group] for group in groups]
+
+
+def _named(table, names, args_key):
+    """Return (table, get() arguments) pairs fetching only the named items of a table, one RPC per name."""
+    return [(table, {args_key: name}) for name in names]
+
+
+def _items(tables, engine='pyez'):
+    """Return the items of several fetched tables as one list, skipping named items missing on the device."""
+    return [item for table in tables if table is not None for item in parsers.table_items(table, engine)]
+
+
+def _logical_tables(filtered, names=None):
+    """Return the MX logical interface tables to fetch, one list per table (see `_logical_items`).
+
+    With names only those units are requested, one RPC per name and table.
+    """
+    tables = [MXLogicalTerseTable, MXLogicalDescriptionTable] if filtered else [MXLogicalTable]
+    if names is None:
+        return [[table] for table in tables]
+    return [_named(table, names, 'interface_name') for table in tables]
+
+
+def _logical_items(ports, descriptions=None, engine='pyez'):
+    """Return MXLogicalTable style items, merging MXLogicalTerseTable names with MXLogicalDescriptionTable when filtered."""
+    return _merge_logical(_items(ports, engine), None if descriptions is None else _items(descriptions, engine))
+
+
+def _merge_logical(ports, descriptions=None):
+    """Merge MXLogicalTerseTable items with MXLogicalDescriptionTable items into MXLogicalTable style items."""
+    if descriptions is None:
+        return ports
+    description = dict(descriptions)
+    return [(key, description.get(key, [('description', None)])) for key, value in ports]
+
+
+# Run a transform on the items of fetched tables, in the parse pool when one is installed (see offload.py)
+def _transform(fqdn, function, transform, groups, engine, *args):
+    """Return transform(items of each group of tables, *args), timed as the transform step of `function`."""
+    pool = offload.get_parse_pool()
+    with metrics.timer(fqdn, function, 'transform'):
+        if pool is None:
+            return transform(*[_items(group, engine) for group in groups], *args)
+        packed = [[offload.pack(table) for table in group] for group in groups]
+        return pool.submit(_transform_packed, transform.__name__, packed, engine, args).result()
+
+
+def _transform_packed(transform, packed, engine, args):
+    """Worker process side of `_transform`: rebuild the tables from their replies and run the named transform."""
+    groups = [[offload.unpack(table, globals()) for table in group] for group in packed]
+    return globals()[transform](*[_items(group, engine) for group in groups], *args)
+
 
 # Juniper MX only: The purpose of this function is to return a dictionary of subinterfaces/vlans (key) and description
 # (value) configured on the MX
 # EXAMPLE: {2001: 'SVC: THOUSANDEYES AWS IPV4', 2002: 'SVC: THOUSANDEYES AZURE PRIMARY',
 # 2107: 'POC: CISCO VIRTUAL LAB BD-5'}
-def juniper_get_mx_interface_vlans_dictionary(fqdn, username, password):
+def juniper_get_mx_interface_vlans_dictionary(fqdn, username, password, filtered=False, columnar=False,
+                                              engine='pyez', vlan_ids=None):
     """Return a mapping of MX subinterface VLAN IDs to their configured descriptions.
 
     Parameters
@@ -46,6 +215,14 @@ def juniper_get_mx_interface_vlans_dictionary(fqdn, username, password):
         Username for device authentication.
     password : str
         Password for device authentication.
+    filtered : bool, optional
+        Request only unit names and descriptions ('terse' and 'descriptions') instead of the full logical interfaces.
+    columnar : bool, optional
+        Run the vectorized NumPy transform and return (results, columns), see `columnar.mx_interface_vlans`.
+    engine : str or dict, optional
+        Parsing engine for the RPC replies, 'pyez' or 'lxml' (see `parsers.table_items`).
+    vlan_ids : list[int], optional
+        Request only the subinterfaces of these VLAN IDs (unit number on any physical interface), one RPC per VLAN.
 
     Returns
     -------
@@ -53,14 +230,26 @@ def juniper_get_mx_interface_vlans_dictionary(fqdn, username, password):
         Mapping of VLAN ID to description. If an interface has no description the value will be 'None'.
     """
     # Netconf session to a juniper device
-    with Device(host=fqdn, user=username, password=password, port='22', timeout=300) as dev:
-        ports = MXLogicalTable(dev)
-        ports.get()
+    names = None if vlan_ids is None else ['[axml][eso]*.%d' % int(vlan_id) for vlan_id in vlan_ids]
+    ports = _fetch_groups(fqdn, username, password, _logical_tables(filtered, names))
+
+    if columnar:
+        with metrics.timer(fqdn, 'juniper_get_mx_interface_vlans_dictionary', 'transform'):
+            return columnar_transforms.mx_interface_vlans(_logical_items(*ports, engine=engine))
+    return _transform(fqdn, 'juniper_get_mx_interface_vlans_dictionary', _logical_vlans, ports, engine)
+
 
+def _logical_vlans(ports, descriptions=None):
+    """Transform logical interface items (see `_merge_logical`) into a mapping of VLAN ID to description."""
+    return _mx_interface_vlans(_merge_logical(ports, descriptions))
+
+
+def _mx_interface_vlans(ports):
+    """Transform MXLogicalTable items into a mapping of VLAN ID to description."""
     # create a dictionary of subinterfaces/vlans (key) and the description (value)
     results = {}
 
-    for key, value in ports.items():
+    for key, value in ports:
         subinterface = key.split('.')
 
         if 'xe' in subinterface[0] or 'ge' in subinterface[0] or 'ae' in subinterface[0] or 'ms' in subinterface[0]:
@@ -77,7 +266,7 @@ def juniper_get_mx_interface_vlans_dictionary(fqdn, username, password):
 # configured on the QFX
 # EXAMPLE: {3047: 'BILL_BLAKE_DEMO_3047', 3048: 'BILL_BLAKE_DEMO_3048', 3049: 'BILL_BLAKE_DEMO_3049',
 # 3051: 'BILL_BLAKE_DEMO_3051'}
-def juniper_get_qfx_vlans_dictionary(fqdn, username, password):
+def juniper_get_qfx_vlans_dictionary(fqdn, username, password, filtered=False, engine='pyez', vlan_ids=None):
     """Return a mapping of VLAN IDs to configured VLAN names on a QFX device.
 
     Parameters
@@ -88,6 +277,13 @@ def juniper_get_qfx_vlans_dictionary(fqdn, username, password):
         Username for device authentication.
     password : str
         Password for device authentication.
+    filtered : bool, optional
+        Read the VLANs from the configuration (get-configuration with a vlans filter subtree) instead of
+        get-vlan-information. VLANs configured without a vlan-id are skipped.
+    engine : str or dict, optional
+        Parsing engine for the RPC replies, 'pyez' or 'lxml' (see `parsers.table_items`).
+    vlan_ids : list[int], optional
+        Return only these VLAN IDs. Junos selects VLANs by name, not tag, so every VLAN is still requested.
 
     Returns
     -------
@@ -95,14 +291,30 @@ def juniper_get_qfx_vlans_dictionary(fqdn, username, password):
         Mapping of VLAN tag (int) to VLAN name (str).
     """
     # Netconf session to a juniper device
-    with Device(host=fqdn, user=username, password=password, port='22', timeout=300) as dev:
-        vlans = QFXVlanTable(dev)
-        vlans.get()
+    vlans, = _get_tables(fqdn, username, password, [QFXVlanConfigTable if filtered else QFXVlanTable])
 
+    with metrics.timer(fqdn, 'juniper_get_qfx_vlans_dictionary', 'transform'):
+        if filtered:
+            results = _qfx_vlans(_vlan_config_items(vlans))
+        else:
+            results = _qfx_vlans(parsers.table_items(vlans, engine))
+        if vlan_ids is not None:
+            vlan_ids = set(int(vlan_id) for vlan_id in vlan_ids)
+            results = dict((key, value) for key, value in results.items() if key in vlan_ids)
+        return results
+
+
+def _vlan_config_items(vlans):
+    """Return QFXVlanTable style (tag, [('vlan_name', name)]) items from QFXVlanConfigTable."""
+    return [(value[0][1], [('vlan_name', key)]) for key, value in vlans.items() if value[0][1] is not None]
+
+
+def _qfx_vlans(vlans):
+    """Transform QFXVlanTable items into a mapping of VLAN tag to VLAN name."""
     # create a dictionary of vlan tags (key) and vlan names (value)
     results = {}
 
-    for key, value in vlans.items():
+    for key, value in vlans:
         results.update({int(key): value[0][1]})
 
     return results
@@ -112,7 +324,8 @@ def juniper_get_qfx_vlans_dictionary(fqdn, username, password):
 # another dictionary (value) containing
 # the interface description, type of SFP and the SFP speed
 # EXAMPLE: {'ge-0/0/0': {'description': 'POC: LS5.SV5 0/1/1', 'speed': '1Gbps', 'type': 'SMF'}}
-def juniper_get_qfx_interfaces(fqdn, username, password):
+def juniper_get_qfx_interfaces(fqdn, username, password, parallel=False, filtered=False, engine='pyez',
+                               interface_names=None):
     """Return QFX interface metadata including description, speed, and fiber/copper type.
 
     Parameters
@@ -123,6 +336,15 @@ def juniper_get_qfx_interfaces(fqdn, username, password):
         Username for device authentication.
     password : str
         Password for device authentication.
+    parallel : bool, optional
+        Fetch the interface and chassis inventory tables concurrently on two NETCONF sessions.
+    filtered : bool, optional
+        Request the 'brief' interface output, which drops traffic statistics and address families from the reply.
+    engine : str or dict, optional
+        Parsing engine for the RPC replies, 'pyez' or 'lxml' (see `parsers.table_items`).
+    interface_names : list[str], optional
+        Request only these physical interfaces, one RPC per name. The chassis inventory is still read in full for
+        the optic types. Names not configured on the device are left out of the result.
 
     Returns
     -------
@@ -132,16 +354,21 @@ def juniper_get_qfx_interfaces(fqdn, username, password):
         - 'speed' (str) e.g. '1Gbps', '10Gbps' or 'None'
         - 'type' (str) one of 'SMF', 'MMF', 'copper', or 'lag'
     """
-    # Netconf session to a juniper device
-    with Device(host=fqdn, user=username, password=password, port='22', timeout=300) as dev:
-        phy_port = QFXEXPhysicalTable(dev)
-        sfp_info = QFXEXChassisHardware(dev)
-        phy_port.get()
-        sfp_info.get()
+    # Netconf session(s) to a juniper device
+    phy_port_table = QFXEXPhysicalBriefTable if filtered else QFXEXPhysicalTable
+    phy_ports = [phy_port_table]
+    if interface_names is not None:
+        phy_ports = _named(phy_port_table, interface_names, 'interface_name')
+    phy_port, sfp_info = _fetch_groups(fqdn, username, password, [phy_ports, [QFXEXChassisHardware]], parallel)
+
+    return _transform(fqdn, 'juniper_get_qfx_interfaces', _qfx_interfaces, [phy_port, sfp_info], engine)
+
 
+def _qfx_interfaces(phy_port, sfp_info):
+    """Join QFXEXPhysicalTable and QFXEXChassisHardware items into the QFX interface dictionary."""
     # create a dictionary of interface names with another dictionary with port description, sfp type and speed
     results = {}
-    for key, value in phy_port.items():
+    for key, value in phy_port:
         if value[0][1] == None:
             results.update({key: {'description': ''}})
         else:
@@ -157,38 +384,44 @@ def juniper_get_qfx_interfaces(fqdn, username, password):
             results[key]['speed'] = value[1][1]
 
         # for em interfaces set type to copper
-        if 'em' in key:
+        media = interfaces.media(key)
+        if media == 'em':
             results[key]['type'] = 'copper'
-        elif 'ae' in key:
+        elif media == 'ae':
             results[key]['type'] = 'lag'
-    for key, value in sfp_info.items():
-        # construct interface from fpc, pic, port and sfp description
-        if '10G' in value[1][1]:
-            type = 'xe-'
-        else:
-            type = 'ge-'
-        fpc = value[4][1].replace('FPC ', '')
-        pic = value[3][1].replace('PIC ', '')
-        port = key.replace('Xcvr ', '')
-
-        # match chassis hardware description to netbox tags
-        if int(port) < 48:
-            try:
-                if value[1][1] == 'SFP+-10G-LR' or value[1][1] == 'SFP-LX10' or value[1][1] == 'QSFP+-40G-LR4':
-                    results[type+fpc+'/'+pic+'/'+port]['type'] = 'SMF'
-                elif value[1][1] == 'SFP+-10G-SR' or value[1][1] == 'SFP-SX':
-                    results[type + fpc + '/' + pic + '/' + port]['type'] = 'MMF'
-                else:
-                    results[type + fpc + '/' + pic + '/' + port]['type'] = 'copper'
-            except:
-                pass
+
+    # match chassis hardware description to netbox tags, transceivers from 48 up (the uplinks) are left out
+    _optic_types(results, [(value[1][1], value[4][1], value[3][1], key) for key, value in sfp_info
+                           if interfaces.number(key) < 48], _SMF_OPTICS)
     return results
 
 
+def _optic_types(results, optics, smf_optics):
+    """Set the 'type' of the ports holding `optics` ((description, fpc, pic, xcvr) tuples, see
+    `interfaces.join_optics`) and log the optics without a port in `results`.
+
+    Only optics of a media `results` has ports of are logged, the 40G/100G optics of et- ports outside the
+    interface filter never join."""
+    matched, unmatched = interfaces.join_optics(results, optics)
+    for name, description in matched:
+        if description in smf_optics:
+            results[name]['type'] = 'SMF'
+        elif description in _MMF_OPTICS:
+            results[name]['type'] = 'MMF'
+        else:
+            results[name]['type'] = 'copper'
+    if unmatched:
+        collected = set(interfaces.media(name) for name in results)
+        unmatched = [optic for optic in unmatched if interfaces.optic_media(optic[0]) in collected]
+    if unmatched:
+        logger.warning('%d optics without a matching port, e.g. %s', len(unmatched), unmatched[:10])
+
+
 # Juniper MX only: The purpose of this function is to return a dictionary with the interface name (key) pointing to another dictionary (value) containing
 # the interface description, type of SFP and the SFP speed
 # EXAMPLE: {'ge-1/0/0': {'description': '', 'speed': '1Gbps', 'type': 'copper'},
-def juniper_get_mx_interfaces(fqdn, username, password):
+def juniper_get_mx_interfaces(fqdn, username, password, parallel=False, filtered=False, columnar=False, engine='pyez',
+                              interface_names=None):
     """Return MX interface metadata including description, speed, and fiber/copper type.
 
     Parameters
@@ -199,6 +432,17 @@ def juniper_get_mx_interfaces(fqdn, username, password):
         Username for device authentication.
     password : str
         Password for device authentication.
+    parallel : bool, optional
+        Fetch the interface and chassis inventory tables concurrently on two NETCONF sessions.
+    filtered : bool, optional
+        Request the 'brief' interface output, which drops traffic statistics and address families from the reply.
+    columnar : bool, optional
+        Run the vectorized NumPy transform and return (results, columns), see `columnar.mx_interfaces`.
+    engine : str or dict, optional
+        Parsing engine for the RPC replies, 'pyez' or 'lxml' (see `parsers.table_items`).
+    interface_names : list[str], optional
+        Request only these physical interfaces, one RPC per name. The chassis inventory is still read in full for
+        the optic types. Names not configured on the device are left out of the result.
 
     Returns
     -------
@@ -208,15 +452,22 @@ def juniper_get_mx_interfaces(fqdn, username, password):
         - 'speed' (str)
         - 'type' (str) one of 'SMF', 'MMF', 'copper', 'lag', or 'No SFP'
     """
-    # Netconf session to a juniper device
-    with Device(host=fqdn, user=username, password=password, port='22',timeout=300) as dev:
-        ports = MXPhysicalTable(dev)
-        sfp = MXChassisHardware(dev)
-        ports.get()
-        sfp.get()
+    # Netconf session(s) to a juniper device
+    ports_table = MXPhysicalBriefTable if filtered else MXPhysicalTable
+    port_tables = [ports_table] if interface_names is None else _named(ports_table, interface_names, 'interface_name')
+    ports, sfp = _fetch_groups(fqdn, username, password, [port_tables, [MXChassisHardware]], parallel)
+
+    if columnar:
+        with metrics.timer(fqdn, 'juniper_get_mx_interfaces', 'transform'):
+            return columnar_transforms.mx_interfaces(_items(ports, engine), _items(sfp, engine))
+    return _transform(fqdn, 'juniper_get_mx_interfaces', _mx_interfaces, [ports, sfp], engine)
+
+
+def _mx_interfaces(ports, sfp):
+    """Join MXPhysicalTable and MXChassisHardware items into the MX interface dictionary."""
     # create a dictionary of interface names with another dictionary with port description, sfp type and speed
     results = {}
-    for key, value in ports.items():
+    for key, value in ports:
         if value[0][1] is None:
             results.update({key: {'description': ''}})
         else:
@@ -230,40 +481,24 @@ def juniper_get_mx_interfaces(fqdn, username, password):
             results[key]['speed'] = value[1][1]
 
         # for ae interfaces set type to lag, anything else set to None
-        if 'ae' in key:
+        media = interfaces.media(key)
+        if media == 'ae':
             results[key]['type'] = 'lag'
-        elif 'ge' in key:
+        elif media == 'ge':
             results[key]['type'] = 'copper'
         else:
             results[key]['type'] = 'No SFP'
 
-    for key,value in sfp.items():
-        #construct interface from fpc, pic, port and sfp description
-        if '10G' in value[1][1]:
-            type = 'xe-'
-        else:
-            type = 'ge-'
-        fpc = value[4][1].replace('FPC ', '')
-        pic = value[2][1].replace('PIC ', '')
-        port = key.replace('Xcvr ', '')
-
-        #match chassis hardware description to netbox tags
-        try:
-            if value[1][1] == 'SFP+-10G-LR' or value[1][1] == 'SFP-LX10' or value[1][1] == 'QSFP+-40G-LR4' or value[1][1] == 'XFP-10G-LR':
-                results[type+fpc+'/'+pic+'/'+port]['type']='SMF'
-            elif value[1][1] == 'SFP+-10G-SR' or value[1][1] == 'SFP-SX':
-                results[type + fpc + '/' + pic + '/' + port]['type'] = 'MMF'
-            else:
-                results[type + fpc + '/' + pic + '/' + port]['type'] = 'copper'
-        except:
-            pass
+    #match chassis hardware description to netbox tags
+    _optic_types(results, [(value[1][1], value[4][1], value[2][1], key) for key, value in sfp], _MX_SMF_OPTICS)
     return results
 
 
 # Juniper EX only: The purpose of this function is to return a dictionary with the interface name (key) pointing to another dictionary (value) containing
 # the interface description, type of SFP and the SFP speed
 # EXAMPLE: {'ge-0/1/0': {'description': 'SVC: CSW1-SVC.CH3 0/0/43', 'speed': '1Gbps', 'type': 'SMF'},
-def juniper_get_ex_interfaces(fqdn, username, password):
+def juniper_get_ex_interfaces(fqdn, username, password, parallel=False, filtered=False, engine='pyez',
+                              interface_names=None):
     """Return EX/QFX-EX interface metadata including description, speed, and fiber/copper type.
 
     Parameters
@@ -274,6 +509,15 @@ def juniper_get_ex_interfaces(fqdn, username, password):
         Username for device authentication.
     password : str
         Password for device authentication.
+    parallel : bool, optional
+        Fetch the interface and chassis inventory tables concurrently on two NETCONF sessions.
+    filtered : bool, optional
+        Request the 'brief' interface output, which drops traffic statistics and address families from the reply.
+    engine : str or dict, optional
+        Parsing engine for the RPC replies, 'pyez' or 'lxml' (see `parsers.table_items`).
+    interface_names : list[str], optional
+        Request only these physical interfaces, one RPC per name. The chassis inventory is still read in full for
+        the optic types. Names not configured on the device are left out of the result.
 
     Returns
     -------
@@ -283,16 +527,19 @@ def juniper_get_ex_interfaces(fqdn, username, password):
         - 'speed' (str)
         - 'type' (str) one of 'SMF', 'MMF', 'copper', or 'lag'
     """
-    # Netconf session to a juniper device
-    with Device(host=fqdn, user=username, password=password, port='22',timeout=300) as dev:
-        ports = QFXEXPhysicalTable(dev)
-        sfp = QFXEXChassisHardware(dev)
-        ports.get()
-        sfp.get()
+    # Netconf session(s) to a juniper device
+    ports_table = QFXEXPhysicalBriefTable if filtered else QFXEXPhysicalTable
+    port_tables = [ports_table] if interface_names is None else _named(ports_table, interface_names, 'interface_name')
+    ports, sfp = _fetch_groups(fqdn, username, password, [port_tables, [QFXEXChassisHardware]], parallel)
 
+    return _transform(fqdn, 'juniper_get_ex_interfaces', _ex_interfaces, [ports, sfp], engine)
+
+
+def _ex_interfaces(ports, sfp):
+    """Join QFXEXPhysicalTable and QFXEXChassisHardware items into the EX interface dictionary."""
     # create a dictionary of interface names with another dictionary with port description, sfp type and speed
     results = {}
-    for key,value in ports.items():
+    for key,value in ports:
         if value[0][1] == None:
             results.update({key: {'description': ''}})
         else:
@@ -308,37 +555,19 @@ def juniper_get_ex_interfaces(fqdn, username, password):
             results[key]['speed'] = value[1][1]
 
         # for ae interfaces set type to lag
-        if 'ae' in key:
+        if interfaces.media(key) == 'ae':
             results[key]['type'] = 'lag'
 
-    for key,value in sfp.items():
-        #construct interface from fpc, pic, port and sfp description
-        if '10G' in value[1][1]:
-            type = 'xe-'
-        else:
-            type = 'ge-'
-        fpc = value[4][1].replace('FPC ', '')
-        pic = value[3][1].replace('PIC ', '')
-        port = key.replace('Xcvr ','')
-
-        #match chassis hardware description to netbox tags
-        if int(port) < 48:
-            try:
-                if value[1][1] == 'SFP+-10G-LR' or value[1][1] == 'SFP-LX10' or value[1][1] == 'QSFP+-40G-LR4':
-                    results[type+fpc+'/'+pic+'/'+port]['type']='SMF'
-                elif value[1][1] == 'SFP+-10G-SR' or value[1][1] == 'SFP-SX':
-                    results[type + fpc + '/' + pic + '/' + port]['type'] = 'MMF'
-                else:
-                    results[type + fpc + '/' + pic + '/' + port]['type'] = 'copper'
-            except:
-                pass
-
+    #match chassis hardware description to netbox tags, transceivers from 48 up (the uplinks) are left out
+    _optic_types(results, [(value[1][1], value[4][1], value[3][1], key) for key, value in sfp
+                           if interfaces.number(key) < 48], _SMF_OPTICS)
     return results
 
 # The purpose of this function to get all the public ips in use at a specfic SVC location
 # EXAMPLE: {'64.191.201.2/31': 'SVC: THOUSANDEYES AWS IPV4', '64.191.201.4/30': 'SVC: THOUSANDEYES AZURE PRIMARY'}
 # NOTE: PUBLIC NETWORKS ARE ADDED MANUALLY TO THE YML FILE
-def juniper_get_mx_ipv4_public_routes(fqdn,site,username,password):
+def juniper_get_mx_ipv4_public_routes(fqdn,site,username,password,parallel=False,filtered=False,columnar=False,
+                                      engine='pyez', prefixes=None):
     """Return public IPv4 networks configured at a specific SVC site on an MX device.
 
     The function selects a site-specific route parser (from built-in YML models) to get public
@@ -354,67 +583,74 @@ def juniper_get_mx_ipv4_public_routes(fqdn,site,username,password):
         Username for device authentication.
     password : str
         Password for device authentication.
+    parallel : bool, optional
+        Fetch the route table and the logical interface table(s) concurrently on separate NETCONF sessions.
+    filtered : bool, optional
+        Request only logical unit names and descriptions ('terse' and 'descriptions') instead of the full
+        logical interfaces.
+    columnar : bool, optional
+        Run the vectorized NumPy transform and return (results, columns), see `columnar.mx_ipv4_public_routes`.
+    engine : str or dict, optional
+        Parsing engine for the RPC replies, 'pyez' or 'lxml' (see `parsers.table_items`).
+    prefixes : list[str], optional
+        Request only these routes (exact match, e.g. '64.191.201.2/31') and then only the logical interfaces they
+        point to, on one session. `parallel` does not apply.
 
     Returns
     -------
     dict[str, str]
         Mapping of route (CIDR string) to the interface description (value).
     """
-    # Netconf session to a juniper device
-    with Device(host=fqdn, user=username, password=password, port='22', timeout=300) as dev:
-        if site =='at1':
-            routes = br1svcat1corpequinixcom(dev)
-        elif site =='ch3':
-            routes = br1svcch3corpequinixcom(dev)
-        elif site =='da6':
-            routes = br1svcda6corpequinixcom(dev)
-        elif site =='dc6':
-            routes = br1svcdc6corpequinixcom(dev)
-        elif site =='la3':
-            routes = br1svcla3corpequinixcom(dev)
-        elif site =='mi1':
-            routes = br1svcmi1corpequinixcom(dev)
-        elif site =='ny5':
-            routes = br1svcny5corpequinixcom(dev)
-        elif site =='se3':
-            routes = br1svcse3corpequinixcom(dev)
-        elif site =='sv5':
-            routes = br1svcsv5corpequinixcom(dev)
-        elif site =='am3':
-            routes = svcbr1am3corpeuequinixcom(dev)
-        elif site =='fr4':
-            routes = svcbr1fr4corpeuequinixcom(dev)
-        elif site =='ld5':
-            routes = svcbr1ld5corpeuequinixcom(dev)
-        elif site =='hk2':
-            routes = br1svchk2apequinixcom(dev)
-        elif site =='os1':
-            routes = br1svcos1apequinixcom(dev)
-        elif site =='sg2':
-            routes = br1svcsg2apequinixcom(dev)
-        elif site =='sy4':
-            routes = br1svcsy4apequinixcom(dev)
-        elif site =='ty4':
-            routes = br1svcty4apequinixcom(dev)
-        elif site =='tr2':
-            routes = br1svctr2corpequinixcom(dev)
-        routes.get()
-
-        ports = MXLogicalTable(dev)
-        ports.get()
+    # Netconf session(s) to a juniper device
+    if prefixes is None:
+        routes, *ports = _fetch_groups(fqdn, username, password,
+                                       [[_PUBLIC_ROUTE_TABLES[site]]] + _logical_tables(filtered), parallel)
+    else:
+        # the logical interfaces are only known once the routes are read
+        route_tables = [(_PUBLIC_ROUTE_TABLES[site], {'destination': prefix, 'exact': True}) for prefix in prefixes]
+        if aio.get_collector() is not None:
+            # the collector keeps the device session open between the two round trips
+            routes = _get_tables(fqdn, username, password, route_tables)
+            ports = _fetch_groups(fqdn, username, password, _logical_tables(filtered, _route_units(routes, engine)))
+        else:
+            with _session(fqdn, username, password) as dev:
+                routes = [sessions.fetch_table(dev, table) for table in route_tables]
+                ports = [[sessions.fetch_table(dev, table) for table in group]
+                         for group in _logical_tables(filtered, _route_units(routes, engine))]
+
+    if columnar:
+        with metrics.timer(fqdn, 'juniper_get_mx_ipv4_public_routes', 'transform'):
+            descriptions = dict((key, value[0][1]) for key, value in _logical_items(*ports, engine=engine))
+            return columnar_transforms.mx_ipv4_public_routes(_items(routes, engine), descriptions)
+    return _transform(fqdn, 'juniper_get_mx_ipv4_public_routes', _public_routes, [routes] + ports, engine)
+
+
+def _route_units(routes, engine):
+    """Return the logical units the fetched routes point to."""
+    return sorted(set(value[2][1] for key, value in _items(routes, engine) if isinstance(value[2][1], str)))
 
+
+def _public_routes(routes, ports, descriptions=None):
+    """Map public route items to the description of their logical interface items (see `_merge_logical`)."""
+    descriptions = dict((key, value[0][1]) for key, value in _merge_logical(ports, descriptions))
+    return _mx_ipv4_public_routes(routes, descriptions)
+
+
+def _mx_ipv4_public_routes(routes, descriptions):
+    """Map site public route table items to the description of their logical interface."""
     # create a dictionary of routes and descriptions (based on interface description)
     results = {}
-    for key, value in routes.items():
-        if value[3][1] is None and value[4][1] is None:
-            if value[2][1] in ports:
-                results.update({key: ports[value[2][1]]['description']})
+    for key, value in routes:
+        # routes with several next hops return a list of interfaces and never match
+        if value[3][1] is None and value[4][1] is None and not isinstance(value[2][1], list):
+            if value[2][1] in descriptions:
+                results.update({key: descriptions[value[2][1]]})
     return results
 
 
 #This purpose of this function is to get the routing instance information from the MX router
 #EXAMPLE: {'RI-BBVA': {'instance_type': 'vpls', 'route_distinguisher': '0:0', 'instance_interface': ['xe-2/0/1.3031', 'ae0.3031', 'xe-2/0/1.3030', 'ae0.3030']}}
-def juniper_get_instance(fqdn, site, username, password):
+def juniper_get_instance(fqdn, site, username, password, filtered=False, engine='pyez', instance_names=None):
     """Retrieve routing-instance (VRF) information from an MX device.
 
     Parameters
@@ -427,6 +663,14 @@ def juniper_get_instance(fqdn, site, username, password):
         Username for device authentication.
     password : str
         Password for device authentication.
+    filtered : bool, optional
+        Read the routing-instances from the configuration (get-configuration with a routing-instances filter
+        subtree) instead of get-instance-information.
+    engine : str or dict, optional
+        Parsing engine for the RPC replies, 'pyez' or 'lxml' (see `parsers.table_items`).
+    instance_names : list[str], optional
+        Request only these routing-instances, one RPC per name. Names as returned by this function, the site
+        prefix of '<SITE> RI-VRF-Internet-2' is accepted.
 
     Returns
     -------
@@ -437,12 +681,24 @@ def juniper_get_instance(fqdn, site, username, password):
         - 'instance_interface' (list[str])
     """
     # Netconf session to a juniper device
-    with Device(host=fqdn, user=username, password=password, port='22',timeout=300) as dev:
-        instance=MXRouteInstance(dev)
-        instance.get()
-
+    table = MXRouteInstanceConfigTable if filtered else MXRouteInstance
+    if instance_names is None:
+        tables = [table]
+    else:
+        # the site prefix is added by _instances, it is not part of the routing-instance name on the device
+        prefix = site.upper() + ' '
+        names = [name[len(prefix):] if name.startswith(prefix) else name for name in instance_names]
+        tables = _named(table, names, 'key' if filtered else 'instance_name')
+    instance = _get_tables(fqdn, username, password, tables)
+
+    with metrics.timer(fqdn, 'juniper_get_instance', 'transform'):
+        return _instances(_items(instance, engine), site)
+
+
+def _instances(instance, site):
+    """Transform MXRouteInstance items into the routing-instance dictionary for a site."""
     results={}
-    for key,value in instance.items():
+    for key,value in instance:
         if '__' not in key and 'master' not in key and 'junos' not in key:
             if value[1][1]=='0:0':
                 results.update({key: {'instance_type': value[0][1], 'route_distinguisher': None,
@@ -485,9 +741,7 @@ def juniper_get_mx_version(fqdn, username, password):
     str
         Version string as returned by the MX device model.
     """
-    dev = Device(host=fqdn, user=username, password=password, port='22',timeout=300).open()
-    mx_version = MXVersion(dev)
-    mx_version.get()
+    mx_version, = _get_tables(fqdn, username, password, [MXVersion])
 
     results=mx_version[0].version
     return results
@@ -512,9 +766,7 @@ def juniper_get_qfx_version(fqdn, username, password):
     str
         Version string as returned by the QFX device model.
     """
-    dev = Device(host=fqdn, user=username, password=password, port='22',timeout=300).open()
-    qfx_version = QFXVersion(dev)
-    qfx_version.get()
+    qfx_version, = _get_tables(fqdn, username, password, [QFXVersion])
 
     results=qfx_version[0].version
     return results
@@ -539,9 +791,7 @@ def juniper_get_ex3400_version(fqdn, username, password):
     str
         Version string as returned by the EX3400 device model.
     """
-    dev = Device(host=fqdn, user=username, password=password, port='22',timeout=300).open()
-    ex_version = EX3400Version(dev)
-    ex_version.get()
+    ex_version, = _get_tables(fqdn, username, password, [EX3400Version])
 
     results=ex_version[0].version
     return results
@@ -568,11 +818,66 @@ def juniper_get_ex2200_version(ip_address,username,password):
     str
         Extracted version string (contents inside brackets if present) or the raw version string.
     """
-    dev = Device(host=ip_address, user=username, password=password, port='22',timeout=300).open()
-    ex_version = EX2200Version(dev)
-    ex_version.get()
+    ex_version, = _get_tables(ip_address, username, password, [EX2200Version])
 
     results=ex_version[0].version
     #extract only the version
     only_version = results[results.find('[')+1:results.find(']')]
-    return only_version
\ No newline at end of file
+    return only_version
+
+
+#this will get the model, version and serial number of any juniper device, from the facts cache when possible
+def juniper_get_facts(fqdn, username, password, refresh=False, serial=True, max_age=None):
+    """Return the model, software version and serial number of a Juniper device.
+
+    Facts are served from the cache configured with `facts.set_facts_cache` until they expire, so repeated
+    lookups do not open a session or run an RPC. A miss runs get-software-information, and get-chassis-inventory
+    for the serial number.
+
+    Parameters
+    ----------
+    fqdn : str
+        Hostname or IP of the device.
+    username : str
+        Username for device authentication.
+    password : str
+        Password for device authentication.
+    refresh : bool, optional
+        Read the facts from the device even if they are cached.
+    serial : bool, optional
+        Include the serial number, False skips the chassis inventory RPC.
+    max_age : int or float, optional
+        Seconds the cached facts may be old for this call when less than the cache TTL, see `facts.get_facts`.
+
+    Returns
+    -------
+    dict
+        Dictionary with 'hostname', 'model' (e.g. 'EX2200-24T-4G'), 'version', 'timestamp' and, with `serial`,
+        'serial'.
+    """
+    return device_facts.get_facts(fqdn, username, password, refresh, serial=serial, max_age=max_age)
+
+
+#this will get the version of code on any juniper device (MX, QFX, EX2200 or EX3400)
+def juniper_get_version(fqdn, username, password, refresh=False, max_age=None):
+    """Return the software version of a Juniper device from its facts, one get-software-information RPC on a miss.
+
+    Parameters
+    ----------
+    fqdn : str
+        Hostname or IP of the device.
+    username : str
+        Username for device authentication.
+    password : str
+        Password for device authentication.
+    refresh : bool, optional
+        Read the facts from the device even if they are cached.
+    max_age : int or float, optional
+        Seconds the cached facts may be old for this call when less than the cache TTL, e.g. `facts.RECENT`.
+
+    Returns
+    -------
+    str
+        Junos version string (e.g. '12.3R12.4'), the same value the model specific version functions return.
+    """
+    return juniper_get_facts(fqdn, username, password, refresh, serial=False, max_age=max_age)['version']
@@ -0,0 +1,148 @@
+"""
+Timing and payload-size instrumentation for Junos NETCONF calls
+"""
+import collections
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+from lxml import etree
+
+# the installed metrics sink, None means instrumentation is disabled
+_sink = None
+
+
+def set_metrics_sink(sink):
+    """Install the metrics sink that receives every measurement taken by svc_juniper_lib.
+
+    Parameters
+    ----------
+    sink : callable or None
+        Callable taking a single dict argument (see `record`). Pass None to disable instrumentation.
+
+    Returns
+    -------
+    callable or None
+        The previously installed sink.
+    """
+    global _sink
+    previous = _sink
+    _sink = sink
+    return previous
+
+
+def get_metrics_sink():
+    """Return the currently installed metrics sink (or None)."""
+    return _sink
+
+
+def record(device, table, phase, seconds, reply_bytes=None, items=None):
+    """Send one measurement to the installed metrics sink.
+
+    Parameters
+    ----------
+    device : str
+        Hostname or IP of the Juniper device.
+    table : str
+        Table or function the measurement belongs to (e.g. 'MXPhysicalTable', 'juniper_get_mx_interfaces').
+    phase : str
+        One of 'connect', 'rpc' or 'transform'.
+    seconds : float
+        Elapsed wall clock time.
+    reply_bytes : int, optional
+        Size of the serialized RPC reply.
+    items : int, optional
+        Number of table items in the RPC reply.
+
+    Returns
+    -------
+    None
+    """
+    if _sink is None:
+        return
+    _sink({'device': device, 'table': table, 'phase': phase, 'seconds': seconds,
+           'reply_bytes': reply_bytes, 'items': items, 'timestamp': time.time()})
+
+
+@contextmanager
+def timer(device, table, phase):
+    """Context manager recording the wall clock time of the enclosed block as one measurement."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(device, table, phase, time.perf_counter() - start)
+
+
+def get_table(table, *vargs, **kvargs):
+    """Run `table.get()` and record the RPC round trip, reply size and item count.
+
+    Parameters
+    ----------
+    table : jnpr.junos.factory.optable.OpTable
+        PyEZ table bound to an open Device.
+    *vargs, **kvargs
+        Passed through to `table.get()`.
+
+    Returns
+    -------
+    OpTable
+        The same table, for call chaining.
+    """
+    start = time.perf_counter()
+    table.get(*vargs, **kvargs)
+    seconds = time.perf_counter() - start
+    if _sink is not None:
+        reply_bytes = len(etree.tostring(table.xml)) if table.xml is not None else 0
+        device = table.D.hostname if table.D is not None else None
+        record(device, type(table).__name__, 'rpc', seconds, reply_bytes=reply_bytes, items=len(table))
+    return table
+
+
+class MetricsRecorder:
+    """In-memory metrics sink that keeps every measurement and reports the slowest calls.
+
+    Parameters
+    ----------
+    maxlen : int, optional
+        Keep only the most recent `maxlen` measurements. None keeps everything.
+    """
+
+    def __init__(self, maxlen=None):
+        self.maxlen = maxlen
+        # a bounded deque drops the oldest measurement in O(1) per append
+        self.records = collections.deque(maxlen=maxlen)
+
+    def __call__(self, measurement):
+        self.records.append(measurement)
+
+    def slowest(self, count=10, phase=None):
+        """Return the `count` slowest measurements, optionally limited to one phase."""
+        selected = [r for r in self.records if phase is None or r['phase'] == phase]
+        return sorted(selected, key=lambda r: r['seconds'], reverse=True)[:count]
+
+    def summary(self):
+        """Return per (device, table, phase) aggregates.
+
+        Returns
+        -------
+        dict[tuple, dict]
+            Mapping of (device, table, phase) -> dict with 'count', 'total', 'max', 'reply_bytes' and 'items'.
+        """
+        results = {}
+        for r in self.records:
+            key = (r['device'], r['table'], r['phase'])
+            entry = results.setdefault(key, {'count': 0, 'total': 0.0, 'max': 0.0, 'reply_bytes': 0, 'items': 0})
+            entry['count'] += 1
+            entry['total'] += r['seconds']
+            entry['max'] = max(entry['max'], r['seconds'])
+            entry['reply_bytes'] += r['reply_bytes'] or 0
+            entry['items'] += r['items'] or 0
+        return results
+
+    def dump_slowest(self, count=10, phase=None, stream=None):
+        """Write the slowest measurements as JSON lines to `stream` (default stdout)."""
+        stream = stream or sys.stdout
+        for r in self.slowest(count, phase):
+            stream.write(json.dumps(r) + '\n')
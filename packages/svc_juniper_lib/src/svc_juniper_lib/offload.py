@@ -0,0 +1,76 @@
+"""
+Process pool the juniper functions hand their fetched tables to, so Table/View evaluation and the dict transforms of
+many devices run on several cores instead of taking turns on the GIL. The replies are still parsed in the I/O thread
+(by ncclient, as PyEZ receives them), only what follows the parse is offloaded
+"""
+from lxml import etree
+
+# pool the juniper functions send their replies to, None transforms them in the calling thread
+_pool = None
+
+
+def set_parse_pool(pool):
+    """Install the executor every svc_juniper_lib.juniper function runs its Table/View evaluation and transform on.
+
+    With a pool installed the calling (I/O) thread fetches and parses the replies (ncclient parses every reply as it
+    arrives), serializes each table to bytes and sends it to a worker process, which parses it again, evaluates the
+    views and transforms them; only the resulting dictionary comes back. The serialization and second parse are the
+    cost of the offload, it pays off when the views and transforms of many devices outweigh them.
+
+    Parameters
+    ----------
+    pool : concurrent.futures.ProcessPoolExecutor or None
+        Pool to use, e.g. ProcessPoolExecutor(max_workers=os.cpu_count()). None transforms in the calling thread.
+
+    Returns
+    -------
+    concurrent.futures.Executor or None
+        The previously installed pool.
+    """
+    global _pool
+    previous = _pool
+    _pool = pool
+    return previous
+
+
+def get_parse_pool():
+    """Return the installed parse pool (or None)."""
+    return _pool
+
+
+def pack(table):
+    """Return a fetched PyEZ table as (table class name, reply bytes), small enough to pickle to a worker.
+
+    Parameters
+    ----------
+    table : OpTable or CfgTable or None
+        Fetched table, None (a named item missing on the device) is kept as None.
+
+    Returns
+    -------
+    tuple[str, bytes] or None
+    """
+    if table is None:
+        return None
+    return type(table).__name__, etree.tostring(table.xml)
+
+
+def unpack(packed, tables):
+    """Rebuild a table packed with `pack`.
+
+    Parameters
+    ----------
+    packed : tuple[str, bytes] or None
+        Packed table.
+    tables : dict
+        Table classes by name, e.g. the globals() of the module that fetched it.
+
+    Returns
+    -------
+    OpTable or CfgTable or None
+        Table bound to the parsed reply instead of a device.
+    """
+    if packed is None:
+        return None
+    name, reply = packed
+    return tables[name](xml=etree.fromstring(reply))
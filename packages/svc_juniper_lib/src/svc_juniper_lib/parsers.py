@@ -0,0 +1,137 @@
+"""
+Single pass lxml parser for the Junos operational tables, bypassing the PyEZ Table/View layer
+"""
+from lxml import etree
+
+from jnpr.junos.factory.optable import OpTable
+
+# compiled parsers, one per (table class, view class)
+_compiled = {}
+
+
+def _field_getter(xpath):
+    """Return (levels, find) for a view field xpath, `find` extracting the matched elements from an element
+    `levels` parents above the item.
+
+    Plain child paths ('description', 'rt-entry/nh/via') use ElementPath and leading parent walks ('../name',
+    '../../../name') become getparent() calls; anything else falls back to a precompiled XPath on the item.
+    """
+    levels = 0
+    path = xpath
+    while path.startswith('../'):
+        levels += 1
+        path = path[3:]
+
+    if not any(token in path for token in ('[', '(', '@', '|', ':', '..', '//', '*')):
+        return levels, lambda element: element.findall(path)
+    return 0, etree.XPath(xpath)
+
+
+def _munch(element, astype):
+    """Convert a matched element like PyEZ does: stripped text, or the element tag when the text is empty."""
+    text = element.text
+    if text is not None:
+        text = text.strip()
+    if not text:
+        text = element.tag
+    return astype(text)
+
+
+def _compile(table):
+    """Build the parser for a PyEZ OpTable with a simple key, or return None if it is not supported."""
+    key = table.ITEM_NAME_XPATH
+    view = table.view
+    if not isinstance(table, OpTable) or view is None or not isinstance(key, str) or ' | ' in key:
+        return None
+    if view.GROUPS or view.EVAL or any('xpath' not in field for field in view.FIELDS.values()):
+        return None
+
+    find_items = etree.XPath(table.ITEM_XPATH)
+    find_keys = etree.XPath(key)
+    fields = [(name,) + _field_getter(field['xpath']) + (field.get('astype', str),)
+              for name, field in view.FIELDS.items()]
+
+    def parse(xml):
+        keys = []
+        values = []
+        # parent lookups are shared by sibling items, remember the last parent searched for every field
+        parents = {}
+        for item in find_items(xml):
+            keys.extend(element.text.strip() for element in find_keys(item))
+            record = []
+            for name, levels, find, astype in fields:
+                if levels:
+                    parent = item
+                    for _ in range(levels):
+                        parent = parent.getparent() if parent is not None else None
+                    if parent is None:
+                        found = []
+                    elif name in parents and parents[name][0] is parent:
+                        found = parents[name][1]
+                    else:
+                        found = find(parent)
+                        parents[name] = (parent, found)
+                else:
+                    found = find(item)
+                if astype is bool:
+                    value = bool(found)
+                elif not found:
+                    value = None
+                elif len(found) == 1:
+                    value = _munch(found[0], astype)
+                else:
+                    value = [_munch(element, astype) for element in found]
+                record.append((name, value))
+            values.append(record)
+        # zip like Table.items() so items without a key element line up the same way
+        return list(zip(keys, values))
+
+    return parse
+
+
+def items(table):
+    """Return `table.items()` for a fetched PyEZ table by walking its reply XML once.
+
+    Parameters
+    ----------
+    table : jnpr.junos.factory.optable.OpTable
+        PyEZ table whose RPC reply has already been fetched with `get()`.
+
+    Returns
+    -------
+    list[tuple]
+        (key, [(field, value), ...]) items identical to `table.items()`. Tables this parser does not support
+        (configuration tables, composite keys, grouped or evaluated view fields) are evaluated by PyEZ.
+    """
+    index = (type(table), table.view)
+    if index not in _compiled:
+        _compiled[index] = _compile(table)
+    parse = _compiled[index]
+    if parse is None or table.xml is None:
+        return table.items()
+    return parse(table.xml)
+
+
+def table_items(table, engine='pyez'):
+    """Return the items of a fetched PyEZ table using the requested parsing engine.
+
+    Parameters
+    ----------
+    table : jnpr.junos.factory.table.Table
+        PyEZ table whose RPC reply has already been fetched with `get()`.
+    engine : str or dict, optional
+        'pyez' evaluates the Table/View, 'lxml' uses the single pass parser in this module. A dict selects the
+        engine per table class name (e.g. {'MXLogicalTable': 'lxml'}), tables not listed use 'pyez'.
+
+    Returns
+    -------
+    list[tuple]
+        (key, [(field, value), ...]) items.
+    """
+    if isinstance(engine, dict):
+        engine = engine.get(type(table).__name__, 'pyez')
+    if engine == 'lxml':
+        return items(table)
+    if engine == 'pyez':
+        return table.items()
+    raise ValueError("Unknown parsing engine: '%s'" % engine)
@@ -0,0 +1,250 @@
+"""
+NETCONF session pool used to run independent RPCs against one device concurrently
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from jnpr.junos import Device
+from jnpr.junos.exception import RpcError
+
+from . import metrics
+from . import timeouts
+
+# pool the juniper functions borrow their sessions from, None opens a new session for every call
+_pool = None
+
+# sessions get_tables opens to one device without a pool, as the daemon and worker pools
+_TABLE_SESSIONS = 2
+
+
+def open_device(fqdn, username, password):
+    """Open a NETCONF session to a Juniper device, recording the time spent on the SSH/NETCONF handshake.
+
+    The connect timeout is decided by the policy installed with `timeouts.set_timeout_policy`, 30 seconds without.
+
+    Parameters
+    ----------
+    fqdn : str
+        Hostname or IP of the device.
+    username : str
+        Username for device authentication.
+    password : str
+        Password for device authentication.
+
+    Returns
+    -------
+    jnpr.junos.Device
+        The open device session. The caller is responsible for closing it.
+    """
+    # facts are read lazily (see facts.py), never as part of the handshake
+    with timeouts.budget(fqdn, timeouts.CONNECT, 30) as connect_timeout:
+        dev = Device(host=fqdn, user=username, password=password, port='22', timeout=300, gather_facts=False,
+                     conn_open_timeout=connect_timeout)
+        with metrics.timer(fqdn, 'Device', 'connect'):
+            dev.open()
+    return dev
+
+
+def fetch_table(dev, table):
+    """Fetch one PyEZ table on an open device.
+
+    Parameters
+    ----------
+    dev : jnpr.junos.Device
+        Open device session.
+    table : type or tuple
+        PyEZ table class, or a (table class, dict) pair whose dict is passed to `table.get()` to fetch only some
+        items, e.g. (MXPhysicalTable, {'interface_name': 'xe-0/0/1'}).
+
+    Returns
+    -------
+    OpTable or CfgTable or None
+        The fetched table. None when the item named in the get() arguments does not exist on the device.
+
+    Raises
+    ------
+    timeouts.DeviceDeferred
+        The RPC exceeded the timeout decided by the installed policy, see `timeouts.budget`.
+    """
+    table, kvargs = table if isinstance(table, tuple) else (table, {})
+    try:
+        with timeouts.budget(dev.hostname, table.__name__, 300) as rpc_timeout:
+            # the session may be pooled, every RPC sets its own timeout
+            dev.timeout = rpc_timeout
+            return metrics.get_table(table(dev), **kvargs)
+    except RpcError as error:
+        # Junos answers a request for a named interface that is not configured with an error, not an empty reply
+        if kvargs and 'not found' in str(error):
+            return None
+        raise
+
+
+class SessionPool:
+    """Small pool of open NETCONF sessions, at most `size` per device.
+
+    Junos answers RPCs one at a time on a single NETCONF session, so independent RPCs to the same
+    device only overlap when they run on separate sessions. Sessions are opened lazily, reused
+    once released and closed with `close()`.
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of concurrent sessions per device.
+    max_idle : int or float, optional
+        Close sessions that have been idle for longer than this many seconds instead of reusing them, devices
+        and firewalls drop quiet SSH connections. None reuses idle sessions indefinitely.
+    """
+
+    def __init__(self, size=2, max_idle=None):
+        self.size = size
+        self.max_idle = max_idle
+        self._idle = {}
+        self._open = {}
+        self._lock = threading.Condition()
+
+    @contextmanager
+    def session(self, fqdn, username, password):
+        """Borrow an open session to `fqdn`, opening a new one if the device is below its session limit.
+
+        A session is discarded rather than returned to the pool if the enclosed block raises.
+        """
+        key = (fqdn, username)
+        dev = self._acquire(key, fqdn, username, password)
+        try:
+            yield dev
+        except Exception:
+            self._discard(key, dev)
+            raise
+        with self._lock:
+            self._idle.setdefault(key, []).append((dev, time.monotonic()))
+            self._lock.notify()
+
+    def _acquire(self, key, fqdn, username, password):
+        stale = []
+        with self._lock:
+            while True:
+                idle = self._idle.get(key)
+                while idle:
+                    dev, released = idle.pop()
+                    if dev.connected and (self.max_idle is None or time.monotonic() - released < self.max_idle):
+                        break
+                    stale.append(dev)
+                    self._open[key] -= 1
+                else:
+                    dev = None
+                if dev is not None:
+                    break
+                if self._open.get(key, 0) < self.size:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                self._lock.wait()
+        for old in stale:
+            try:
+                old.close()
+            except Exception:
+                pass
+        if dev is not None:
+            return dev
+        try:
+            return open_device(fqdn, username, password)
+        except Exception:
+            with self._lock:
+                self._open[key] -= 1
+                self._lock.notify()
+            raise
+
+    def _discard(self, key, dev):
+        try:
+            dev.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open[key] -= 1
+            self._lock.notify()
+
+    def close(self):
+        """Close every idle session in the pool."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            for key, devices in idle.items():
+                self._open[key] -= len(devices)
+        for devices in idle.values():
+            for dev, released in devices:
+                try:
+                    dev.close()
+                except Exception:
+                    pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def set_session_pool(pool):
+    """Install the pool every svc_juniper_lib.juniper function borrows its NETCONF sessions from.
+
+    A long-running process installs a pool once so sessions stay open between calls, short scripts leave it
+    unset and open a session per call.
+
+    Parameters
+    ----------
+    pool : SessionPool or None
+        Pool to use, None restores a new session per call.
+
+    Returns
+    -------
+    SessionPool or None
+        The previously installed pool.
+    """
+    global _pool
+    previous = _pool
+    _pool = pool
+    return previous
+
+
+def get_session_pool():
+    """Return the installed session pool (or None)."""
+    return _pool
+
+
+def get_tables(fqdn, username, password, tables, pool=None):
+    """Fetch several PyEZ tables from one device concurrently on pooled sessions, at most the pool size at a time.
+
+    Parameters
+    ----------
+    fqdn : str
+        Hostname or IP of the device.
+    username : str
+        Username for device authentication.
+    password : str
+        Password for device authentication.
+    tables : list
+        PyEZ table classes or (table class, get() arguments) pairs to fetch (e.g. [MXPhysicalTable,
+        MXChassisHardware]), see `fetch_table`.
+    pool : SessionPool, optional
+        Pool to borrow sessions from. By default a pool of two sessions is opened and closed, so a scoped fetch
+        of one table per item does not open a session per item.
+
+    Returns
+    -------
+    list
+        The fetched tables, in the same order as `tables`.
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = SessionPool(size=min(len(tables), _TABLE_SESSIONS))
+
+    def fetch(table):
+        with pool.session(fqdn, username, password) as dev:
+            return fetch_table(dev, table)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(len(tables), pool.size))) as executor:
+            return list(executor.map(fetch, tables))
+    finally:
+        if own_pool:
+            pool.close()
@@ -0,0 +1,267 @@
+"""
+Adaptive NETCONF timeouts: each connect and RPC gets a budget from the time it took on the same device before (or
+on the other devices), instead of a flat 300 seconds, and a device exceeding its budget is deferred
+
+    policy = timeouts.TimeoutPolicy('/var/lib/svc/timeouts.json')
+    timeouts.set_timeout_policy(policy)
+    ...                             # a DeviceDeferred is raised for a device that exceeded a budget
+    with timeouts.retry_lane():     # at the end of the run: the deferred devices again, with the maximum timeouts
+        ...
+    policy.save()
+    policy.report()                 # every timeout decision, for the run output
+"""
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from jnpr.junos.exception import ConnectError
+from jnpr.junos.exception import ConnectTimeoutError
+from jnpr.junos.exception import RpcTimeoutError
+
+# policy deciding the timeouts of svc_juniper_lib, None uses the flat PyEZ timeouts
+_policy = None
+
+# exceptions raised when a connect or RPC runs out of its budget
+_TIMEOUTS = (ConnectTimeoutError, RpcTimeoutError, asyncio.TimeoutError, TimeoutError)
+
+# history key of the SSH/NETCONF handshake, RPCs are kept under their table name
+CONNECT = 'connect'
+
+
+class DeviceDeferred(Exception):
+    """A device exceeded its timeout budget, or did earlier in the run, and is left for the retry lane.
+
+    Parameters
+    ----------
+    device : str
+        Hostname or IP of the device.
+    reason : str
+        The budget it exceeded, e.g. 'EX2200Version exceeded 12 s'.
+    """
+
+    def __init__(self, device, reason):
+        super().__init__('%s deferred: %s' % (device, reason))
+        self.device = device
+        self.reason = reason
+
+
+def set_timeout_policy(policy):
+    """Install the policy deciding the connect and RPC timeouts of every svc_juniper_lib session.
+
+    Parameters
+    ----------
+    policy : TimeoutPolicy or None
+        Policy to use, None restores the flat timeouts (300 seconds per RPC, 30 seconds per connect).
+
+    Returns
+    -------
+    TimeoutPolicy or None
+        The previously installed policy.
+    """
+    global _policy
+    previous = _policy
+    _policy = policy
+    return previous
+
+
+def get_timeout_policy():
+    """Return the installed timeout policy (or None)."""
+    return _policy
+
+
+@contextmanager
+def retry_lane():
+    """Run the enclosed block in the retry lane of the installed policy, if any: the maximum timeouts, no deferral."""
+    policy = _policy
+    if policy is None:
+        yield
+        return
+    previous, policy.lane = policy.lane, 'retry'
+    try:
+        yield
+    finally:
+        policy.lane = previous
+
+
+@contextmanager
+def budget(device, table, default):
+    """Yield the timeout in seconds for one connect or RPC and account for how it went.
+
+    Without a policy installed `default` is yielded and nothing is recorded. With a policy, a device deferred
+    earlier in the run raises `DeviceDeferred` before the block runs, and a timeout raised by the block defers the
+    device (in the retry lane the timeout itself is raised). PyEZ reports some connects that ran out of time as a
+    plain ConnectError (a silent SSH banner, or ConnectRefusedError within 3 seconds), a connect error raised after
+    the timeout elapsed counts as a timeout.
+
+    Parameters
+    ----------
+    device : str
+        Hostname or IP of the device.
+    table : str
+        Table name of the RPC, or CONNECT for the SSH/NETCONF handshake.
+    default : int
+        Timeout without a policy.
+    """
+    policy = _policy
+    if policy is None:
+        yield default
+        return
+    decision = policy.decide(device, table)
+    start = time.perf_counter()
+    try:
+        yield decision['timeout']
+    except BaseException as error:
+        seconds = time.perf_counter() - start
+        timed_out = isinstance(error, _TIMEOUTS) or (isinstance(error, ConnectError) and table == CONNECT
+                                                     and seconds >= decision['timeout'])
+        policy.finish(decision, seconds, 'timeout' if timed_out else 'error')
+        if not timed_out or decision['lane'] == 'retry':
+            raise
+        raise DeviceDeferred(device, '%s exceeded %d s' % (table, decision['timeout'])) from error
+    policy.finish(decision, time.perf_counter() - start, 'ok')
+
+
+class TimeoutPolicy:
+    """Connect and RPC timeouts from the recorded durations of each device and table.
+
+    The timeout of an RPC is `factor` times the slowest of the last `window` durations of the same table on the
+    device, between `minimum` and `maximum`. A device without history gets `factor` times the median of the other
+    devices for that table, and `default` when no device has one. Connects are budgeted the same way between
+    `connect_timeout` and `retry_connect_timeout`, so an unreachable device fails in seconds.
+
+    A device that runs out of a budget is deferred: every later call to it in the run raises `DeviceDeferred` at
+    once, until it is tried again in the retry lane (see `retry_lane`) with `maximum` and `retry_connect_timeout`.
+    Only successful calls are added to the history, a slow device that succeeds in the retry lane gets a larger
+    budget in the next run.
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the history is loaded from and saved to with `save`, None keeps it in memory.
+    factor : float, optional
+        Headroom over the recorded durations.
+    minimum : int, optional
+        Smallest RPC timeout in seconds.
+    maximum : int, optional
+        Largest RPC timeout in seconds, and the RPC timeout of the retry lane.
+    default : int, optional
+        RPC timeout in seconds for a table no device has a history for.
+    connect_timeout : int, optional
+        Smallest connect timeout in seconds, and the connect timeout without history.
+    retry_connect_timeout : int, optional
+        Largest connect timeout in seconds, and the connect timeout of the retry lane.
+    window : int, optional
+        Durations kept per device and table.
+    """
+
+    def __init__(self, path=None, factor=3.0, minimum=10, maximum=300, default=120, connect_timeout=10,
+                 retry_connect_timeout=30, window=20):
+        self.path = path
+        self.factor = factor
+        self.minimum = minimum
+        self.maximum = maximum
+        self.default = default
+        self.connect_timeout = connect_timeout
+        self.retry_connect_timeout = retry_connect_timeout
+        self.window = window
+        self.lane = 'first'
+        self._history = {}
+        self._deferred = {}
+        self._decisions = []
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._history = json.load(f)
+
+    def _limits(self, table):
+        if table == CONNECT:
+            return self.connect_timeout, self.retry_connect_timeout, self.connect_timeout
+        return self.minimum, self.maximum, self.default
+
+    def decide(self, device, table):
+        """Return the decision for one call: a dict with 'device', 'table', 'lane', 'timeout' (whole seconds, as
+        PyEZ takes them) and 'basis' ('device', 'peers', 'default' or 'retry').
+
+        Raises
+        ------
+        DeviceDeferred
+            The device was deferred earlier in the run and this is not the retry lane.
+        """
+        smallest, largest, default = self._limits(table)
+        with self._lock:
+            decision = {'device': device, 'table': table, 'lane': self.lane, 'timeout': None, 'basis': None,
+                        'seconds': None, 'outcome': None}
+            self._decisions.append(decision)
+            if self.lane == 'retry':
+                decision.update(timeout=largest, basis='retry')
+                return decision
+            if device in self._deferred:
+                decision.update(basis='deferred', outcome='deferred')
+                raise DeviceDeferred(device, self._deferred[device])
+
+            samples = self._history.get(device, {}).get(table)
+            if samples:
+                basis, observed = 'device', max(samples)
+            else:
+                peers = sorted(max(tables[table]) for tables in self._history.values() if tables.get(table))
+                basis, observed = ('peers', peers[len(peers) // 2]) if peers else ('default', None)
+            if observed is None:
+                timeout = default
+            else:
+                timeout = min(max(math.ceil(self.factor * observed), smallest), largest)
+            decision.update(timeout=timeout, basis=basis)
+            return decision
+
+    def finish(self, decision, seconds, outcome):
+        """Record how a decided call went: 'ok' adds its duration to the history, 'timeout' defers the device."""
+        with self._lock:
+            decision.update(seconds=round(seconds, 3), outcome=outcome)
+            if outcome == 'ok':
+                samples = self._history.setdefault(decision['device'], {}).setdefault(decision['table'], [])
+                samples.append(round(seconds, 3))
+                del samples[:-self.window]
+            elif outcome == 'timeout' and decision['lane'] == 'first':
+                self._deferred.setdefault(decision['device'], '%s exceeded %d s' % (decision['table'],
+                                                                                      decision['timeout']))
+
+    def deferred(self):
+        """Return {device: reason} for every device deferred in this run."""
+        with self._lock:
+            return dict(self._deferred)
+
+    def report(self):
+        """Summarize the timeout decisions of the run.
+
+        Returns
+        -------
+        dict
+            'deferred' ({device: reason}), 'timeouts' (calls that ran out of their budget), 'decisions' (every
+            decision, with the 'seconds' it took and its 'outcome': 'ok', 'timeout', 'error' or 'deferred').
+        """
+        with self._lock:
+            decisions = [dict(decision) for decision in self._decisions]
+            return {'deferred': dict(self._deferred),
+                    'timeouts': sum(1 for decision in decisions if decision['outcome'] == 'timeout'),
+                    'decisions': decisions}
+
+    def reset(self):
+        """Forget the decisions and deferred devices of the run, the history is kept."""
+        with self._lock:
+            self._decisions = []
+            self._deferred = {}
+            self.lane = 'first'
+
+    def save(self):
+        """Write the history to `path`."""
+        if self.path is None:
+            return
+        with self._lock:
+            document = json.dumps(self._history, sort_keys=True)
+        temporary = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(temporary, 'w') as f:
+            f.write(document)
+        os.replace(temporary, self.path)
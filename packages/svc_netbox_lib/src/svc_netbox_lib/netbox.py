@@ -1,5 +1,314 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
 import requests
 
+# one HTTP session for every call, so connections to NetBox are kept alive and reused
+_session = requests.Session()
+
+# device lists the fqdn/id lookups read: ('devices', token, site) -> (timestamp, value)
+_lookups = {}
+_lookup_ttl = 300
+_lookup_lock = threading.Lock()
+
+
+def netbox_set_lookup_cache(ttl):
+    """Set how long device fqdn/id lookups are reused before NetBox is queried again.
+
+    Parameters
+    ----------
+    ttl : int or float
+        Seconds a lookup is cached, 0 disables the cache. Defaults to 300.
+
+    Returns
+    -------
+    None
+    """
+    global _lookup_ttl
+    with _lookup_lock:
+        _lookup_ttl = ttl
+        _lookups.clear()
+
+
+def netbox_clear_lookup_cache():
+    """Forget every cached device fqdn/id lookup."""
+    with _lookup_lock:
+        _lookups.clear()
+
+
+def _cached_lookup(key):
+    with _lookup_lock:
+        entry = _lookups.get(key)
+    if entry is not None and time.monotonic() - entry[0] < _lookup_ttl:
+        return entry[1]
+    return None
+
+
+def _cache_lookup(key, value):
+    if _lookup_ttl:
+        with _lookup_lock:
+            _lookups[key] = (time.monotonic(), value)
+
+
+# on-disk cache of NetBox list responses, None disables it
+_response_cache_path = None
+_response_cache_ttl = 0
+_response_cache_stats = {'fresh': 0, 'not_modified': 0, 'probed': 0, 'downloaded': 0}
+_response_cache_lock = threading.Lock()
+
+
+def netbox_set_response_cache(path, ttl=0):
+    """Keep the interface, VLAN, VRF and IP address lists read from NetBox in an on-disk cache.
+
+    Every netbox_post_*, netbox_patch_* and netbox_delete_* call deletes the cached lists of the endpoint it writes.
+    A cached list younger than `ttl` is reused as is, changes made outside these functions (another host, the NetBox
+    UI) are not seen until it expires. An older one is revalidated: with If-None-Match /
+    If-Modified-Since when NetBox sent an ETag or Last-Modified header (an unchanged list costs a 304), otherwise
+    with two one-object probes of the same query, neither depending on the result ordering: the object count
+    (a creation or deletion changes it) and the objects updated after the latest last_updated of the cached list
+    (an edit). The list is downloaded again unless the count is the same and no object was updated.
+
+    Parameters
+    ----------
+    path : str or None
+        Cache directory, created if it does not exist. None disables the cache (the default).
+    ttl : int or float, optional
+        Seconds a cached list is reused without asking NetBox, 0 (the default) revalidates on every read.
+
+    Returns
+    -------
+    None
+    """
+    global _response_cache_path, _response_cache_ttl
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+    with _response_cache_lock:
+        _response_cache_path = path
+        _response_cache_ttl = ttl
+
+
+def netbox_clear_response_cache():
+    """Delete every cached NetBox list response."""
+    if _response_cache_path is None:
+        return
+    for name in os.listdir(_response_cache_path):
+        if name.endswith('.json'):
+            os.remove(os.path.join(_response_cache_path, name))
+
+
+def netbox_get_response_cache_stats():
+    """Return how the cached list reads were served.
+
+    Returns
+    -------
+    dict[str, int]
+        'fresh' (younger than the TTL), 'not_modified' (304), 'probed' (unchanged per the last_updated probe) and
+        'downloaded' (full response) counts.
+    """
+    with _response_cache_lock:
+        return dict(_response_cache_stats)
+
+
+def _endpoint(url):
+    """Return the cache file prefix of a list endpoint, e.g. 'ipam-vlans' for .../api/ipam/vlans/."""
+    return '-'.join(url.split('/api/', 1)[1].strip('/').split('/')[:2])
+
+
+def _cache_file(url, headers, parameters):
+    # the token is part of the key, another token may see other objects
+    key = json.dumps([url, headers.get('Authorization'), sorted((parameters or {}).items())], default=str)
+    return os.path.join(_response_cache_path, '%s.%s.json' % (_endpoint(url), hashlib.sha256(key.encode()).hexdigest()))
+
+
+def _drop_cached(url):
+    """Delete the cached lists of the endpoint a write changed, the next read downloads them again."""
+    if _response_cache_path is None:
+        return
+    prefix = _endpoint(url) + '.'
+    for name in os.listdir(_response_cache_path):
+        if name.startswith(prefix) and name.endswith('.json'):
+            try:
+                os.remove(os.path.join(_response_cache_path, name))
+            except FileNotFoundError:
+                pass
+
+
+def _latest(results):
+    """Return the most recent last_updated of a list of NetBox objects."""
+    return max((item.get('last_updated') or '' for item in results), default='')
+
+
+def _count(stat):
+    with _response_cache_lock:
+        _response_cache_stats[stat] += 1
+
+
+def _unchanged(url, headers, parameters, entry):
+    """Return True if the query of a cached list without validators still has the same objects, unmodified."""
+    # same filters, one object: a creation or deletion changes the count
+    data = _session.get(url, headers=headers, params=dict(parameters or {}, limit=1)).json()
+    if data.get('count') != entry['count']:
+        return False
+    if not entry['count']:
+        return True
+    if not entry['latest']:
+        # objects without last_updated, an edit cannot be seen
+        return False
+    # objects updated since the cached list: a server ignoring the filter counts them all and the list is downloaded
+    probe = dict(parameters or {}, limit=1, last_updated__gt=entry['latest'])
+    return _session.get(url, headers=headers, params=probe).json().get('count') == 0
+
+
+def _write_entry(path, entry):
+    entry['stored'] = time.time()
+    # written aside and renamed, a concurrent reader never sees half a file
+    temporary = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(temporary, 'w') as f:
+        json.dump(entry, f)
+    os.replace(temporary, path)
+
+
+def _cached_get(url, headers, parameters):
+    """GET a NetBox list endpoint through the response cache, see `netbox_set_response_cache`.
+
+    Returns
+    -------
+    dict
+        The decoded JSON response.
+    """
+    if _response_cache_path is None:
+        return _session.get(url, headers=headers, params=parameters).json()
+
+    path = _cache_file(url, headers, parameters)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        entry = None
+
+    if entry is not None:
+        if time.time() - entry['stored'] < _response_cache_ttl:
+            _count('fresh')
+            return entry['data']
+
+        if entry['etag'] or entry['last_modified']:
+            conditional = dict(headers)
+            if entry['etag']:
+                conditional['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                conditional['If-Modified-Since'] = entry['last_modified']
+            response = _session.get(url, headers=conditional, params=parameters)
+            if response.status_code == 304:
+                _write_entry(path, entry)
+                _count('not_modified')
+                return entry['data']
+        elif _unchanged(url, headers, parameters, entry):
+            _write_entry(path, entry)
+            _count('probed')
+            return entry['data']
+        else:
+            response = _session.get(url, headers=headers, params=parameters)
+    else:
+        response = _session.get(url, headers=headers, params=parameters)
+
+    data = response.json()
+    _count('downloaded')
+    if response.status_code == 200 and 'results' in data:
+        _write_entry(path, {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+                            'count': data.get('count'), 'latest': _latest(data['results']), 'data': data})
+    return data
+
+
+def _get_all(url, headers, parameters):
+    """Return the results of every page of a NetBox list endpoint."""
+    results = []
+    while url:
+        data = _session.get(url, headers=headers, params=parameters).json()
+        results.extend(data['results'])
+        # the next page url already carries the filters
+        url, parameters = data['next'], None
+    return results
+
+
+# NetBox ids of the objects write payloads reference by name: kind -> {name: id}, None until loaded
+_references = None
+_references_lock = threading.Lock()
+# payload fields whose nested {'name': ...} references are rewritten, each is also the kind of object it references
+_REFERENCE_FIELDS = ['site', 'vrf', 'platform']
+
+
+def netbox_load_references(token):
+    """Load the ids of every site, VRF and platform, so write payloads reference them by id instead of by name.
+
+    Once loaded, nested name references such as {'site': {'name': 'AT1'}}, {'vrf': {'name': ...}} and
+    {'platform': {'name': ...}} in the payloads of the netbox_post_* and netbox_patch_* functions are replaced
+    by the object id, which NetBox does not have to look up on every write. Names that are not known are left as
+    they are, as are names shared by several objects. VRFs and platforms created through this module are added as
+    they are created. Tags keep their names, NetBox reads and writes them as name strings.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token for authentication.
+
+    Returns
+    -------
+    dict[str, int]
+        Number of ids loaded per kind ('site', 'vrf', 'platform').
+    """
+    global _references
+    myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
+    references = {}
+    for kind, url in [('site', 'http://netbox.solutionvalidation.center/api/dcim/sites/'),
+                      ('vrf', 'http://netbox.solutionvalidation.center/api/ipam/vrfs/'),
+                      ('platform', 'http://netbox.solutionvalidation.center/api/dcim/platforms/')]:
+        references[kind] = {}
+        for item in _get_all(url, myheaders, {'limit': 1000}):
+            _add_reference(references[kind], item)
+    with _references_lock:
+        _references = references
+    return dict((kind, sum(1 for id in ids.values() if id is not None)) for kind, ids in references.items())
+
+
+def netbox_clear_references():
+    """Forget the loaded ids, payloads are sent with their name references again."""
+    global _references
+    with _references_lock:
+        _references = None
+
+
+def _add_reference(ids, item):
+    # a name used twice (VRFs of different sites) is kept as None and stays a name reference, NetBox decides
+    ids[item['name']] = None if item['name'] in ids else item['id']
+
+
+def _resolve(payload):
+    """Return the payload (or list of payloads) with the known name references replaced by ids."""
+    if _references is None:
+        return payload
+    if isinstance(payload, list):
+        return [_resolve(item) for item in payload]
+    resolved = dict(payload)
+    with _references_lock:
+        for field in _REFERENCE_FIELDS:
+            value = payload.get(field)
+            if isinstance(value, dict) and set(value) == {'name'} and _references[field].get(value['name']) is not None:
+                resolved[field] = _references[field][value['name']]
+    return resolved
+
+
+def _remember(kind, response):
+    """Add the objects created by a successful POST to the loaded ids."""
+    if _references is None or response.status_code != 201:
+        return
+    data = response.json()
+    with _references_lock:
+        for item in data if isinstance(data, list) else [data]:
+            _add_reference(_references[kind], item)
+
 
 def netbox_get_sites():
     """Return the list of supported SVC site identifiers.
@@ -14,8 +323,87 @@ def netbox_get_sites():
     return svc_locations
 
 
+def netbox_get_site_devices(token, site):
+    """Return the SVC devices of a site, read with the exact site and tenant filters.
+
+    The list is cached for the lookup TTL, see `netbox_set_lookup_cache`, so the fqdn and id lookups of every role
+    of a site share one query.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token for authentication.
+    site : str
+        Site identifier to filter devices by.
+
+    Returns
+    -------
+    list[tuple[str, int]]
+        (name, NetBox device id) of every device, ordered by name.
+    """
+    devices = _cached_lookup(('devices', token, site))
+    if devices is not None:
+        return devices
+
+    myheaders = {'Authorization': 'Token ' + token}
+    data = _get_all('http://netbox.solutionvalidation.center/api/dcim/devices/', myheaders,
+                    {'site': site, 'tenant': 'svc', 'limit': 1000})
+    devices = sorted((item['name'], item['id']) for item in data)
+    _cache_lookup(('devices', token, site), devices)
+    return devices
+
+
+def netbox_device_matches(name, device):
+    """Return True if a device name is the hostname of a role.
+
+    The role must be a whole '-' separated part of the first label, optionally with an 'svc' prefix: 'br1' matches
+    'br1-svc.at1.corp.equinix.com', 'svc-br1.ld5.corp.eu.equinix.com' and 'svcbr1.ld5.corp.eu.equinix.com', 'csw1'
+    does not match 'csw10-svc.at1.corp.equinix.com'.
+
+    Parameters
+    ----------
+    name : str
+        NetBox device name.
+    device : str
+        Device role (e.g. 'br1', 'csw1').
+
+    Returns
+    -------
+    bool
+    """
+    for part in name.lower().split('.')[0].split('-'):
+        if part == device or part == 'svc' + device:
+            return True
+    return False
+
+
+def netbox_find_device(token, site, device):
+    """Return the device of a site whose hostname is the role, see `netbox_device_matches`.
+
+    With several matches the first by name is returned.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token for authentication.
+    site : str
+        Site identifier.
+    device : str
+        Device role (e.g. 'br1', 'csw1').
+
+    Returns
+    -------
+    tuple[str, int] or None
+        (name, NetBox device id), None if the site has no such device.
+    """
+    for name, device_id in netbox_get_site_devices(token, site):
+        if netbox_device_matches(name, device):
+            return name, device_id
+    return None
+
+
 def netbox_get_fqdn(token, site, device):
-    """Query NetBox for a device and return its FQDN/name.
+    """Return the FQDN/name of a device, see `netbox_find_device`.
 
     Parameters
     ----------
@@ -24,26 +412,21 @@ def netbox_get_fqdn(token, site, device):
     site : str
         Site identifier to filter devices by.
     device : str
-        Search string for the device (e.g. 'br1', 'csw1').
+        Device role (e.g. 'br1', 'csw1').
 
     Returns
     -------
     str
         Device FQDN/name if found, otherwise the string 'none'.
     """
-    myheaders = {'Authorization': 'Token ' + token}
-    parameters = {'site': site, 'q': device}
-    data = requests.get('http://netbox.solutionvalidation.center/api/dcim/devices/', headers=myheaders, params=parameters)
-    data = data.json()
-    try:
-        fqdn = data['results'][0]['name']
-    except:
-        fqdn = 'none'
-    return fqdn
+    found = netbox_find_device(token, site, device)
+    if found is None:
+        return 'none'
+    return found[0]
 
 
-def netbox_get_vlan_dictionary(token, site, device):
-    """Return a mapping of VLAN tag to NetBox VLAN ID for a site and device filter.
+def netbox_get_vlan_dictionaries(token, site, descriptions, vids=None):
+    """Return the VLANs of a site partitioned by description, e.g. ['qfx', 'mx'], with a single query.
 
     Parameters
     ----------
@@ -51,28 +434,54 @@ def netbox_get_vlan_dictionary(token, site, device):
         NetBox API token for authentication.
     site : str
         Site identifier to filter VLANs by.
-    device : str
-        Search/filter term for VLANs (passed as 'q' to the API).
+    descriptions : list[str]
+        VLAN descriptions to return, the sync functions describe the VLANs of each device by its type.
+    vids : list[int], optional
+        Return only these VLAN VIDs.
 
     Returns
     -------
-    dict[int, int] or dict
-        Mapping of VLAN VID (int) -> NetBox VLAN object id (int). If the request fails or no data is present,
-        returns {'none': 'none'}.
+    dict[str, dict]
+        Mapping of description -> {VLAN VID (int): NetBox VLAN object id (int)}. If the request fails every
+        description maps to {'none': 'none'}.
     """
     myheaders = {'Authorization' : 'Token '+ token}
-    parameters = {'q' : device, 'site': site, 'limit' : 100000}
-    data = requests.get('http://netbox.solutionvalidation.center/api/ipam/vlans/', headers=myheaders, params=parameters)
-    data = data.json()
-    results = {}
+    parameters = {'site': site, 'limit' : 100000}
+    if vids is not None:
+        parameters['vid'] = list(vids)
+    data = _cached_get('http://netbox.solutionvalidation.center/api/ipam/vlans/', myheaders, parameters)
+    results = dict((description, {}) for description in descriptions)
     try:
-        for i in range(len(data['results'])):
-            results.update({data['results'][i]['vid'] : data['results'][i]['id']})
+        for item in data['results']:
+            if item['description'] in results:
+                results[item['description']][item['vid']] = item['id']
     except:
-        results = {'none': 'none'}
+        results = dict((description, {'none': 'none'}) for description in descriptions)
     return results
 
 
+def netbox_get_vlan_dictionary(token, site, device, vids=None):
+    """Return a mapping of VLAN tag to NetBox VLAN ID for a site and device type.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token for authentication.
+    site : str
+        Site identifier to filter VLANs by.
+    device : str
+        Device type the VLANs are described with ('qfx' or 'mx'), see `netbox_get_vlan_dictionaries`.
+    vids : list[int], optional
+        Return only these VLAN VIDs.
+
+    Returns
+    -------
+    dict[int, int] or dict
+        Mapping of VLAN VID (int) -> NetBox VLAN object id (int). If the request fails, returns {'none': 'none'}.
+    """
+    return netbox_get_vlan_dictionaries(token, site, [device], vids)[device]
+
+
 def netbox_delete_vlan(token, id):
     """Delete a VLAN object from NetBox.
 
@@ -89,7 +498,8 @@ def netbox_delete_vlan(token, id):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization' : 'Token '+ token, 'Content-Type': 'application/json'}
-    data = requests.delete('http://netbox.solutionvalidation.center/api/ipam/vlans/'+ str(id)+ '/', headers=myheaders)
+    data = _session.delete('http://netbox.solutionvalidation.center/api/ipam/vlans/'+ str(id)+ '/', headers=myheaders)
+    _drop_cached('http://netbox.solutionvalidation.center/api/ipam/vlans/')
     return data.status_code
 
 
@@ -109,12 +519,13 @@ def netbox_post_vlan(token, payload):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization' : 'Token '+ token, 'Content-Type': 'application/json'}
-    data = requests.post('http://netbox.solutionvalidation.center/api/ipam/vlans/', headers=myheaders, json=payload)
+    data = _session.post('http://netbox.solutionvalidation.center/api/ipam/vlans/', headers=myheaders, json=_resolve(payload))
+    _drop_cached('http://netbox.solutionvalidation.center/api/ipam/vlans/')
     return data.status_code
 
 
 def netbox_get_id(token, location, device):
-    """Return the NetBox device id for a device matching location and name.
+    """Return the NetBox device id of a device, see `netbox_find_device`.
 
     Parameters
     ----------
@@ -123,22 +534,20 @@ def netbox_get_id(token, location, device):
     location : str
         Site/location code to filter devices by.
     device : str
-        Search string for the device.
+        Device role (e.g. 'br1', 'csw1').
 
     Returns
     -------
     int
-        NetBox device id (raises if no results are found).
+        NetBox device id (raises ValueError if the site has no such device).
     """
-    myheaders = {'Authorization': 'Token ' + token}
-    parameters = {'q': device, 'site': location, 'tenant' : 'svc'}
-    data = requests.get('http://netbox.solutionvalidation.center/api/dcim/devices/', headers=myheaders, params=parameters)
-    data = data.json()
-    results = data['results'][0]['id']
-    return results
+    found = netbox_find_device(token, location, device)
+    if found is None:
+        raise ValueError("No SVC device '%s' at site '%s' in NetBox" % (device, location))
+    return found[1]
 
 
-def netbox_get_interfaces(token, id):
+def netbox_get_interfaces(token, id, names=None):
     """Fetch interfaces for a NetBox device and return a structured mapping.
 
     Parameters
@@ -147,6 +556,8 @@ def netbox_get_interfaces(token, id):
         NetBox API token for authentication.
     id : int
         NetBox device id to list interfaces for.
+    names : list[str], optional
+        Return only these interface names.
 
     Returns
     -------
@@ -158,9 +569,10 @@ def netbox_get_interfaces(token, id):
         - 'speed' (str): human-readable speed tag
     """
     myheaders = {'Authorization' : 'Token '+ token}
-    parameters = {'q' : '', 'device_id' : id, 'limit' : 100000}
-    data = requests.get('http://netbox.solutionvalidation.center/api/dcim/interfaces/', headers=myheaders, params=parameters)
-    data = data.json()
+    parameters = {'device_id' : id, 'limit' : 100000}
+    if names is not None:
+        parameters['name'] = list(names)
+    data = _cached_get('http://netbox.solutionvalidation.center/api/dcim/interfaces/', myheaders, parameters)
     results = {}
     for i in range(len(data['results'])):
         if 'vcp' not in data['results'][i]['name'] and 'member' not in data['results'][i]['name'] and 'vlan' not in data['results'][i]['name']:
@@ -213,7 +625,8 @@ def netbox_post_interface(token, payload):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.post('http://netbox.solutionvalidation.center/api/dcim/interfaces/', headers=myheaders, json=payload)
+    data = _session.post('http://netbox.solutionvalidation.center/api/dcim/interfaces/', headers=myheaders, json=payload)
+    _drop_cached('http://netbox.solutionvalidation.center/api/dcim/interfaces/')
     return data.status_code
 
 
@@ -233,7 +646,8 @@ def netbox_delete_interface(token, id):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.delete('http://netbox.solutionvalidation.center/api/dcim/interfaces/'+ str(id)+ '/', headers=myheaders)
+    data = _session.delete('http://netbox.solutionvalidation.center/api/dcim/interfaces/'+ str(id)+ '/', headers=myheaders)
+    _drop_cached('http://netbox.solutionvalidation.center/api/dcim/interfaces/')
     return data.status_code
 
 
@@ -255,7 +669,8 @@ def netbox_patch_interface(token, interface_id, payload):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.patch('http://netbox.solutionvalidation.center/api/dcim/interfaces/'+ str(interface_id)+'/', headers=myheaders, json=payload)
+    data = _session.patch('http://netbox.solutionvalidation.center/api/dcim/interfaces/'+ str(interface_id)+'/', headers=myheaders, json=payload)
+    _drop_cached('http://netbox.solutionvalidation.center/api/dcim/interfaces/')
     return data.status_code
 
 
@@ -275,8 +690,8 @@ def netbox_get_ipv4_public_prefix(token, site):
         The prefix string (e.g. '64.191.201.0/24'), or an empty string if none found.
     """
     myheaders = {'Authorization' : 'Token '+ token}
-    parameters = {'q' : '', 'role': site+'-ipv4-public-ip-space'}
-    data = requests.get('http://netbox.solutionvalidation.center/api/ipam/prefixes/', headers=myheaders, params=parameters)
+    parameters = {'role': site+'-ipv4-public-ip-space'}
+    data = _session.get('http://netbox.solutionvalidation.center/api/ipam/prefixes/', headers=myheaders, params=parameters)
     data = data.json()
     results = ''
     for i in range(len(data['results'])):
@@ -284,7 +699,7 @@ def netbox_get_ipv4_public_prefix(token, site):
     return results
 
 
-def netbox_get_ipv4_public_routes(token, site):
+def netbox_get_ipv4_public_routes(token, site, addresses=None):
     """Return IPv4 public addresses (children of the site's public prefix) from NetBox.
 
     Parameters
@@ -293,6 +708,8 @@ def netbox_get_ipv4_public_routes(token, site):
         NetBox API token for authentication.
     site : str
         Site identifier to locate the parent public prefix.
+    addresses : list[str], optional
+        Return only these addresses (CIDR strings, e.g. '64.191.201.2/31').
 
     Returns
     -------
@@ -303,9 +720,10 @@ def netbox_get_ipv4_public_routes(token, site):
     parent_prefix = netbox_get_ipv4_public_prefix(token, site)
     if parent_prefix == '':
         parent_prefix = '1.1.1.0/30'
-    parameters = {'q' : '', 'parent': parent_prefix, 'limit' : 100000}
-    data = requests.get('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/', headers=myheaders, params=parameters)
-    data = data.json()
+    parameters = {'parent': parent_prefix, 'limit' : 100000}
+    if addresses is not None:
+        parameters['address'] = list(addresses)
+    data = _cached_get('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/', myheaders, parameters)
     results={}
     for i in range(len(data['results'])):
         results.update({data['results'][i]['address']:{'id':data['results'][i]['id'], 'description': data['results'][i]['description']}})
@@ -330,7 +748,8 @@ def netbox_patch_ip_address(token, ip_id, payload):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.patch('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/'+ str(ip_id)+'/', headers=myheaders, json=payload)
+    data = _session.patch('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/'+ str(ip_id)+'/', headers=myheaders, json=payload)
+    _drop_cached('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/')
     return data.status_code
 
 
@@ -350,7 +769,8 @@ def netbox_post_ip_address(token, payload):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.post('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/', headers=myheaders, json=payload)
+    data = _session.post('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/', headers=myheaders, json=_resolve(payload))
+    _drop_cached('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/')
     return data.status_code
 
 
@@ -370,11 +790,12 @@ def netbox_delete_ip_address(token, ip_id):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.delete('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/'+ str(ip_id)+ '/', headers=myheaders)
+    data = _session.delete('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/'+ str(ip_id)+ '/', headers=myheaders)
+    _drop_cached('http://netbox.solutionvalidation.center/api/ipam/ip-addresses/')
     return data.status_code
 
 
-def netbox_get_vrfs(token, site):
+def netbox_get_vrfs(token, site, names=None):
     """Return VRFs for a given site from NetBox with selected metadata.
 
     Parameters
@@ -383,6 +804,8 @@ def netbox_get_vrfs(token, site):
         NetBox API token for authentication.
     site : str
         Site identifier to filter VRFs by (custom field 'Site').
+    names : list[str], optional
+        Return only these VRF names.
 
     Returns
     -------
@@ -395,9 +818,10 @@ def netbox_get_vrfs(token, site):
         - 'site' : custom field 'Site'
     """
     myheaders = {'Authorization' : 'Token '+ token, 'Content-Type': 'application/json'}
-    parameters = {'q':'', 'cf_Site':site, 'limit' : 100000}
-    data = requests.get('http://netbox.solutionvalidation.center/api/ipam/vrfs/',headers=myheaders, params=parameters)
-    data = data.json()
+    parameters = {'cf_Site':site, 'limit' : 100000}
+    if names is not None:
+        parameters['name'] = list(names)
+    data = _cached_get('http://netbox.solutionvalidation.center/api/ipam/vrfs/', myheaders, parameters)
     results={}
     for i in range(len(data['results'])):
         results.update({data['results'][i]['name']:{'id':data['results'][i]['id'],'instance_type':data['results'][i]['custom_fields']['type'],
@@ -422,7 +846,9 @@ def netbox_post_vrf(token, payload):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.post('http://netbox.solutionvalidation.center/api/ipam/vrfs/', headers=myheaders, json=payload)
+    data = _session.post('http://netbox.solutionvalidation.center/api/ipam/vrfs/', headers=myheaders, json=_resolve(payload))
+    _drop_cached('http://netbox.solutionvalidation.center/api/ipam/vrfs/')
+    _remember('vrf', data)
     return data.status_code
 
 
@@ -444,7 +870,8 @@ def netbox_patch_vrf(token, vrf_id, payload):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.patch('http://netbox.solutionvalidation.center/api/ipam/vrfs/'+ str(vrf_id)+'/', headers=myheaders, json=payload)
+    data = _session.patch('http://netbox.solutionvalidation.center/api/ipam/vrfs/'+ str(vrf_id)+'/', headers=myheaders, json=payload)
+    _drop_cached('http://netbox.solutionvalidation.center/api/ipam/vrfs/')
     return data.status_code
 
 
@@ -464,7 +891,8 @@ def netbox_delete_vrf(token, vrf_id):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.delete('http://netbox.solutionvalidation.center/api/ipam/vrfs/'+ str(vrf_id)+ '/', headers=myheaders)
+    data = _session.delete('http://netbox.solutionvalidation.center/api/ipam/vrfs/'+ str(vrf_id)+ '/', headers=myheaders)
+    _drop_cached('http://netbox.solutionvalidation.center/api/ipam/vrfs/')
     return data.status_code
 
 
@@ -482,11 +910,10 @@ def netbox_get_platforms(token):
         List of platform names as strings.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.get('http://netbox.solutionvalidation.center/api/dcim/platforms/', headers=myheaders)
-    data = data.json()
+    data = _get_all('http://netbox.solutionvalidation.center/api/dcim/platforms/', myheaders, {'limit': 1000})
     results = []
-    for i in range(len(data['results'])):
-        results.append(data['results'][i]['name'])
+    for i in range(len(data)):
+        results.append(data[i]['name'])
     return results
 
 
@@ -506,10 +933,70 @@ def netbox_post_platform(token, payload):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.post('http://netbox.solutionvalidation.center/api/dcim/platforms/', headers=myheaders, json=payload)
+    data = _session.post('http://netbox.solutionvalidation.center/api/dcim/platforms/', headers=myheaders, json=payload)
+    _drop_cached('http://netbox.solutionvalidation.center/api/dcim/platforms/')
+    _remember('platform', data)
     return data.status_code
 
 
+def netbox_post_platforms(token, payloads):
+    """Create several platforms (software versions) in NetBox with one bulk request.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token for authentication.
+    payloads : list[dict]
+        JSON payloads for platform creation (e.g. [{'name': ..., 'slug': ...}]).
+
+    Returns
+    -------
+    int
+        HTTP status code returned by the NetBox API.
+    """
+    myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
+    data = _session.post('http://netbox.solutionvalidation.center/api/dcim/platforms/', headers=myheaders, json=payloads)
+    _drop_cached('http://netbox.solutionvalidation.center/api/dcim/platforms/')
+    _remember('platform', data)
+    return data.status_code
+
+
+def netbox_get_devices(token, sites=None):
+    """Return every SVC device with its current platform and upgrade flag, reading all pages of dcim/devices.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token for authentication.
+    sites : list[str], optional
+        Site identifiers to filter devices by, by default every site.
+
+    Returns
+    -------
+    list[dict]
+        One dict per device, ordered by name, with keys:
+        - 'id' : NetBox device id
+        - 'name' : device name (FQDN)
+        - 'site' : site identifier
+        - 'platform' : platform name, or 'none' (see `netbox_get_device_platform`)
+        - 'upgrade' : custom field 'upgrade', None when the device has no platform
+    """
+    myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
+    parameters = {'tenant': 'svc', 'limit': 1000}
+    if sites is not None:
+        parameters['site'] = list(sites)
+    data = _get_all('http://netbox.solutionvalidation.center/api/dcim/devices/', myheaders, parameters)
+    results = []
+    for device in data:
+        if device['platform'] is not None:
+            platform, upgrade = device['platform']['name'], device['custom_fields']['upgrade']
+        else:
+            platform, upgrade = 'none', None
+        results.append({'id': device['id'], 'name': device['name'], 'site': device['site']['slug'],
+                        'platform': platform, 'upgrade': upgrade})
+    return results
+
+
 def netbox_get_device_platform(token, device_id):
     """Get the current platform name and upgrade flag for a device in NetBox.
 
@@ -527,7 +1014,7 @@ def netbox_get_device_platform(token, device_id):
         and upgrade_flag is the device's custom_fields['upgrade'] value or None.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.get('http://netbox.solutionvalidation.center/api/dcim/devices/'+ str(device_id)+'/', headers=myheaders)
+    data = _session.get('http://netbox.solutionvalidation.center/api/dcim/devices/'+ str(device_id)+'/', headers=myheaders)
     data = data.json()
     if data['platform'] is not None:
         platform = data['platform']['name']
@@ -556,5 +1043,27 @@ def netbox_patch_device_platform(token, device_id, payload):
         HTTP status code returned by the NetBox API.
     """
     myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
-    data = requests.patch('http://netbox.solutionvalidation.center/api/dcim/devices/'+ str(device_id)+'/', headers=myheaders, json=payload)
-    return data.status_code
\ No newline at end of file
+    data = _session.patch('http://netbox.solutionvalidation.center/api/dcim/devices/'+ str(device_id)+'/', headers=myheaders, json=_resolve(payload))
+    _drop_cached('http://netbox.solutionvalidation.center/api/dcim/devices/')
+    return data.status_code
+
+
+def netbox_patch_devices(token, payloads):
+    """Patch several devices in NetBox with one bulk request.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token for authentication.
+    payloads : list[dict]
+        JSON payloads, each with the device 'id' and the fields to update.
+
+    Returns
+    -------
+    int
+        HTTP status code returned by the NetBox API.
+    """
+    myheaders = {'Authorization': 'Token ' + token, 'Content-Type': 'application/json'}
+    data = _session.patch('http://netbox.solutionvalidation.center/api/dcim/devices/', headers=myheaders, json=_resolve(payloads))
+    _drop_cached('http://netbox.solutionvalidation.center/api/dcim/devices/')
+    return data.status_code
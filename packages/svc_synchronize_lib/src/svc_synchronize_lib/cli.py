@@ -0,0 +1,247 @@
+"""
+svc-sync: run sync functions for selected sites, optionally profiled, timed per phase or as a dry run
+
+    NETBOX_TOKEN=... JUNOS_USERNAME=... JUNOS_PASSWORD=... svc-sync --sites at1 ld5 --syncs sync_mx_interfaces --timings
+    svc-sync --dry-run --profile profiles/ --output run.json
+    svc-sync --timeout-history timeouts.json
+
+The result is one JSON document (stdout or --output) with an entry per site and sync function: planned change
+count, write statuses, errors, and with the options the phase timings, the profile file and its hottest functions.
+With --timeout-history the device timeouts adapt to the recorded durations, a sync stopped by a device exceeding
+its budget is run again at the end with the maximum timeouts, and every timeout decision is added to the result.
+With --drift-cache the drift each sync found is recorded for the dashboards, see `drift.DriftCache`.
+"""
+import argparse
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+from svc_juniper_lib import facts
+from svc_juniper_lib import juniper
+from svc_juniper_lib import timeouts
+from svc_netbox_lib import netbox
+
+from . import drift
+from . import synchronize
+
+# functions timed as each read phase, every function of the module with the prefix
+_READ_PHASES = [('device', juniper, 'juniper_get_'), ('netbox', netbox, 'netbox_get_')]
+
+
+class PhaseTimer:
+    """Accumulate the wall clock time of one sync run per phase: 'device' (juniper_get_* calls, RPC and parsing),
+    'netbox' (netbox_get_* calls), 'diff' (the rest of planning) and 'write' (applying the changes).
+
+    While entered, the juniper_get_* and netbox_get_* functions are replaced by timed wrappers on their modules,
+    which is where the planners look them up.
+    """
+
+    def __init__(self):
+        self.seconds = {'device': 0.0, 'netbox': 0.0, 'diff': 0.0, 'write': 0.0}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._originals = []
+
+    def _wrap(self, phase, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            # nested reads (netbox_get_ipv4_public_routes reads the prefix first) are counted once
+            if getattr(self._local, 'active', False):
+                return function(*args, **kwargs)
+            self._local.active = True
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.active = False
+                with self._lock:
+                    self.seconds[phase] += time.perf_counter() - start
+        return timed
+
+    def __enter__(self):
+        for phase, module, prefix in _READ_PHASES:
+            for name in dir(module):
+                function = getattr(module, name)
+                if name.startswith(prefix) and callable(function):
+                    self._originals.append((module, name, function))
+                    setattr(module, name, self._wrap(phase, function))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for module, name, function in self._originals:
+            setattr(module, name, function)
+        self._originals = []
+
+    def planned(self, seconds):
+        """Book the planning time not spent reading the devices or NetBox as 'diff'."""
+        self.seconds['diff'] += max(seconds - self.seconds['device'] - self.seconds['netbox'], 0.0)
+
+
+def _hot_functions(profile, count):
+    """Return the `count` functions with the highest cumulative time of a profile."""
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    results = []
+    for (filename, line, name), (calls, _, total, cumulative, _) in stats.stats.items():
+        results.append({'function': '%s:%d(%s)' % (filename, line, name), 'calls': calls,
+                        'total': round(total, 6), 'cumulative': round(cumulative, 6)})
+    return sorted(results, key=lambda item: item['cumulative'], reverse=True)[:count]
+
+
+def run(token, site, sync, username, password, dry_run=False, timings=False, profile=None, top=20):
+    """Plan one sync function for one site and, unless a dry run, write its changes.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    site : str
+        Site identifier.
+    sync : str
+        Name of the sync function, a key of `synchronize.PLANNERS`.
+    username : str
+        Juniper device username.
+    password : str
+        Juniper device password.
+    dry_run : bool, optional
+        Only plan, the changes are returned instead of written.
+    timings : bool, optional
+        Add the phase breakdown, see `PhaseTimer`.
+    profile : str, optional
+        Directory to write the cProfile stats of the run to, as <site>.<sync>.prof.
+    top : int, optional
+        Number of hottest functions of the profile to return.
+
+    Returns
+    -------
+    dict
+        'site', 'sync', 'seconds', 'planned' (change count), 'statuses' (HTTP status of every write, None on a dry
+        run), 'failed' (writes with a status of 400 or above), 'error' (None, or the exception that stopped the
+        run), 'deferred' (stopped by a device exceeding its timeout budget, see `timeouts.TimeoutPolicy`), and
+        depending on the options 'changes', 'timings', 'profile' and 'hot'.
+    """
+    result = {'site': site, 'sync': sync, 'planned': 0, 'statuses': None, 'failed': 0, 'error': None,
+              'deferred': False}
+    timer = PhaseTimer()
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    try:
+        with timer if timings else contextlib.nullcontext():
+            if profiler is not None:
+                profiler.enable()
+            try:
+                changes = synchronize.PLANNERS[sync](token, site, username, password)
+                timer.planned(time.perf_counter() - start)
+                result['planned'] = len(changes)
+                if dry_run:
+                    result['changes'] = changes
+                else:
+                    write_start = time.perf_counter()
+                    result['statuses'] = synchronize.apply_changes(token, changes)
+                    timer.seconds['write'] = time.perf_counter() - write_start
+                    result['failed'] = sum(1 for status in result['statuses'] if status >= 400)
+                drift.record(site, sync, changes, written=not dry_run and result['failed'] == 0)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    except timeouts.DeviceDeferred as e:
+        result['error'] = repr(e)
+        result['deferred'] = True
+    except Exception as e:
+        result['error'] = repr(e)
+        drift.record(site, sync, None, error=result['error'])
+    result['seconds'] = time.perf_counter() - start
+
+    if timings:
+        result['timings'] = timer.seconds
+    if profiler is not None:
+        os.makedirs(profile, exist_ok=True)
+        result['profile'] = os.path.join(profile, '%s.%s.prof' % (site, sync))
+        profiler.dump_stats(result['profile'])
+        result['hot'] = _hot_functions(profiler, top)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='svc-sync', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sites', nargs='+', help='site identifiers, by default every SVC site')
+    parser.add_argument('--syncs', nargs='+', choices=list(synchronize.PLANNERS),
+                        help='sync functions, by default all of them')
+    parser.add_argument('--dry-run', action='store_true', help='plan only and output the changes')
+    parser.add_argument('--timings', action='store_true', help='time device reads, NetBox reads, diff and writes')
+    parser.add_argument('--profile', metavar='DIRECTORY', help='write cProfile stats per site and sync function')
+    parser.add_argument('--top', type=int, default=20, help='hottest functions reported per profile')
+    parser.add_argument('--resolve-ids', action='store_true',
+                        help='send site, VRF and platform ids instead of names in the NetBox writes')
+    parser.add_argument('--timeout-history', metavar='FILE',
+                        help='adapt device timeouts to the durations recorded in this file, retry slow devices last')
+    parser.add_argument('--response-cache', metavar='DIRECTORY',
+                        help='keep NetBox list responses here and revalidate them instead of downloading them again')
+    parser.add_argument('--facts-cache', metavar='FILE',
+                        help='keep the device facts in this file, facts are reused for version lookups between runs')
+    parser.add_argument('--drift-cache', metavar='FILE',
+                        help='record the drift every sync found in this file, see svc_synchronize_lib.drift')
+    parser.add_argument('--output', help='write the JSON result to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    token, username, password = (os.environ['NETBOX_TOKEN'], os.environ['JUNOS_USERNAME'],
+                                 os.environ['JUNOS_PASSWORD'])
+    if args.resolve_ids:
+        netbox.netbox_load_references(token)
+    if args.response_cache:
+        netbox.netbox_set_response_cache(args.response_cache)
+    if args.facts_cache:
+        facts.set_facts_cache(args.facts_cache)
+    policy = timeouts.TimeoutPolicy(args.timeout_history) if args.timeout_history else None
+    previous = timeouts.set_timeout_policy(policy)
+    cache = drift.DriftCache(args.drift_cache) if args.drift_cache else None
+    previous_cache = drift.set_drift_cache(cache)
+    try:
+        results = []
+        for site in args.sites or netbox.netbox_get_sites():
+            for sync in args.syncs or synchronize.PLANNERS:
+                results.append(run(token, site, sync, username, password, args.dry_run, args.timings, args.profile,
+                                   args.top))
+        # the retry lane: syncs stopped by a slow device, once every other sync is done
+        with timeouts.retry_lane():
+            for index, item in enumerate(results):
+                if item['deferred']:
+                    results[index] = run(token, item['site'], item['sync'], username, password, args.dry_run,
+                                         args.timings, args.profile, args.top)
+                    results[index]['retried'] = True
+    finally:
+        timeouts.set_timeout_policy(previous)
+        drift.set_drift_cache(previous_cache)
+        if cache is not None:
+            cache.save()
+
+    totals = {'seconds': sum(item['seconds'] for item in results),
+              'planned': sum(item['planned'] for item in results),
+              'failed': sum(item['failed'] for item in results),
+              'errors': sum(1 for item in results if item['error'] is not None),
+              'retried': sum(1 for item in results if item.get('retried'))}
+    if args.timings:
+        totals['timings'] = dict((phase, sum(item['timings'][phase] for item in results))
+                                 for phase in ('device', 'netbox', 'diff', 'write'))
+    output = {'dry_run': args.dry_run, 'totals': totals, 'runs': results}
+    if policy is not None:
+        policy.save()
+        output['timeouts'] = policy.report()
+    document = json.dumps(output, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        sys.stdout.write(document + '\n')
+    return 1 if totals['failed'] or totals['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
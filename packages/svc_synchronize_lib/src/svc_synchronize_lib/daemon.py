@@ -0,0 +1,302 @@
+"""
+Resident sync daemon: warm NETCONF and NetBox connections, in-memory lookups and a deduplicating job queue
+
+    NETBOX_TOKEN=... JUNOS_USERNAME=... JUNOS_PASSWORD=... python -m svc_synchronize_lib.daemon --port 8765
+
+Jobs are JSON lines sent to the daemon socket, e.g. {"site": "at1", "role": "br1", "object_type": "vlans"}.
+With --drift-cache the daemon keeps the drift found by every task (see `drift.DriftCache`), {"drift": "at1"} is
+answered with the report of a site and {"drift": null} with the overview.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+
+from svc_juniper_lib import facts
+from svc_juniper_lib import sessions
+from svc_netbox_lib import netbox
+
+from . import drift
+from . import synchronize
+
+logger = logging.getLogger(__name__)
+
+# sync function for every (device role, object type), br1 and csw1 share the VLAN sync
+OBJECT_SYNCS = {
+    ('br1', 'vlans'): synchronize.sync_mx_qfx_netbox_vlans,
+    ('csw1', 'vlans'): synchronize.sync_mx_qfx_netbox_vlans,
+    ('br1', 'interfaces'): synchronize.sync_mx_interfaces,
+    ('csw1', 'interfaces'): synchronize.sync_qfx_interfaces,
+    ('ls1', 'interfaces'): synchronize.sync_ex_interfaces,
+    ('br1', 'routes'): synchronize.sync_mx_netbox_public_ipv4_routes,
+    ('br1', 'vrfs'): synchronize.sync_netbox_mx_vrfs,
+    ('br1', 'platform'): synchronize.sync_mx_platform_version,
+    ('csw1', 'platform'): synchronize.sync_qfx_platform_version,
+    ('ls1', 'platform'): synchronize.sync_ex_platform_version,
+}
+
+
+def expand_job(site, role=None, object_type=None):
+    """Return the (site, sync function) tasks of a job, without duplicates.
+
+    Parameters
+    ----------
+    site : str
+        Site identifier.
+    role : str, optional
+        Device role ('br1', 'csw1' or 'ls1'), None for every role.
+    object_type : str, optional
+        'vlans', 'interfaces', 'routes', 'vrfs' or 'platform', None for every object type of the role.
+
+    Returns
+    -------
+    list[tuple]
+        (site, sync function) tasks in OBJECT_SYNCS order.
+    """
+    tasks = []
+    for (sync_role, sync_type), sync in OBJECT_SYNCS.items():
+        if role not in (None, sync_role) or object_type not in (None, sync_type):
+            continue
+        if (site, sync) not in tasks:
+            tasks.append((site, sync))
+    if not tasks:
+        raise ValueError("Unknown sync job: site '%s', role '%s', object type '%s'" % (site, role, object_type))
+    return tasks
+
+
+class SyncDaemon:
+    """Run sync jobs from a queue in a resident process.
+
+    While started, NETCONF sessions are borrowed from a shared `SessionPool`, NetBox calls reuse one HTTP
+    session and device fqdn/id lookups are cached, so a job only pays for its RPCs and NetBox writes.
+
+    Device facts are cached for `facts_ttl` rather than the one day default: facts captured by an interface or VLAN
+    job serve the platform jobs that follow it, and a platform job never writes a version older than that to NetBox
+    after an upgrade (the platform syncs ask for facts younger than `facts.RECENT` in any case).
+
+    A job expands into one task per sync function. A task that is already queued is not queued again, and a
+    task submitted while it runs is queued once more after it finishes, so overlapping jobs coalesce.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    username : str
+        Username for Juniper device authentication.
+    password : str
+        Password for Juniper device authentication.
+    workers : int, optional
+        Number of tasks run at the same time.
+    sessions_per_device : int, optional
+        Maximum open NETCONF sessions per device.
+    max_idle : int or float, optional
+        Seconds an idle NETCONF session is kept open.
+    lookup_ttl : int or float, optional
+        Seconds NetBox device fqdn/id lookups are cached.
+    facts_ttl : int or float, optional
+        Seconds device facts are cached.
+    facts_cache : str, optional
+        JSON file the device facts are kept in, see `facts.set_facts_cache`.
+    """
+
+    def __init__(self, token, username, password, workers=1, sessions_per_device=2, max_idle=300, lookup_ttl=3600,
+                 facts_ttl=facts.RECENT, facts_cache=None):
+        self.token = token
+        self.username = username
+        self.password = password
+        self.workers = workers
+        self.lookup_ttl = lookup_ttl
+        self.facts_ttl = facts_ttl
+        self.facts_cache = facts_cache
+        self.pool = sessions.SessionPool(size=sessions_per_device, max_idle=max_idle)
+        self.stats = {'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0}
+        self._queue = collections.deque()
+        self._queued = set()
+        self._running = set()
+        self._rerun = set()
+        self._threads = []
+        self._stopping = False
+        self._previous_pool = None
+        self._condition = threading.Condition()
+
+    def start(self):
+        """Install the shared session pool, lookup cache and facts cache and start the worker threads."""
+        self._previous_pool = sessions.set_session_pool(self.pool)
+        netbox.netbox_set_lookup_cache(self.lookup_ttl)
+        facts.set_facts_cache(self.facts_cache, self.facts_ttl)
+        self._stopping = False
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name='sync-worker-%d' % number, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Finish the running tasks, drop the queue, close the NETCONF sessions and restore the previous pool."""
+        with self._condition:
+            self._stopping = True
+            self._queue.clear()
+            self._queued.clear()
+            self._rerun.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        sessions.set_session_pool(self._previous_pool)
+        self.pool.close()
+
+    def submit(self, site, role=None, object_type=None):
+        """Queue a sync job.
+
+        Parameters
+        ----------
+        site : str
+            Site identifier.
+        role : str, optional
+            Device role, None for every role.
+        object_type : str, optional
+            Object type, None for every object type of the role.
+
+        Returns
+        -------
+        int
+            Number of tasks added to the queue, the other tasks of the job were coalesced with queued or running ones.
+        """
+        tasks = expand_job(site, role, object_type)
+        queued = 0
+        with self._condition:
+            for task in tasks:
+                self.stats['submitted'] += 1
+                if task in self._queued or task in self._rerun:
+                    self.stats['coalesced'] += 1
+                elif task in self._running:
+                    self._rerun.add(task)
+                    queued += 1
+                else:
+                    self._queue.append(task)
+                    self._queued.add(task)
+                    queued += 1
+            self._condition.notify_all()
+        return queued
+
+    def wait(self, timeout=None):
+        """Block until the queue is empty and no task is running. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._queue or self._running or self._rerun:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                task = self._queue.popleft()
+                self._queued.discard(task)
+                self._running.add(task)
+
+            site, sync = task
+            start = time.perf_counter()
+            try:
+                # sync(), planned and written in two steps so the plan is recorded as the site's drift
+                changes = synchronize.PLANNERS[sync.__name__](self.token, site, self.username, self.password)
+                statuses = synchronize.apply_changes(self.token, changes)
+                drift.record(site, sync.__name__, changes, written=all(status < 400 for status in statuses))
+                outcome = 'completed'
+            except Exception as e:
+                logger.exception('%s failed for %s', sync.__name__, site)
+                drift.record(site, sync.__name__, None, error=repr(e))
+                outcome = 'failed'
+            logger.info('%s %s %s in %.2fs', sync.__name__, site, outcome, time.perf_counter() - start)
+
+            with self._condition:
+                self.stats[outcome] += 1
+                self._running.discard(task)
+                if task in self._rerun:
+                    self._rerun.discard(task)
+                    self._queue.append(task)
+                    self._queued.add(task)
+                self._condition.notify_all()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # one JSON job (or drift query) per line, answered with one JSON line
+        for line in self.rfile:
+            try:
+                job = json.loads(line)
+                if 'drift' in job:
+                    cache = drift.get_drift_cache()
+                    reply = {'drift': None if cache is None else cache.report(job['drift'])}
+                else:
+                    reply = {'queued': self.server.sync_daemon.submit(job['site'], job.get('role'),
+                                                                      job.get('object_type'))}
+            except (ValueError, KeyError, TypeError) as error:
+                reply = {'error': str(error)}
+            self.wfile.write((json.dumps(reply, default=str) + '\n').encode())
+
+
+def serve(daemon, host='127.0.0.1', port=8765):
+    """Accept sync jobs as JSON lines on a local TCP socket, blocking forever.
+
+    Parameters
+    ----------
+    daemon : SyncDaemon
+        Started daemon the jobs are submitted to.
+    host : str, optional
+        Address to listen on, keep it local.
+    port : int, optional
+        TCP port.
+
+    Returns
+    -------
+    None
+    """
+    with socketserver.ThreadingTCPServer((host, port), _JobHandler) as server:
+        server.sync_daemon = daemon
+        server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resident SVC sync daemon')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--drift-cache', metavar='FILE', help='keep the drift found by every task in this file')
+    parser.add_argument('--response-cache', metavar='DIRECTORY', help='keep and revalidate NetBox list responses here')
+    parser.add_argument('--facts-cache', metavar='FILE', help='keep the device facts in this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.response_cache:
+        netbox.netbox_set_response_cache(args.response_cache)
+    cache = drift.DriftCache(args.drift_cache) if args.drift_cache else None
+    drift.set_drift_cache(cache)
+    try:
+        with SyncDaemon(os.environ['NETBOX_TOKEN'], os.environ['JUNOS_USERNAME'], os.environ['JUNOS_PASSWORD'],
+                        workers=args.workers, facts_cache=args.facts_cache) as daemon:
+            serve(daemon, args.host, args.port)
+    finally:
+        if cache is not None:
+            cache.save()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+Drift reports: what is out of sync between the devices and NetBox, per site and object type, summarized from the
+changes the sync functions plan and kept so dashboards read it without reaching a device or NetBox
+
+    cache = drift.DriftCache('/var/lib/svc/drift.json')
+    drift.set_drift_cache(cache)
+    ...                    # cli.run, journal.run_sync, scheduler.sync_site and the daemon record what they plan
+    drift.build(token, ['at1', 'ld5'], username, password)    # or plan only, writing nothing
+    cache.report('at1')    # precomputed, a dict lookup
+    cache.save()
+
+    python -m svc_synchronize_lib.drift --cache drift.json build --sites at1 ld5
+    python -m svc_synchronize_lib.drift --cache drift.json show --site at1
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from svc_netbox_lib import netbox
+
+from . import synchronize
+
+# cache the plans are recorded in, None records nothing
+_cache = None
+
+# report object type of every planned change object type, a device update is its platform (software version)
+OBJECT_KINDS = {
+    'interface': 'interfaces',
+    'vlan': 'vlans',
+    'ip_address': 'ip_addresses',
+    'vrf': 'vrfs',
+    'platform': 'versions',
+    'device': 'versions',
+}
+
+# create: on the device, missing in NetBox; delete: in NetBox, no longer on the device; update: differs
+_DRIFT = {'create': 'missing', 'delete': 'extra', 'update': 'changed'}
+
+
+def set_drift_cache(cache):
+    """Install the cache every plan of the svc_synchronize_lib runners is recorded in.
+
+    Parameters
+    ----------
+    cache : DriftCache or None
+        Cache to record in, None disables drift reports.
+
+    Returns
+    -------
+    DriftCache or None
+        The previously installed cache.
+    """
+    global _cache
+    previous = _cache
+    _cache = cache
+    return previous
+
+
+def get_drift_cache():
+    """Return the installed drift cache (or None)."""
+    return _cache
+
+
+def record(site, sync, changes, written=False, error=None):
+    """Record the plan of one sync function for one site in the installed cache, no-op when none is installed.
+
+    Parameters
+    ----------
+    site : str
+        Site identifier.
+    sync : str
+        Name of the sync function, a key of `synchronize.PLANNERS`.
+    changes : list[dict]
+        The planned changes, see `synchronize.change`.
+    written : bool, optional
+        Every planned change was written, NetBox matched the devices once the sync finished.
+    error : str, optional
+        The error that stopped the planning, the site's drift is then unknown for this sync function.
+    """
+    if _cache is not None:
+        _cache.record(site, sync, changes, written, error)
+
+
+def summarize(changes):
+    """Summarize planned changes by object type.
+
+    Parameters
+    ----------
+    changes : list[dict]
+        Planned changes, see `synchronize.change`.
+
+    Returns
+    -------
+    dict
+        {object type: {'missing': n, 'extra': n, 'changed': n, 'details': [...]}}, one detail per change:
+        {'device', 'key', 'drift' ('missing', 'extra' or 'changed'), 'fields' (the fields that differ, for
+        'changed')}. Object types are the values of OBJECT_KINDS.
+    """
+    objects = {}
+    for item in changes:
+        summary = objects.setdefault(OBJECT_KINDS[item['object_type']],
+                                     {'missing': 0, 'extra': 0, 'changed': 0, 'details': []})
+        drift = _DRIFT[item['action']]
+        summary[drift] += 1
+        detail = {'device': item['device'], 'key': item['key'], 'drift': drift}
+        if drift == 'changed':
+            detail['fields'] = sorted(item['payload'])
+        summary['details'].append(detail)
+    return objects
+
+
+class DriftCache:
+    """The latest drift of every site and sync function, with the site reports precomputed on every record so
+    they are served as stored. Reports are shared dicts, do not modify them.
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file the recorded plans are loaded from and saved to with `save`, None keeps them in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._syncs = {}
+        self._sites = {}
+        self._overview = {'checked': None, 'sites': {}}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._syncs = json.load(f)
+            for site in self._syncs:
+                self._sites[site] = self._site_report(site)
+            self._overview = self._overview_report()
+
+    def record(self, site, sync, changes, written=False, error=None):
+        """Record the plan of one sync function for one site, see `record`."""
+        entry = {'checked': time.time(), 'planned': len(changes or ()), 'written': written, 'error': error,
+                 'in_sync': None if error is not None else written or not changes,
+                 'objects': {} if error is not None else summarize(changes)}
+        with self._lock:
+            self._syncs.setdefault(site, {})[sync] = entry
+            self._sites[site] = self._site_report(site)
+            self._overview = self._overview_report()
+
+    def _site_report(self, site):
+        syncs = self._syncs[site]
+        objects = {}
+        for sync, entry in sorted(syncs.items()):
+            for kind, summary in entry['objects'].items():
+                merged = objects.setdefault(kind, {'missing': 0, 'extra': 0, 'changed': 0, 'details': []})
+                for drift in ('missing', 'extra', 'changed'):
+                    merged[drift] += summary[drift]
+                merged['details'].extend(dict(detail, sync=sync) for detail in summary['details'])
+        in_sync = [entry['in_sync'] for entry in syncs.values()]
+        return {'site': site,
+                'checked': min(entry['checked'] for entry in syncs.values()),
+                'in_sync': None if None in in_sync else all(in_sync),
+                'syncs': dict((sync, dict((key, entry[key]) for key in ('checked', 'planned', 'written', 'error',
+                                                                       'in_sync')))
+                              for sync, entry in sorted(syncs.items())),
+                'objects': objects}
+
+    def _overview_report(self):
+        sites = {}
+        for site, report in sorted(self._sites.items()):
+            sites[site] = {'checked': report['checked'], 'in_sync': report['in_sync'],
+                           'counts': dict((kind, dict((drift, summary[drift]) for drift in ('missing', 'extra',
+                                                                                             'changed')))
+                                          for kind, summary in report['objects'].items())}
+        return {'checked': min((site['checked'] for site in sites.values()), default=None), 'sites': sites}
+
+    def report(self, site=None):
+        """Return the drift report of a site, or the overview of every site.
+
+        Parameters
+        ----------
+        site : str, optional
+            Site identifier, None for the overview.
+
+        Returns
+        -------
+        dict or None
+            For a site: 'site', 'checked' (epoch seconds of its oldest plan), 'in_sync' (True, False or None when a
+            plan failed), 'syncs' ({sync: 'checked', 'planned', 'written', 'error', 'in_sync'}) and 'objects' (see
+            `summarize`, every detail with its 'sync'). None for a site never recorded. The overview has 'checked'
+            and 'sites' ({site: 'checked', 'in_sync', 'counts'}).
+        """
+        if site is None:
+            return self._overview
+        return self._sites.get(site)
+
+    def save(self):
+        """Write the recorded plans to `path`."""
+        if self.path is None:
+            return
+        with self._lock:
+            document = json.dumps(self._syncs, sort_keys=True, default=str)
+        temporary = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(temporary, 'w') as f:
+            f.write(document)
+        os.replace(temporary, self.path)
+
+
+def build(token, sites, username, password, syncs=None, workers=8, cache=None):
+    """Plan the sync functions for every site, writing nothing, and record the plans.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    sites : list[str]
+        Site identifiers, e.g. netbox.netbox_get_sites().
+    username : str
+        Juniper device username.
+    password : str
+        Juniper device password.
+    syncs : list[str], optional
+        Names of the sync functions, by default every key of `synchronize.PLANNERS`.
+    workers : int, optional
+        Plans run at the same time.
+    cache : DriftCache, optional
+        Cache to record in, by default the installed one.
+
+    Returns
+    -------
+    DriftCache
+        The cache recorded in.
+    """
+    cache = cache or _cache or DriftCache()
+
+    def plan(task):
+        site, sync = task
+        try:
+            cache.record(site, sync, synchronize.PLANNERS[sync](token, site, username, password))
+        except Exception as e:
+            cache.record(site, sync, None, error=repr(e))
+
+    tasks = [(site, sync) for site in sites for sync in syncs or synchronize.PLANNERS]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(plan, tasks))
+    return cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SVC drift reports')
+    parser.add_argument('--cache', required=True, help='drift cache file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_command = commands.add_parser('build', help='plan every sync function, writing nothing, and save')
+    build_command.add_argument('--sites', nargs='+', help='site identifiers, by default every SVC site')
+    build_command.add_argument('--syncs', nargs='+', choices=list(synchronize.PLANNERS),
+                               help='sync functions, by default all of them')
+    build_command.add_argument('--workers', type=int, default=8, help='plans run at the same time')
+    show = commands.add_parser('show', help='print the overview, or the report of a site')
+    show.add_argument('--site', help='site identifier')
+    args = parser.parse_args(argv)
+
+    cache = DriftCache(args.cache)
+    if args.command == 'build':
+        build(os.environ['NETBOX_TOKEN'], args.sites or netbox.netbox_get_sites(), os.environ['JUNOS_USERNAME'],
+              os.environ['JUNOS_PASSWORD'], args.syncs, args.workers, cache)
+        cache.save()
+        result = cache.report()
+    else:
+        result = cache.report(args.site)
+    sys.stdout.write(json.dumps(result, indent=2, default=str) + '\n')
+
+
+if __name__ == '__main__':
+    main()
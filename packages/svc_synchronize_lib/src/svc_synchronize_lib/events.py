@@ -0,0 +1,301 @@
+"""
+Push-triggered synchronization: run the sync functions of one device when it reports a Junos commit
+"""
+import json
+import logging
+import re
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from svc_netbox_lib import netbox
+
+from . import synchronize
+
+logger = logging.getLogger(__name__)
+
+# sync functions that read from each device role, the platform version only changes on upgrade (not on
+# commit) and stays with the scheduled runs
+ROLE_SYNCS = {
+    'br1': [synchronize.sync_mx_qfx_netbox_vlans, synchronize.sync_mx_interfaces,
+            synchronize.sync_mx_netbox_public_ipv4_routes, synchronize.sync_netbox_mx_vrfs],
+    'csw1': [synchronize.sync_mx_qfx_netbox_vlans, synchronize.sync_qfx_interfaces],
+    'ls1': [synchronize.sync_ex_interfaces],
+}
+
+# RFC 5424: <PRI>1 TIMESTAMP HOSTNAME APP PROCID MSGID ...
+_RFC5424 = re.compile(r'^<\d+>1 \S+ (?P<host>\S+) \S+ \S+ (?P<tag>\S+)')
+# RFC 3164 (BSD): <PRI>Mmm dd hh:mm:ss HOSTNAME process[pid]: TAG: ...
+_RFC3164 = re.compile(r'^<\d+>\w{3} +\d+ [\d:]+ (?P<host>\S+) [^:]+: (?P<tag>[A-Z_]+)')
+
+
+def parse_commit_event(message):
+    """Return the hostname of a Junos syslog message if it is a UI_COMMIT_COMPLETED event.
+
+    Parameters
+    ----------
+    message : str
+        Raw syslog message in RFC 5424 or RFC 3164 (BSD) format.
+
+    Returns
+    -------
+    str or None
+        Hostname from the syslog header, None for any other message.
+    """
+    match = _RFC5424.match(message) or _RFC3164.match(message)
+    if match is None or match.group('tag') != 'UI_COMMIT_COMPLETED':
+        return None
+    return match.group('host')
+
+
+def device_from_hostname(hostname):
+    """Map a device FQDN to its (site, role).
+
+    The role is matched in the first label as NetBox device names are (see `netbox.netbox_device_matches`) and the
+    site is the first site code found in the following labels (e.g. 'br1-svc.at1.corp.equinix.com' -> ('at1',
+    'br1')). A short host-name without the site labels maps to None, see `DeviceDirectory`.
+
+    Parameters
+    ----------
+    hostname : str
+        Device hostname or FQDN.
+
+    Returns
+    -------
+    tuple[str, str] or None
+        (site, role), None when the hostname does not identify a synchronized device.
+    """
+    labels = hostname.lower().split('.')
+    role = next((role for role in ROLE_SYNCS if netbox.netbox_device_matches(labels[0], role)), None)
+    site = next((label for label in labels[1:] if label in netbox.netbox_get_sites()), None)
+    if role is None or site is None:
+        return None
+    return site, role
+
+
+class DeviceDirectory:
+    """Map the sender of a commit event to its (site, role) through the NetBox devices.
+
+    Junos sends its configured host-name in syslog, usually the short name ('br1-svc'), which is the same at every
+    site. The sender is therefore looked up by its source address first, among the addresses the NetBox device names
+    of every site and role resolve to, then by its FQDN (see `device_from_hostname`), then by a short name that only
+    one device has.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    ttl : int or float, optional
+        Seconds the device index is kept, an unknown sender rebuilds it at most once a minute.
+    """
+
+    def __init__(self, token, ttl=3600):
+        self.token = token
+        self.ttl = ttl
+        self._addresses = {}
+        self._names = {}
+        self._built = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        addresses = {}
+        names = {}
+        for site in netbox.netbox_get_sites():
+            for role in ROLE_SYNCS:
+                found = netbox.netbox_find_device(self.token, site, role)
+                if found is None:
+                    continue
+                name = found[0].lower()
+                short = name.split('.')[0]
+                # a short name of several devices identifies none of them
+                names[short] = None if short in names else (site, role)
+                try:
+                    for info in socket.getaddrinfo(name, None):
+                        addresses[info[4][0]] = (site, role)
+                except OSError:
+                    logger.warning('%s does not resolve, its commits are matched by name only', name)
+        self._addresses = addresses
+        self._names = names
+        self._built = time.monotonic()
+
+    def resolve(self, hostname, address=None):
+        """Return the (site, role) of a commit event sender, None for an unknown device.
+
+        Parameters
+        ----------
+        hostname : str
+            Host-name from the syslog header (short or FQDN) or the hook body.
+        address : str, optional
+            Source address of the syslog datagram.
+        """
+        with self._lock:
+            if self._built is None or time.monotonic() - self._built > self.ttl:
+                self._build()
+            device = self._lookup(hostname, address)
+            if device is None and time.monotonic() - self._built > 60:
+                # a device added to NetBox since the index was built
+                self._build()
+                device = self._lookup(hostname, address)
+            return device
+
+    def _lookup(self, hostname, address):
+        if address is not None and address in self._addresses:
+            return self._addresses[address]
+        return device_from_hostname(hostname) or self._names.get(hostname.lower().split('.')[0])
+
+
+class CommitDebouncer:
+    """Collect commit events per (site, role) and run the matching sync functions once a burst has settled.
+
+    Every event restarts the quiet period of its device, so a burst of commits results in one run.
+    `max_delay` bounds how long a device that keeps committing waits.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    username : str
+        Username for Juniper device authentication.
+    password : str
+        Password for Juniper device authentication.
+    delay : int or float, optional
+        Quiet period in seconds after the last commit before the sync runs.
+    max_delay : int or float, optional
+        Maximum seconds between the first commit of a burst and the sync.
+    """
+
+    def __init__(self, token, username, password, delay=15, max_delay=120):
+        self.token = token
+        self.username = username
+        self.password = password
+        self.delay = delay
+        self.max_delay = max_delay
+        self._pending = {}
+        self._running = threading.Lock()
+        self._lock = threading.Lock()
+
+    def notify(self, site, role):
+        """Register a commit on the `role` device of `site`."""
+        key = (site, role)
+        now = time.monotonic()
+        with self._lock:
+            timer, first = self._pending.get(key, (None, now))
+            if timer is not None:
+                timer.cancel()
+            wait = max(0, min(self.delay, first + self.max_delay - now))
+            timer = threading.Timer(wait, self._fire, args=(key,))
+            timer.daemon = True
+            self._pending[key] = (timer, first)
+            timer.start()
+
+    def _fire(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+        self.run(*key)
+
+    def run(self, site, role):
+        """Run the sync functions for one device now (sync runs are serialized)."""
+        # sync_mx_qfx_netbox_vlans is shared by br1 and csw1, runs do not overlap so it never races itself
+        with self._running:
+            for sync in ROLE_SYNCS[role]:
+                try:
+                    sync(self.token, site, self.username, self.password)
+                except Exception:
+                    logger.exception('%s failed for %s %s', sync.__name__, site, role)
+
+    def flush(self):
+        """Run every pending sync immediately instead of waiting for its timer."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for key, (timer, first) in pending.items():
+            timer.cancel()
+            self.run(*key)
+
+
+class _SyslogHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        message = self.request[0].decode('utf-8', 'replace').strip()
+        hostname = parse_commit_event(message)
+        if hostname is None:
+            return
+        device = self.server.directory.resolve(hostname, self.client_address[0])
+        if device is None:
+            logger.info('commit on unknown device %s (%s) ignored', hostname, self.client_address[0])
+            return
+        self.server.debouncer.notify(*device)
+
+
+class _CommitHookHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        # body: {"hostname": "br1-svc.at1.corp.equinix.com"} or {"site": "at1", "role": "br1"}
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            device = (body['site'], body['role']) if 'site' in body else self.server.directory.resolve(body['hostname'])
+        except (ValueError, KeyError, AttributeError):
+            device = None
+        # the hook is not authenticated, only known sites and roles are queued
+        if device is None or device[0] not in netbox.netbox_get_sites() or device[1] not in ROLE_SYNCS:
+            self.send_response(400)
+            self.end_headers()
+            return
+        self.server.debouncer.notify(*device)
+        self.send_response(202)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def serve_syslog(debouncer, host='0.0.0.0', port=514, directory=None):
+    """Receive Junos syslog over UDP and trigger syncs on UI_COMMIT_COMPLETED, blocking forever.
+
+    Parameters
+    ----------
+    debouncer : CommitDebouncer
+        Debouncer the commit events are sent to.
+    host : str, optional
+        Address to listen on.
+    port : int, optional
+        UDP port, configure the devices with `set system syslog host <listener> any notice` (and `port` if not 514).
+    directory : DeviceDirectory, optional
+        Maps the senders to their devices, by default one reading NetBox with the debouncer's token.
+
+    Returns
+    -------
+    None
+    """
+    with socketserver.ThreadingUDPServer((host, port), _SyslogHandler) as server:
+        server.debouncer = debouncer
+        server.directory = directory or DeviceDirectory(debouncer.token)
+        server.serve_forever()
+
+
+def serve_http(debouncer, host='0.0.0.0', port=8080, directory=None):
+    """Accept commit notifications as HTTP POSTs with a JSON body, blocking forever.
+
+    The body is either {"hostname": "<device name>"} or {"site": "<site>", "role": "br1" | "csw1" | "ls1"}, a site
+    that is not one of netbox_get_sites() is rejected with 400.
+
+    Parameters
+    ----------
+    debouncer : CommitDebouncer
+        Debouncer the commit events are sent to.
+    host : str, optional
+        Address to listen on.
+    port : int, optional
+        TCP port.
+    directory : DeviceDirectory, optional
+        Maps the host-names to their devices, by default one reading NetBox with the debouncer's token.
+
+    Returns
+    -------
+    None
+    """
+    with HTTPServer((host, port), _CommitHookHandler) as server:
+        server.debouncer = debouncer
+        server.directory = directory or DeviceDirectory(debouncer.token)
+        server.serve_forever()
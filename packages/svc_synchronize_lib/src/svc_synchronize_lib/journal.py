@@ -0,0 +1,216 @@
+"""
+Persistent journal of planned and applied NetBox changes, so an interrupted fleet sync resumes where it stopped
+"""
+import json
+import os
+import time
+
+from svc_juniper_lib import timeouts
+
+from . import drift
+from . import synchronize
+
+
+class Journal:
+    """Append-only JSON lines file recording, per site and sync function, the planned changes and the outcome of
+    every write.
+
+    Reopening the same file restores the state: finished (site, sync) pairs are skipped, a recorded plan is reused
+    instead of reading the devices and NetBox again, and only its changes without a successful write are applied.
+    A change whose write was sent but not recorded (process killed mid-request) is written again on resume.
+
+    Parameters
+    ----------
+    path : str
+        Journal file, created if it does not exist. Use a new file for every fleet run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._plans = {}
+        self._results = {}
+        self._errors = {}
+        self._done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    # a line cut short by a kill is ignored
+                    try:
+                        self._load(json.loads(line))
+                    except ValueError:
+                        continue
+
+    def _load(self, record):
+        key = (record['site'], record['sync'])
+        if record['event'] == 'planned':
+            self._plans[key] = record['changes']
+            self._results[key] = {}
+            self._errors.pop(key, None)
+        elif record['event'] == 'result':
+            self._results.setdefault(key, {})[record['index']] = record
+        elif record['event'] == 'plan_failed':
+            self._errors[key] = record['error']
+        elif record['event'] == 'done':
+            self._done.add(key)
+
+    def _write(self, record):
+        record['timestamp'] = time.time()
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._load(record)
+
+    def is_done(self, site, sync):
+        """Return True if every change of the sync function was applied for the site."""
+        return (site, sync) in self._done
+
+    def plan(self, site, sync):
+        """Return the recorded changes of the sync function for the site, None if it was not planned yet."""
+        return self._plans.get((site, sync))
+
+    def pending(self, site, sync):
+        """Return (index, change) for every recorded change without a successful write."""
+        results = self._results.get((site, sync), {})
+        return [(index, item) for index, item in enumerate(self._plans.get((site, sync), []))
+                if not results.get(index, {}).get('ok')]
+
+    def record_plan(self, site, sync, changes):
+        """Record the changes planned for the sync function at the site."""
+        self._write({'event': 'planned', 'site': site, 'sync': sync, 'changes': changes})
+
+    def record_plan_error(self, site, sync, error):
+        """Record that the sync function could not plan its changes for the site."""
+        self._write({'event': 'plan_failed', 'site': site, 'sync': sync, 'error': error})
+
+    def record_result(self, site, sync, index, status, error=None):
+        """Record the outcome of one write, returns True if it succeeded (HTTP status below 400)."""
+        ok = error is None and status is not None and status < 400
+        self._write({'event': 'result', 'site': site, 'sync': sync, 'index': index, 'status': status,
+                     'error': error, 'ok': ok})
+        return ok
+
+    def record_done(self, site, sync):
+        """Record that every change of the sync function was applied for the site."""
+        self._write({'event': 'done', 'site': site, 'sync': sync})
+
+    def failed(self):
+        """Return every change whose last write failed, for a targeted retry.
+
+        Returns
+        -------
+        list[dict]
+            One dict per failed change with 'site', 'sync', 'index', 'change', 'status' and 'error'.
+        """
+        results = []
+        for key, changes in self._plans.items():
+            for index, record in sorted(self._results[key].items()):
+                if not record['ok']:
+                    results.append({'site': key[0], 'sync': key[1], 'index': index, 'change': changes[index],
+                                    'status': record['status'], 'error': record['error']})
+        return results
+
+    def report(self):
+        """Summarize the run.
+
+        Returns
+        -------
+        dict
+            'done' (list of [site, sync]), 'planned', 'applied' and 'pending' change counts, 'failed' (see `failed`)
+            and 'plan_failed' (list of {'site', 'sync', 'error'} for syncs that could not read their devices).
+        """
+        planned = sum(len(changes) for changes in self._plans.values())
+        pending = sum(len(self.pending(*key)) for key in self._plans)
+        return {'done': sorted(self._done), 'planned': planned, 'applied': planned - pending, 'pending': pending,
+                'failed': self.failed(),
+                'plan_failed': [{'site': key[0], 'sync': key[1], 'error': error} for key, error in self._errors.items()]}
+
+
+def run_sync(journal, token, site, sync, username, password):
+    """Run one sync function for one site through the journal.
+
+    Parameters
+    ----------
+    journal : Journal
+        Journal of the run.
+    token : str
+        NetBox API token.
+    site : str
+        Site identifier.
+    sync : str
+        Name of the sync function, a key of `synchronize.PLANNERS`.
+    username : str
+        Juniper device username.
+    password : str
+        Juniper device password.
+
+    Returns
+    -------
+    bool
+        True when every change is applied, False if a write failed.
+    """
+    if journal.is_done(site, sync):
+        return True
+    if journal.plan(site, sync) is None:
+        journal.record_plan(site, sync, synchronize.PLANNERS[sync](token, site, username, password))
+
+    ok = True
+    for index, item in journal.pending(site, sync):
+        try:
+            status, error = synchronize.apply_change(token, item), None
+        except Exception as e:
+            status, error = None, repr(e)
+        ok = journal.record_result(site, sync, index, status, error) and ok
+    if ok:
+        journal.record_done(site, sync)
+    drift.record(site, sync, journal.plan(site, sync), written=ok)
+    return ok
+
+
+def run_fleet(token, sites, username, password, path, syncs=None):
+    """Run the sync functions for every site, resuming the journal at `path` if it exists.
+
+    A sync whose devices cannot be read is recorded and skipped, the rest of the run continues. A sync stopped by a
+    device that exceeded its timeout budget (see `timeouts.TimeoutPolicy`) is run again at the end, in the retry
+    lane, so one slow device does not hold up the other sites.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    sites : list[str]
+        Site identifiers, e.g. netbox.netbox_get_sites().
+    username : str
+        Juniper device username.
+    password : str
+        Juniper device password.
+    path : str
+        Journal file of the run.
+    syncs : list[str], optional
+        Names of the sync functions to run, by default every key of `synchronize.PLANNERS`.
+
+    Returns
+    -------
+    dict
+        The journal report, see `Journal.report`.
+    """
+    journal = Journal(path)
+    deferred = []
+    for site in sites:
+        for sync in syncs or synchronize.PLANNERS:
+            try:
+                run_sync(journal, token, site, sync, username, password)
+            except timeouts.DeviceDeferred:
+                deferred.append((site, sync))
+            except Exception as e:
+                journal.record_plan_error(site, sync, repr(e))
+                drift.record(site, sync, None, error=repr(e))
+
+    with timeouts.retry_lane():
+        for site, sync in deferred:
+            try:
+                run_sync(journal, token, site, sync, username, password)
+            except Exception as e:
+                journal.record_plan_error(site, sync, repr(e))
+                drift.record(site, sync, None, error=repr(e))
+    return journal.report()
@@ -0,0 +1,207 @@
+"""
+Dependency-aware NetBox writes: the planned changes of every sync function of a site are ordered by what they
+reference and written in parallel, a change starts as soon as the changes it depends on succeeded
+
+    result = scheduler.sync_site(token, 'at1', username, password, workers=8)
+"""
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from . import drift
+from . import synchronize
+
+
+def dependencies(changes):
+    """Return, for every change, the indexes of the changes that must be written before it.
+
+    - an IP address created in a VRF waits for the creation of that VRF
+    - a device whose platform is set waits for the creation of that platform
+    - a VRF deletion waits for every IP address change of its site, which may still reference it
+    - changes to the same object (site, device, object type and key) keep their plan order
+
+    Parameters
+    ----------
+    changes : list[dict]
+        Changes returned by the plan_* functions, see `synchronize.change`.
+
+    Returns
+    -------
+    list[set[int]]
+        Indexes into `changes`, one set per change.
+    """
+    vrf_creates = {}
+    platform_creates = {}
+    site_addresses = {}
+    last_change = {}
+    results = []
+    for index, item in enumerate(changes):
+        if item['object_type'] == 'vrf' and item['action'] == 'create':
+            vrf_creates.setdefault(item['payload']['name'], []).append(index)
+        elif item['object_type'] == 'platform' and item['action'] == 'create':
+            platform_creates.setdefault(item['key'], []).append(index)
+        elif item['object_type'] == 'ip_address':
+            site_addresses.setdefault(item['site'], []).append(index)
+
+    for index, item in enumerate(changes):
+        payload = item['payload'] or {}
+        required = set()
+        if item['object_type'] == 'ip_address' and item['action'] == 'create' and payload.get('vrf'):
+            required.update(vrf_creates.get(payload['vrf'].get('name'), []))
+        elif item['object_type'] == 'device' and item['action'] == 'update' and payload.get('platform'):
+            required.update(platform_creates.get(payload['platform'].get('name'), []))
+        elif item['object_type'] == 'vrf' and item['action'] == 'delete':
+            required.update(site_addresses.get(item['site'], []))
+
+        key = (item['site'], item['device'], item['object_type'], item['key'])
+        if key in last_change:
+            required.add(last_change[key])
+        last_change[key] = index
+        required.discard(index)
+        results.append(required)
+    return results
+
+
+def _graph(changes):
+    """Return the dependents of every change and the number of changes each one waits for."""
+    required = dependencies(changes)
+    dependents = [[] for _ in changes]
+    for index, others in enumerate(required):
+        for other in others:
+            dependents[other].append(index)
+    return dependents, [len(others) for others in required]
+
+
+def levels(changes):
+    """Group the changes into levels, every change of a level depends only on changes of earlier levels.
+
+    The number of levels is the length of the critical path, in writes.
+
+    Parameters
+    ----------
+    changes : list[dict]
+        Changes returned by the plan_* functions.
+
+    Returns
+    -------
+    list[list[int]]
+        Indexes into `changes`, one list per level.
+    """
+    dependents, waiting = _graph(changes)
+
+    results = []
+    level = [index for index, count in enumerate(waiting) if count == 0]
+    while level:
+        results.append(level)
+        following = []
+        for index in level:
+            for dependent in dependents[index]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    following.append(dependent)
+        level = sorted(following)
+    if sum(len(level) for level in results) != len(changes):
+        raise ValueError('The planned changes depend on each other in a cycle')
+    return results
+
+
+def apply_scheduled(token, changes, workers=8):
+    """Write planned changes to NetBox in parallel, each one after the changes it depends on.
+
+    A change whose dependency failed (status 400 or above, or an exception) is not written.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    changes : list[dict]
+        Changes returned by the plan_* functions, from any number of sync functions and sites.
+    workers : int, optional
+        Writes in flight at the same time.
+
+    Returns
+    -------
+    tuple[list, dict]
+        The HTTP status of every change (None if it was not written or raised), and {index: error} for the
+        changes that raised or were skipped.
+    """
+    dependents, waiting = _graph(changes)
+    statuses = [None] * len(changes)
+    errors = {}
+
+    def skip(index, reason):
+        for dependent in dependents[index]:
+            if dependent not in errors:
+                errors[dependent] = reason
+                skip(dependent, reason)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        for index, count in enumerate(waiting):
+            if count == 0:
+                running[executor.submit(synchronize.apply_change, token, changes[index])] = index
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    statuses[index] = future.result()
+                except Exception as e:
+                    errors[index] = repr(e)
+                if index in errors or statuses[index] >= 400:
+                    skip(index, 'skipped, change %d failed' % index)
+                    continue
+                for dependent in dependents[index]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0 and dependent not in errors:
+                        running[executor.submit(synchronize.apply_change, token, changes[dependent])] = dependent
+    return statuses, errors
+
+
+def sync_site(token, site, username, password, syncs=None, workers=8):
+    """Plan every sync function for a site, then write all of their changes with `apply_scheduled`.
+
+    The devices and NetBox are read one sync function after the other, only the writes run in parallel. A
+    platform created by several devices' version syncs is created once.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    site : str
+        Site identifier.
+    username : str
+        Juniper device username.
+    password : str
+        Juniper device password.
+    syncs : list[str], optional
+        Names of the sync functions, by default every key of `synchronize.PLANNERS`.
+    workers : int, optional
+        Writes in flight at the same time.
+
+    Returns
+    -------
+    dict
+        'changes' (the planned changes), 'statuses' and 'errors' (see `apply_scheduled`) and 'levels' (the
+        length of the critical path, in writes).
+    """
+    changes = []
+    platforms = set()
+    plans = {}
+    for sync in syncs or synchronize.PLANNERS:
+        plan = synchronize.PLANNERS[sync](token, site, username, password)
+        plans[sync] = (plan, len(changes))
+        for item in plan:
+            if item['object_type'] == 'platform' and item['action'] == 'create':
+                if item['key'] in platforms:
+                    continue
+                platforms.add(item['key'])
+            changes.append(item)
+
+    critical_path = len(levels(changes))
+    statuses, errors = apply_scheduled(token, changes, workers)
+    ends = [start for _, start in plans.values()][1:] + [len(changes)]
+    for (sync, (plan, start)), end in zip(plans.items(), ends):
+        written = all(status is not None and status < 400 for status in statuses[start:end])
+        drift.record(site, sync, plan, written=written)
+    return {'changes': changes, 'statuses': statuses, 'errors': errors, 'levels': critical_path}
@@ -0,0 +1,193 @@
+"""
+Parquet snapshots of the device and NetBox inventories read during a sync, for offline analytics
+
+    with snapshot.SnapshotWriter('/data/svc-inventory'):
+        journal.run_fleet(token, netbox.netbox_get_sites(), username, password, 'run.journal')
+
+Every planner hands the dictionaries it reads to the installed sink, the writer flattens them into one row per
+object and writes a Parquet dataset per table (interfaces, vlans, vrfs, ip_addresses, versions) under `path`,
+partitioned by run and site. Each row carries 'run', 'site', 'device' (role) and 'source' ('device' or 'netbox').
+"""
+import os
+import threading
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency: pip install svc-synchronize-lib[snapshot]
+    pa = None
+    pq = None
+
+# sink receiving every inventory read by the planners, None disables snapshots
+_sink = None
+
+# columns of each table after the common run, site, device and source columns
+COLUMNS = {
+    'interfaces': [('name', 'string'), ('description', 'string'), ('speed', 'string'), ('type', 'string'),
+                   ('netbox_id', 'int64')],
+    'vlans': [('vid', 'int64'), ('name', 'string'), ('netbox_id', 'int64')],
+    'vrfs': [('name', 'string'), ('instance_type', 'string'), ('route_distinguisher', 'string'),
+             ('interfaces', 'list<string>'), ('netbox_id', 'int64')],
+    'ip_addresses': [('address', 'string'), ('description', 'string'), ('netbox_id', 'int64')],
+    'versions': [('version', 'string'), ('upgrade', 'string')],
+}
+_COMMON = [('run', 'string'), ('site', 'string'), ('device', 'string'), ('source', 'string')]
+
+
+def set_snapshot_sink(sink):
+    """Install the sink that receives every inventory read by the svc_synchronize_lib planners.
+
+    Parameters
+    ----------
+    sink : callable or None
+        Called as sink(table, source, site, device, data), e.g. a `SnapshotWriter`. None disables snapshots.
+
+    Returns
+    -------
+    callable or None
+        The previously installed sink.
+    """
+    global _sink
+    previous = _sink
+    _sink = sink
+    return previous
+
+
+def get_snapshot_sink():
+    """Return the currently installed snapshot sink (or None)."""
+    return _sink
+
+
+def record(table, source, site, device, data):
+    """Hand an inventory dictionary to the installed sink, no-op when none is installed.
+
+    Parameters
+    ----------
+    table : str
+        One of the COLUMNS tables.
+    source : str
+        'device' or 'netbox'.
+    site : str
+        Site identifier.
+    device : str
+        Device role ('br1', 'csw1' or 'ls1').
+    data : dict
+        Dictionary as returned by the juniper_get_* / netbox_get_* function, see `rows`.
+    """
+    if _sink is not None:
+        _sink(table, source, site, device, data)
+
+
+def rows(table, data):
+    """Flatten an inventory dictionary into rows of the table's COLUMNS.
+
+    Parameters
+    ----------
+    table : str
+        'interfaces' ({name: {'description', 'speed', 'type'[, 'id']}}), 'vlans' ({vid: name or NetBox id}),
+        'vrfs' ({name: {'instance_type', 'route_distinguisher', 'instance_interface'[, 'id']}}), 'ip_addresses'
+        ({address: description or {'id', 'description'}}) or 'versions' ({'version', 'upgrade'}).
+    data : dict
+        The inventory dictionary.
+
+    Returns
+    -------
+    list[dict]
+    """
+    if table == 'interfaces':
+        return [{'name': name, 'description': value.get('description'), 'speed': value.get('speed'),
+                 'type': value.get('type'), 'netbox_id': value.get('id')} for name, value in data.items()]
+    if table == 'vlans':
+        # {'none': 'none'} is a failed NetBox query, NetBox values are object ids, device values names
+        return [{'vid': vid, 'name': None if isinstance(value, int) else value,
+                 'netbox_id': value if isinstance(value, int) else None}
+                for vid, value in data.items() if isinstance(vid, int)]
+    if table == 'vrfs':
+        results = []
+        for name, value in data.items():
+            interfaces = value['instance_interface']
+            if interfaces is not None and not isinstance(interfaces, list):
+                interfaces = [interfaces]
+            results.append({'name': name, 'instance_type': value['instance_type'],
+                            'route_distinguisher': value['route_distinguisher'], 'interfaces': interfaces,
+                            'netbox_id': value.get('id')})
+        return results
+    if table == 'ip_addresses':
+        return [{'address': address, 'description': value.get('description'), 'netbox_id': value.get('id')}
+                if isinstance(value, dict) else {'address': address, 'description': value, 'netbox_id': None}
+                for address, value in data.items()]
+    if table == 'versions':
+        return [{'version': data.get('version'),
+                 'upgrade': None if data.get('upgrade') is None else str(data.get('upgrade'))}]
+    raise ValueError("Unknown snapshot table: '%s'" % table)
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('the Parquet snapshots require pyarrow, install svc-synchronize-lib[snapshot]')
+
+
+def schema(table):
+    """Return the pyarrow schema of a snapshot table."""
+    _require_pyarrow()
+    types = {'string': pa.string(), 'int64': pa.int64(), 'list<string>': pa.list_(pa.string())}
+    return pa.schema([(name, types[kind]) for name, kind in _COMMON + COLUMNS[table]])
+
+
+class SnapshotWriter:
+    """Collect the inventories read during a sync run and write them as Parquet datasets.
+
+    Used as a context manager the writer installs itself as the snapshot sink and writes on exit, otherwise
+    install it with `set_snapshot_sink` and call `write()`. Rows are kept in memory until written.
+
+    Parameters
+    ----------
+    path : str
+        Root directory, each table is written to <path>/<table>/run=<run>/site=<site>/.
+    run : str, optional
+        Run identifier, by default the UTC start time (e.g. '20250101T120000Z').
+    partition_cols : list[str], optional
+        Columns the datasets are partitioned by.
+    """
+
+    def __init__(self, path, run=None, partition_cols=('run', 'site')):
+        _require_pyarrow()
+        self.path = path
+        self.run = run or time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+        self.partition_cols = list(partition_cols)
+        self._rows = dict((table, []) for table in COLUMNS)
+        self._lock = threading.Lock()
+        self._previous = None
+
+    def __call__(self, table, source, site, device, data):
+        common = {'run': self.run, 'site': site, 'device': device, 'source': source}
+        flattened = [dict(common, **row) for row in rows(table, data)]
+        with self._lock:
+            self._rows[table].extend(flattened)
+
+    def write(self):
+        """Write the collected rows and start collecting again.
+
+        Returns
+        -------
+        dict[str, int]
+            Rows written per table.
+        """
+        with self._lock:
+            collected, self._rows = self._rows, dict((table, []) for table in COLUMNS)
+        written = {}
+        for table, table_rows in collected.items():
+            if table_rows:
+                pq.write_to_dataset(pa.Table.from_pylist(table_rows, schema=schema(table)),
+                                    root_path=os.path.join(self.path, table), partition_cols=self.partition_cols)
+            written[table] = len(table_rows)
+        return written
+
+    def __enter__(self):
+        self._previous = set_snapshot_sink(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        set_snapshot_sink(self._previous)
+        self.write()
@@ -1,12 +1,184 @@
 import ipaddress
+from concurrent.futures import ThreadPoolExecutor
 
-from ..netbox import netbox
-from ..juniper import juniper
+from svc_netbox_lib import netbox
+from svc_juniper_lib import facts
+from svc_juniper_lib import juniper
+
+from . import snapshot
+
+
+# NetBox write function for every (object type, action) a plan can contain
+# create: f(token, payload), update: f(token, object_id, payload), delete: f(token, object_id)
+_WRITERS = {
+    ('vlan', 'create'): netbox.netbox_post_vlan,
+    ('vlan', 'delete'): netbox.netbox_delete_vlan,
+    ('interface', 'create'): netbox.netbox_post_interface,
+    ('interface', 'update'): netbox.netbox_patch_interface,
+    ('interface', 'delete'): netbox.netbox_delete_interface,
+    ('ip_address', 'create'): netbox.netbox_post_ip_address,
+    ('ip_address', 'update'): netbox.netbox_patch_ip_address,
+    ('ip_address', 'delete'): netbox.netbox_delete_ip_address,
+    ('vrf', 'create'): netbox.netbox_post_vrf,
+    ('vrf', 'update'): netbox.netbox_patch_vrf,
+    ('vrf', 'delete'): netbox.netbox_delete_vrf,
+    ('platform', 'create'): netbox.netbox_post_platform,
+    ('device', 'update'): netbox.netbox_patch_device_platform,
+}
+
+# NetBox interface type for each port prefix, checked in order
+_QFX_PORT_TYPES = [('em', '1000base-x-sfp'), ('xe', '10gbase-x-sfpp'), ('ge', '1000base-x-sfp'), ('ae', 'lag')]
+_PORT_TYPES = [('xe', '10gbase-x-sfpp'), ('ge', '1000base-x-sfp'), ('ae', 'lag')]
+
+# device roles whose software version is kept as the NetBox platform
+_PLATFORM_ROLES = ['br1', 'csw1', 'ls1']
+
+
+def change(site, device, object_type, key, action, object_id=None, payload=None):
+    """Return one planned NetBox change.
+
+    Parameters
+    ----------
+    site : str
+        Site identifier.
+    device : str
+        Device role the change was read from ('br1', 'csw1' or 'ls1').
+    object_type : str
+        'vlan', 'interface', 'ip_address', 'vrf', 'platform' or 'device'.
+    key : str or int
+        Natural key of the object (VLAN ID, interface name, address, VRF name, version or device id).
+    action : str
+        'create', 'update' or 'delete'.
+    object_id : int, optional
+        NetBox id of the object for 'update' and 'delete'.
+    payload : dict, optional
+        Request body for 'create' and 'update'.
+
+    Returns
+    -------
+    dict
+        The change with the keys above.
+    """
+    return {'site': site, 'device': device, 'object_type': object_type, 'key': key, 'action': action,
+            'object_id': object_id, 'payload': payload}
+
+
+def apply_change(token, change):
+    """Write one planned change to NetBox.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    change : dict
+        Change returned by one of the plan_* functions.
+
+    Returns
+    -------
+    int
+        HTTP status code returned by the NetBox API.
+    """
+    writer = _WRITERS[(change['object_type'], change['action'])]
+    if change['action'] == 'create':
+        return writer(token, change['payload'])
+    if change['action'] == 'update':
+        return writer(token, change['object_id'], change['payload'])
+    return writer(token, change['object_id'])
+
+
+def apply_changes(token, changes):
+    """Write planned changes to NetBox in order.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    changes : list[dict]
+        Changes returned by one of the plan_* functions.
+
+    Returns
+    -------
+    list[int]
+        HTTP status code of every change.
+    """
+    return [apply_change(token, item) for item in changes]
+
+
+def coalesce_changes(changes):
+    """Merge the updates planned for the same NetBox object into one PATCH.
+
+    The merged update takes the place of the first one. Payloads are merged field by field, nested dicts such as
+    'custom_fields' key by key, a later value wins. Creates and deletes are kept as they are.
+
+    Parameters
+    ----------
+    changes : list[dict]
+        Planned changes, see `change`.
+
+    Returns
+    -------
+    list[dict]
+        The changes with at most one update per (object type, NetBox id).
+    """
+    results = []
+    updates = {}
+    for item in changes:
+        if item['action'] != 'update':
+            results.append(item)
+            continue
+        key = (item['object_type'], item['object_id'])
+        if key not in updates:
+            updates[key] = dict(item, payload=dict(item['payload']))
+            results.append(updates[key])
+            continue
+        payload = updates[key]['payload']
+        for field, value in item['payload'].items():
+            if isinstance(value, dict) and isinstance(payload.get(field), dict):
+                payload[field] = dict(payload[field], **value)
+            else:
+                payload[field] = value
+    return results
+
+
+def _empty(scope):
+    """Return True for an empty scope list, which selects no objects (an empty NetBox filter would select all)."""
+    return scope is not None and len(scope) == 0
+
+
+def _plan_interfaces(site, device, device_id, juniper_dictionary, netbox_dictionary, port_types, keep=()):
+    """Return the interface changes that make the NetBox interfaces of a device match the device."""
+    snapshot.record('interfaces', 'device', site, device, juniper_dictionary)
+    snapshot.record('interfaces', 'netbox', site, device, netbox_dictionary)
+
+    changes = []
+    for key, value in juniper_dictionary.items():
+        # add any missing ports to the device in Netbox
+        if key not in netbox_dictionary:
+            for prefix, port_type in port_types:
+                if prefix in key:
+                    payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
+                               'type': port_type, 'tags': [value['speed'], value['type']]}
+                    changes.append(change(site, device, 'interface', key, 'create', payload=payload))
+                    break
+        # update any speed, type, description changes
+        else:
+            if value['speed'] != netbox_dictionary[key]['speed'] or value['type'] != netbox_dictionary[key]['type']:
+                payload = {'tags': [value['speed'], value['type']]}
+                changes.append(change(site, device, 'interface', key, 'update', netbox_dictionary[key]['id'], payload))
+            if value['description'] != netbox_dictionary[key]['description']:
+                payload = {'description': value['description']}
+                changes.append(change(site, device, 'interface', key, 'update', netbox_dictionary[key]['id'], payload))
+
+    # remove any interfaces from Netbox that no longer exist on the device
+    for key, value in netbox_dictionary.items():
+        if key not in keep and key not in juniper_dictionary:
+            changes.append(change(site, device, 'interface', key, 'delete', value['id']))
+    return coalesce_changes(changes)
 
 
 # The purpose of this function is get all vlans from the Juniper QFX/MX, compare to the exisiting vlans in Netbox
 # Then add/delete vlans in Netbox
-def sync_mx_qfx_netbox_vlans(token, site, username, password):
+def sync_mx_qfx_netbox_vlans(token, site, username, password, vlan_ids=None):
     """Synchronize VLANs between Juniper QFX/MX devices and NetBox for a site.
 
     This function:
@@ -25,51 +197,64 @@ def sync_mx_qfx_netbox_vlans(token, site, username, password):
         Username for Juniper device authentication.
     password : str
         Password for Juniper device authentication.
+    vlan_ids : list[int], optional
+        Synchronize only these VLAN IDs, by default every VLAN of the site.
 
     Returns
     -------
     None
     """
-    # get qfx vlan information from Juniper QFX
-    fqdn = netbox.netbox_get_fqdn(token, site, 'csw1')
-    juniper_qfx_dictionary = juniper.juniper_get_qfx_vlans_dictionary(fqdn, username, password)
+    apply_changes(token, plan_mx_qfx_netbox_vlans(token, site, username, password, vlan_ids))
 
-    # get mx subinterface information
-    fqdn = netbox.netbox_get_fqdn(token, site, 'br1')
-    juniper_mx_dictionary = juniper.juniper_get_mx_interface_vlans_dictionary(fqdn, username, password)
-
-    # get qfx vlan information from Netbox
-    netbox_qfx_vlans_dictionary = netbox.netbox_get_vlan_dictionary(token, site, 'qfx')
 
-    # get mx vlan information from Netbox
-    netbox_mx_vlans_dictionary = netbox.netbox_get_vlan_dictionary(token, site, 'mx')
+def plan_mx_qfx_netbox_vlans(token, site, username, password, vlan_ids=None):
+    """Return the VLAN changes sync_mx_qfx_netbox_vlans would write, without writing them.
 
-    # add new qfx vlans to netbox
-    for key, value in juniper_qfx_dictionary.items():
-        if key not in netbox_qfx_vlans_dictionary:
-            payload = {'site': {'name': site.upper()}, 'vid': key, 'name': value, 'description': 'qfx'}
-            netbox.netbox_post_vlan(token, payload)
-
-    # remove qfx netbox vlans that no longer appear on the qfx switch
-    for key, value in netbox_qfx_vlans_dictionary.items():
-        if key not in juniper_qfx_dictionary:
-            netbox.netbox_delete_vlan(token, value)
+    Returns
+    -------
+    list[dict]
+        Planned changes, see `change`.
+    """
+    if _empty(vlan_ids):
+        return []
 
-    # add new mx vlans to netbox
-    for key, value in juniper_mx_dictionary.items():
-        if key not in netbox_mx_vlans_dictionary:
-            payload = {'site': {'name': site.upper()}, 'vid': key, 'name': value, 'description': 'mx'}
-            netbox.netbox_post_vlan(token, payload)
+    # get qfx vlan information from Juniper QFX
+    fqdn = netbox.netbox_get_fqdn(token, site, 'csw1')
+    juniper_qfx_dictionary = juniper.juniper_get_qfx_vlans_dictionary(fqdn, username, password, vlan_ids=vlan_ids)
 
-    # remove mx netbox vlans that no longer appear on the mx switch
-    for key, value in netbox_mx_vlans_dictionary.items():
-        if key not in juniper_mx_dictionary:
-            netbox.netbox_delete_vlan(token, value)
+    # get mx subinterface information
+    fqdn = netbox.netbox_get_fqdn(token, site, 'br1')
+    juniper_mx_dictionary = juniper.juniper_get_mx_interface_vlans_dictionary(fqdn, username, password,
+                                                                              vlan_ids=vlan_ids)
+
+    # get qfx and mx vlan information from Netbox, one query split by description
+    netbox_vlans = netbox.netbox_get_vlan_dictionaries(token, site, ['qfx', 'mx'], vlan_ids)
+    netbox_qfx_vlans_dictionary = netbox_vlans['qfx']
+    netbox_mx_vlans_dictionary = netbox_vlans['mx']
+
+    changes = []
+    for device, description, juniper_dictionary, netbox_dictionary in [
+            ('csw1', 'qfx', juniper_qfx_dictionary, netbox_qfx_vlans_dictionary),
+            ('br1', 'mx', juniper_mx_dictionary, netbox_mx_vlans_dictionary)]:
+        snapshot.record('vlans', 'device', site, device, juniper_dictionary)
+        snapshot.record('vlans', 'netbox', site, device, netbox_dictionary)
+
+        # add new vlans to netbox
+        for key, value in juniper_dictionary.items():
+            if key not in netbox_dictionary:
+                payload = {'site': {'name': site.upper()}, 'vid': key, 'name': value, 'description': description}
+                changes.append(change(site, device, 'vlan', key, 'create', payload=payload))
+
+        # remove netbox vlans that no longer appear on the device, {'none': 'none'} means the netbox query failed
+        for key, value in netbox_dictionary.items():
+            if key not in juniper_dictionary and key != 'none':
+                changes.append(change(site, device, 'vlan', key, 'delete', value))
+    return changes
 
 
 # The purpose of this function is to synchronize Juniper QFX interfaces and Netbox.
 # This function will add/delete interfaces from Netbox based on what is configured on the Juniper QFX
-def sync_qfx_interfaces(token, site, username, password):
+def sync_qfx_interfaces(token, site, username, password, interfaces=None):
     """Synchronize QFX device interfaces with NetBox.
 
     This function:
@@ -89,58 +274,41 @@ def sync_qfx_interfaces(token, site, username, password):
         Juniper device username.
     password : str
         Juniper device password.
+    interfaces : list[str], optional
+        Synchronize only these interface names, by default every interface of the device.
 
     Returns
     -------
     None
     """
+    apply_changes(token, plan_qfx_interfaces(token, site, username, password, interfaces))
+
+
+def plan_qfx_interfaces(token, site, username, password, interfaces=None):
+    """Return the interface changes sync_qfx_interfaces would write, without writing them.
+
+    Returns
+    -------
+    list[dict]
+        Planned changes, see `change`.
+    """
+    if _empty(interfaces):
+        return []
+
     # get qfx interface information from Juniper QFX
     fqdn = netbox.netbox_get_fqdn(token, site, 'csw1')
-    juniper_qfx_dictionary = juniper.juniper_get_qfx_interfaces(fqdn, username, password)
+    juniper_qfx_dictionary = juniper.juniper_get_qfx_interfaces(fqdn, username, password, interface_names=interfaces)
 
     # get qfx interface information from Netbox
     device_id = netbox.netbox_get_id(token, site, 'csw1')
-    netbox_qfx_dictionary = netbox.netbox_get_interfaces(token, device_id)
-
-    # add any missing qfx ports to the qfx device in Netbox
-    # update any speed, type, description changes
-    for key, value in juniper_qfx_dictionary.items():
-        # add any missing qfx ports to the qfx device in Netbox
-        if key not in netbox_qfx_dictionary:
-            if 'em' in key:
-                payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
-                           'type': '1000base-x-sfp', 'tags': [value['speed'], value['type']]}
-                netbox.netbox_post_interface(token, payload)
-            elif 'xe' in key:
-                payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
-                           'type': '10gbase-x-sfpp', 'tags': [value['speed'], value['type']]}
-                netbox.netbox_post_interface(token, payload)
-            elif 'ge' in key:
-                payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
-                           'type': '1000base-x-sfp', 'tags': [value['speed'], value['type']]}
-                netbox.netbox_post_interface(token, payload)
-            elif 'ae' in key:
-                payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
-                           'type': 'lag', 'tags': [value['speed'], value['type']]}
-                netbox.netbox_post_interface(token, payload)
-        # update any speed, type, description changes
-        elif (value['speed'] != netbox_qfx_dictionary[key]['speed'] or
-              value['type'] != netbox_qfx_dictionary[key]['type']):
-            payload = {'tags': [value['speed'], value['type']]}
-            netbox.netbox_patch_interface(token, netbox_qfx_dictionary[key]['id'], payload)
-        elif value['description'] != netbox_qfx_dictionary[key]['description']:
-            payload = {'description': value['description']}
-            netbox.netbox_patch_interface(token, netbox_qfx_dictionary[key]['id'], payload)
+    netbox_qfx_dictionary = netbox.netbox_get_interfaces(token, device_id, interfaces)
 
-    # remove any qfx interfaces from Netbox that no longer exist on the qfx switch
-    for key, value in netbox_qfx_dictionary.items():
-        if key not in juniper_qfx_dictionary:
-            netbox.netbox_delete_interface(token, value['id'])
+    return _plan_interfaces(site, 'csw1', device_id, juniper_qfx_dictionary, netbox_qfx_dictionary, _QFX_PORT_TYPES)
 
 
 # The purpose of this function is to synchronize Juniper MX interfaces and Netbox.
 # This function will add/delete interfaces from Netbox based on what is configured on the Juniper MX
-def sync_mx_interfaces(token, site, username, password):
+def sync_mx_interfaces(token, site, username, password, interfaces=None):
     """Synchronize MX device interfaces with NetBox.
 
     This function:
@@ -160,56 +328,45 @@ def sync_mx_interfaces(token, site, username, password):
         Juniper device username.
     password : str
         Juniper device password.
+    interfaces : list[str], optional
+        Synchronize only these interface names, by default every interface of the device.
 
     Returns
     -------
     None
     """
+    apply_changes(token, plan_mx_interfaces(token, site, username, password, interfaces))
+
+
+def plan_mx_interfaces(token, site, username, password, interfaces=None):
+    """Return the interface changes sync_mx_interfaces would write, without writing them.
+
+    Returns
+    -------
+    list[dict]
+        Planned changes, see `change`.
+    """
+    if _empty(interfaces):
+        return []
+
     # determine MX ip address and device id
     fqdn = netbox.netbox_get_fqdn(token, site, 'br1')
     device_id = netbox.netbox_get_id(token, site, 'br1')
 
     # get mx interface information from Juniper MX
-    juniper_mx_dictionary = juniper.juniper_get_mx_interfaces(fqdn, username, password)
+    juniper_mx_dictionary = juniper.juniper_get_mx_interfaces(fqdn, username, password, interface_names=interfaces)
 
     # get mx interface information from Netbox
-    netbox_mx_dictionary = netbox.netbox_get_interfaces(token, device_id)
-
-    # add any missing mx ports to the mx device in Netbox
-    # update any speed, type, description changes
-    for key, value in juniper_mx_dictionary.items():
-        # add any missing mx ports to the mx device in Netbox
-        if key not in netbox_mx_dictionary:
-            if 'xe' in key:
-                payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
-                           'type': '10gbase-x-sfpp', 'tags': [value['speed'], value['type']]}
-                netbox.netbox_post_interface(token, payload)
-            elif 'ge' in key:
-                payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
-                           'type': '1000base-x-sfp', 'tags': [value['speed'], value['type']]}
-                netbox.netbox_post_interface(token, payload)
-            elif 'ae' in key:
-                payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
-                           'type': 'lag', 'tags': [value['speed'], value['type']]}
-                netbox.netbox_post_interface(token, payload)
-        # update any speed, type, description changes
-        elif value['speed'] != netbox_mx_dictionary[key]['speed'] or value['type'] != netbox_mx_dictionary[key]['type']:
-            payload = {'tags': [value['speed'], value['type']]}
-            netbox.netbox_patch_interface(token, netbox_mx_dictionary[key]['id'], payload)
-        elif value['description'] != netbox_mx_dictionary[key]['description']:
-            payload = {'description': value['description']}
-            netbox.netbox_patch_interface(token, netbox_mx_dictionary[key]['id'], payload)
+    netbox_mx_dictionary = netbox.netbox_get_interfaces(token, device_id, interfaces)
 
-    # remove any mx interfaces from Netbox that no longer exist on the mx router
-    for key, value in netbox_mx_dictionary.items():
-        if key != 'MGMT':
-            if key not in juniper_mx_dictionary:
-                netbox.netbox_delete_interface(token, value['id'])
+    # the management interface is not on the MX interface tables, never remove it
+    return _plan_interfaces(site, 'br1', device_id, juniper_mx_dictionary, netbox_mx_dictionary, _PORT_TYPES,
+                            keep=('MGMT',))
 
 
 # The purpose of this function is to synchronize Juniper EX interfaces and Netbox.
 # This function will add/delete interfaces from Netbox based on what is configured on the Juniper EX
-def sync_ex_interfaces(token, site, username, password):
+def sync_ex_interfaces(token, site, username, password, interfaces=None):
     """Synchronize EX device interfaces with NetBox.
 
     This function:
@@ -229,53 +386,41 @@ def sync_ex_interfaces(token, site, username, password):
         Juniper device username.
     password : str
         Juniper device password.
+    interfaces : list[str], optional
+        Synchronize only these interface names, by default every interface of the device.
 
     Returns
     -------
     None
     """
+    apply_changes(token, plan_ex_interfaces(token, site, username, password, interfaces))
+
+
+def plan_ex_interfaces(token, site, username, password, interfaces=None):
+    """Return the interface changes sync_ex_interfaces would write, without writing them.
+
+    Returns
+    -------
+    list[dict]
+        Planned changes, see `change`.
+    """
+    if _empty(interfaces):
+        return []
+
     # get ex interface information from Juniper EX
     fqdn = netbox.netbox_get_fqdn(token, site, 'ls1')
-    juniper_ex_dictionary = juniper.juniper_get_ex_interfaces(fqdn, username, password)
+    juniper_ex_dictionary = juniper.juniper_get_ex_interfaces(fqdn, username, password, interface_names=interfaces)
 
     # get ex interface information from Netbox
     device_id = netbox.netbox_get_id(token, site, 'ls1')
-    netbox_ex_dictionary = netbox.netbox_get_interfaces(token, device_id)
-
-    for key, value in juniper_ex_dictionary.items():
-        # check for interfaces found on Juniper but not in Netbox
-        if key not in netbox_ex_dictionary:
-            if 'xe' in key:
-                payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
-                           'type': '10gbase-x-sfpp', 'tags': [value['speed'], value['type']]}
-                netbox.netbox_post_interface(token, payload)
-            elif 'ge' in key:
-                payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
-                           'type': '1000base-x-sfp', 'tags': [value['speed'], value['type']]}
-                netbox.netbox_post_interface(token, payload)
-            elif 'ae' in key:
-                payload = {'device': {'id': device_id}, 'name': key, 'description': value['description'],
-                           'type': 'lag', 'tags': [value['speed'], value['type']]}
-                netbox.netbox_post_interface(token, payload)
-
-        # update any speed, type, description changes
-        elif (value['speed'] != netbox_ex_dictionary[key]['speed'] or
-              value['type'] != netbox_ex_dictionary[key]['type']):
-            payload = {'tags': [value['speed'], value['type']]}
-            netbox.netbox_patch_interface(token, netbox_ex_dictionary[key]['id'], payload)
-        elif value['description'] != netbox_ex_dictionary[key]['description']:
-            payload = {'description': value['description']}
-            netbox.netbox_patch_interface(token, netbox_ex_dictionary[key]['id'], payload)
+    netbox_ex_dictionary = netbox.netbox_get_interfaces(token, device_id, interfaces)
 
-    # remove any ex interfaces from Netbox that no longer exist on the ex switch
-    for key, value in netbox_ex_dictionary.items():
-        if key not in juniper_ex_dictionary:
-            netbox.netbox_delete_interface(token, value['id'])
+    return _plan_interfaces(site, 'ls1', device_id, juniper_ex_dictionary, netbox_ex_dictionary, _PORT_TYPES)
 
 
 # The purpose of this function is to get all public ipv4 networks from the Juniper MX and compare to what is configured in Netbox
 # Then add/delete individual ipv4 entries in Netbox
-def sync_mx_netbox_public_ipv4_routes(token, site, username, password):
+def sync_mx_netbox_public_ipv4_routes(token, site, username, password, prefixes=None):
     """Synchronize public IPv4 routes between an MX device and NetBox for a site.
 
     This function:
@@ -295,48 +440,73 @@ def sync_mx_netbox_public_ipv4_routes(token, site, username, password):
         Juniper device username.
     password : str
         Juniper device password.
+    prefixes : list[str], optional
+        Synchronize only the addresses of these public networks (as routed on the MX, e.g. '64.191.201.2/31'),
+        by default every public address of the site.
 
     Returns
     -------
     None
     """
+    apply_changes(token, plan_mx_netbox_public_ipv4_routes(token, site, username, password, prefixes))
+
+
+def _expand_routes(routes):
+    """Return every address of each network with the network mask, mapped to the network value."""
+    expanded = {}
+    for key, value in routes.items():
+        mask = key[-3:]
+        for addr in ipaddress.ip_network(key):
+            expanded.update({str(addr) + mask: value})
+    return expanded
+
+
+def plan_mx_netbox_public_ipv4_routes(token, site, username, password, prefixes=None):
+    """Return the IP address changes sync_mx_netbox_public_ipv4_routes would write, without writing them.
+
+    Returns
+    -------
+    list[dict]
+        Planned changes, see `change`.
+    """
+    if _empty(prefixes):
+        return []
+
     # get public ipv4 routes from juniper
     fqdn = netbox.netbox_get_fqdn(token, site, 'br1')
-    juniper_routes = juniper.juniper_get_mx_ipv4_public_routes(fqdn, site, username, password)
+    juniper_routes = juniper.juniper_get_mx_ipv4_public_routes(fqdn, site, username, password, prefixes=prefixes)
 
-    # get public ipv4 routes from Netbox
-    netbox_routes = netbox.netbox_get_ipv4_public_routes(token, site)
+    # get public ipv4 routes from Netbox, only the addresses of the requested networks when scoped
+    addresses = None if prefixes is None else list(_expand_routes(dict.fromkeys(prefixes)))
+    netbox_routes = netbox.netbox_get_ipv4_public_routes(token, site, addresses)
 
     # create a dictionary of all ips in use with descriptions
     # EXAMPLE: {'64.191.201.2/31': 'SVC: THOUSANDEYES AWS IPV4', '64.191.201.3/31': 'SVC: THOUSANDEYES AWS IPV4'}
-    juniper_routes_expanded = {}
-    for key, value in juniper_routes.items():
-        mask = key[-3:]
-        for addr in ipaddress.ip_network(key):
-            juniper_routes_expanded.update({str(addr) + mask: value})
+    juniper_routes_expanded = _expand_routes(juniper_routes)
+    snapshot.record('ip_addresses', 'device', site, 'br1', juniper_routes_expanded)
+    snapshot.record('ip_addresses', 'netbox', site, 'br1', netbox_routes)
 
     # Patch routes that need to be updated
     # add new routes
+    changes = []
     for key, value in juniper_routes_expanded.items():
         if key in netbox_routes and value != netbox_routes[key]['description'] and value is not None:
             payload = {'address': key, 'description': value}
-            netbox.netbox_patch_ip_address(token, key, payload)
+            changes.append(change(site, 'br1', 'ip_address', key, 'update', netbox_routes[key]['id'], payload))
         elif key not in netbox_routes:
-            if value is None:
-                payload = {'address': key, 'description': '', 'vrf': {'name': site.upper() + ' RI-VRF-Internet-2'}}
-                netbox.netbox_post_ip_address(token, payload)
-            else:
-                payload = {'address': key, 'description': value, 'vrf': {'name': site.upper() + ' RI-VRF-Internet-2'}}
-                netbox.netbox_post_ip_address(token, payload)
+            payload = {'address': key, 'description': '' if value is None else value,
+                       'vrf': {'name': site.upper() + ' RI-VRF-Internet-2'}}
+            changes.append(change(site, 'br1', 'ip_address', key, 'create', payload=payload))
 
     # delete routes that are no longer in the mx
     for key, value in netbox_routes.items():
         if key not in juniper_routes_expanded:
-            netbox.netbox_delete_ip_address(token, value['id'])
+            changes.append(change(site, 'br1', 'ip_address', key, 'delete', value['id']))
+    return changes
 
 
 # This function will synchronize Juniper routing instances with Netbox VRFs
-def sync_netbox_mx_vrfs(token, site, username, password):
+def sync_netbox_mx_vrfs(token, site, username, password, instances=None):
     """Synchronize Juniper MX routing-instances with NetBox VRFs for a site.
 
     This function:
@@ -355,19 +525,38 @@ def sync_netbox_mx_vrfs(token, site, username, password):
         Juniper device username.
     password : str
         Juniper device password.
+    instances : list[str], optional
+        Synchronize only these VRF names, by default every routing-instance of the MX.
 
     Returns
     -------
     None
     """
+    apply_changes(token, plan_netbox_mx_vrfs(token, site, username, password, instances))
+
+
+def plan_netbox_mx_vrfs(token, site, username, password, instances=None):
+    """Return the VRF changes sync_netbox_mx_vrfs would write, without writing them.
+
+    Returns
+    -------
+    list[dict]
+        Planned changes, see `change`.
+    """
+    if _empty(instances):
+        return []
+
     # get routing-instances from Juniper MX
     fqdn = netbox.netbox_get_fqdn(token, site, 'br1')
-    juniper_instances = juniper.juniper_get_instance(fqdn, site, username, password)
+    juniper_instances = juniper.juniper_get_instance(fqdn, site, username, password, instance_names=instances)
 
     # get vrfs from Netbox
-    netbox_vrfs = netbox.netbox_get_vrfs(token, site)
+    netbox_vrfs = netbox.netbox_get_vrfs(token, site, instances)
+    snapshot.record('vrfs', 'device', site, 'br1', juniper_instances)
+    snapshot.record('vrfs', 'netbox', site, 'br1', netbox_vrfs)
 
     # identify missing vrfs and vrfs that need corrections
+    changes = []
     for key, value in juniper_instances.items():
         interface_list = []
         if value['instance_interface'] == None:
@@ -380,42 +569,73 @@ def sync_netbox_mx_vrfs(token, site, username, password):
         if key not in netbox_vrfs:
             payload = {'name': key, 'rd': value['route_distinguisher'], 'tags': interface_list,
                        'custom_fields': {'Site': site, 'type': value['instance_type']}}
-            netbox.netbox_post_vrf(token, payload)
-
-        try:
-            if value['route_distinguisher'] != netbox_vrfs[key]['route_distinguisher']:
-                payload = {'name': key, 'rd': value['route_distinguisher']}
-                netbox.netbox_patch_vrf(token, netbox_vrfs[key]['id'], payload)
-        except:
-            pass
-        try:
-            if value['instance_type'] != netbox_vrfs[key]['instance_type']:
-                payload = {'name': key, 'custom_fields': {'type': value['instance_type']}}
-                netbox.netbox_patch_vrf(token, netbox_vrfs[key]['id'], payload)
-        except:
-            pass
-        try:
-            for i in interface_list:
-                if i not in netbox_vrfs[key]['instance_interface']:
-                    payload = {'name': key, 'tags': interface_list}
-                    netbox.netbox_patch_vrf(token, netbox_vrfs[key]['id'], payload)
-            for i in netbox_vrfs[key]['instance_interface']:
-                if i not in interface_list:
-                    payload = {'name': key, 'tags': interface_list}
-                    netbox.netbox_patch_vrf(token, netbox_vrfs[key]['id'], payload)
-        except:
-            pass
-        try:
-            if site != netbox_vrfs[key]['site']:
-                payload = {'name': key, 'custom_fields': {'Site': site}}
-                netbox.netbox_patch_vrf(token, netbox_vrfs[key]['id'], payload)
-        except:
-            pass
+            changes.append(change(site, 'br1', 'vrf', key, 'create', payload=payload))
+            continue
+
+        vrf_id = netbox_vrfs[key]['id']
+        if value['route_distinguisher'] != netbox_vrfs[key]['route_distinguisher']:
+            payload = {'name': key, 'rd': value['route_distinguisher']}
+            changes.append(change(site, 'br1', 'vrf', key, 'update', vrf_id, payload))
+        if value['instance_type'] != netbox_vrfs[key]['instance_type']:
+            payload = {'name': key, 'custom_fields': {'type': value['instance_type']}}
+            changes.append(change(site, 'br1', 'vrf', key, 'update', vrf_id, payload))
+        # instance interfaces are stored as tags, compared as sets
+        if set(interface_list) != set(netbox_vrfs[key]['instance_interface']):
+            payload = {'name': key, 'tags': interface_list}
+            changes.append(change(site, 'br1', 'vrf', key, 'update', vrf_id, payload))
+        if site != netbox_vrfs[key]['site']:
+            payload = {'name': key, 'custom_fields': {'Site': site}}
+            changes.append(change(site, 'br1', 'vrf', key, 'update', vrf_id, payload))
 
     # find all vrfs that should be removed from Netbox
     for key, value in netbox_vrfs.items():
         if key not in juniper_instances:
-            netbox.netbox_delete_vrf(token, value['id'])
+            changes.append(change(site, 'br1', 'vrf', key, 'delete', value['id']))
+    return coalesce_changes(changes)
+
+
+def _plan_platform_version(token, site, device, username, password):
+    """Return the platform and device changes that make NetBox show the software version running on a device."""
+    # get device corp ip address and id from Netbox
+    fqdn = netbox.netbox_get_fqdn(token, site, device)
+    device_id = netbox.netbox_get_id(token, site, device)
+
+    # get version from the device facts, only recent ones (e.g. captured by the interface syncs of this run) so an
+    # upgrade shows on the next run
+    version = juniper.juniper_get_version(fqdn, username, password, max_age=facts.RECENT)
+
+    # Get the current platform (software version) of the device according to Netbox
+    platform_netbox, platform_upgrade = netbox.netbox_get_device_platform(token, device_id)
+
+    # get all platform versions from Netbox
+    all_platforms = netbox.netbox_get_platforms(token)
+
+    return _platform_changes(site, device, device_id, version, platform_netbox, platform_upgrade, all_platforms)
+
+
+def _platform_changes(site, device, device_id, version, platform_netbox, platform_upgrade, all_platforms):
+    """Return the platform and device changes for one device, adding a created version to `all_platforms`."""
+    snapshot.record('versions', 'device', site, device, {'version': version})
+    snapshot.record('versions', 'netbox', site, device, {'version': platform_netbox, 'upgrade': platform_upgrade})
+
+    # add version to Netbox if not in Netbox
+    changes = []
+    if version not in all_platforms:
+        payload = {'name': version, 'slug': version.replace('.', '-')}
+        changes.append(change(site, device, 'platform', version, 'create', payload=payload))
+        all_platforms.append(version)
+
+    # change version in Netbox to match the device
+    if version != platform_netbox:
+        if platform_upgrade == None:
+            payload = {'platform': {'name': version}}
+            changes.append(change(site, device, 'device', device_id, 'update', device_id, payload))
+
+    # remove upgrade status since versions match
+    elif platform_upgrade != None:
+        payload = {'custom_fields': {'upgrade': None}}
+        changes.append(change(site, device, 'device', device_id, 'update', device_id, payload))
+    return changes
 
 
 # The purpose of this function is to synchronize software version between Juniper Networking devices and Netbox
@@ -423,7 +643,7 @@ def sync_mx_platform_version(token, site, username, password):
     """Ensure the NetBox platform entry and device platform match the Juniper MX software version.
 
     This function:
-    - Reads the software version from the MX.
+    - Reads the software version from the MX facts, reusing facts captured in the last 15 minutes (`facts.RECENT`).
     - Ensures the version exists in NetBox platforms (creates it if missing).
     - Updates the device platform in NetBox if it does not match the MX.
     - Clears any 'upgrade' custom field if the versions already match.
@@ -443,38 +663,18 @@ def sync_mx_platform_version(token, site, username, password):
     -------
     None
     """
-    # get mx corp ip address from Netbox
-    fqdn = netbox.netbox_get_fqdn(token, site, 'br1')
-
-    # get netbox device id
-    device_id = netbox.netbox_get_id(token, site, 'br1')
-
-    # get version from MX
-    mx_version = juniper.juniper_get_mx_version(fqdn, username, password)
+    apply_changes(token, plan_mx_platform_version(token, site, username, password))
 
-    # Get the current platform (software version) of the device according to Netbox
-    mx_platform_netbox, mx_platform_upgrade = netbox.netbox_get_device_platform(token, device_id)
 
-    # get all platform versions from Netbox
-    all_platforms = netbox.netbox_get_platforms(token)
+def plan_mx_platform_version(token, site, username, password):
+    """Return the platform changes sync_mx_platform_version would write, without writing them.
 
-    # add version to Netbox if not in Netbox
-    if mx_version not in all_platforms:
-        slug_version = mx_version.replace('.', '-')
-        new_platform = {'name': mx_version, 'slug': slug_version}
-        netbox.netbox_post_platform(token, new_platform)
-
-    # change version in Netbox to match MX
-    if mx_version != mx_platform_netbox:
-        if mx_platform_upgrade == None:
-            payload = {'platform': {'name': mx_version}}
-            netbox.netbox_patch_device_platform(token, device_id, payload)
-
-    # remove upgrade status since versions match
-    elif mx_version == mx_platform_netbox:
-        if mx_platform_upgrade != None:
-            payload = {'custom_fields': {'upgrade': None}}
-            netbox.netbox_patch_device_platform(token, device_id, payload)
+    Returns
+    -------
+    list[dict]
+        Planned changes, see `change`.
+    """
+    return _plan_platform_version(token, site, 'br1', username, password)
 
 
 # The purpose of this function is to synchronize software version between Juniper Networking devices and Netbox
@@ -498,37 +698,18 @@ def sync_qfx_platform_version(token, site, username, password):
     -------
     None
     """
-    # get qfx corp ip address from Netbox
-    fqdn = netbox.netbox_get_fqdn(token, site, "csw1")
-
-    # get netbox device id
-    device_id = netbox.netbox_get_id(token, site, "csw1")
-
-    # get version from MX
-    qfx_version = juniper.juniper_get_qfx_version(fqdn, username, password)
-
-    # Get the current platform (software version) of the device according to Netbox
-    qfx_platform_netbox, qfx_platform_upgrade = netbox.netbox_get_device_platform(token, device_id)
-
-    # get all platform versions from Netbox
-    all_platforms = netbox.netbox_get_platforms(token)
+    apply_changes(token, plan_qfx_platform_version(token, site, username, password))
 
-    # add any missing versions to Netbox
-    if qfx_version not in all_platforms:
-        slug_version = qfx_version.replace('.', '-')
-        new_platform = {'name': qfx_version, 'slug': slug_version}
-        netbox.netbox_post_platform(token, new_platform)
 
-    # find version mismatch
-    if qfx_version != qfx_platform_netbox:
-        if qfx_platform_upgrade == None:
-            payload = {'platform': {'name': qfx_version}}
-            netbox.netbox_patch_device_platform(token, device_id, payload)
+def plan_qfx_platform_version(token, site, username, password):
+    """Return the platform changes sync_qfx_platform_version would write, without writing them.
 
-    elif qfx_version == qfx_platform_netbox:
-        if qfx_platform_upgrade != None:
-            payload = {'custom_fields': {'upgrade': None}}
-            netbox.netbox_patch_device_platform(token, device_id, payload)
+    Returns
+    -------
+    list[dict]
+        Planned changes, see `change`.
+    """
+    return _plan_platform_version(token, site, 'csw1', username, password)
 
 
 # The purpose of this function is to synchronize software version between Juniper Networking devices and Netbox
@@ -536,7 +717,7 @@ def sync_ex_platform_version(token, site, username, password):
     """Ensure the NetBox platform entry and device platform match the Juniper EX software version.
 
     This function:
-    - Detects EX model (EX3400 vs EX2200) and reads version accordingly.
+    - Reads the software version from the EX facts (EX2200 or EX3400), reusing facts captured in the last 15 minutes.
     - Ensures the version exists in NetBox platforms (creates if missing).
     - Updates the device platform in NetBox if it does not match the device.
     - Clears any 'upgrade' custom field when versions match.
@@ -556,39 +737,121 @@ def sync_ex_platform_version(token, site, username, password):
     -------
     None
     """
-    # get ex corp ip address from Netbox
-    fqdn = netbox.netbox_get_fqdn(token, site, "ls1")
+    apply_changes(token, plan_ex_platform_version(token, site, username, password))
 
-    # get netbox device id
-    device_id = netbox.netbox_get_id(token, site, "ls1")
 
-    # get version from EX
-    # switch in TR2 is a ex3400
-    if 'tr2' in fqdn:
-        ex_version = juniper.juniper_get_ex3400_version(fqdn, username, password)
-    else:
-        ex_version = juniper.juniper_get_ex2200_version(fqdn, username, password)
+def plan_ex_platform_version(token, site, username, password):
+    """Return the platform changes sync_ex_platform_version would write, without writing them.
 
-    # Get the current platform (software version) of the device according to Netbox
-    ex_platform_netbox, ex_platform_upgrade = netbox.netbox_get_device_platform(token, device_id)
+    Returns
+    -------
+    list[dict]
+        Planned changes, see `change`.
+    """
+    return _plan_platform_version(token, site, 'ls1', username, password)
+
+
+# The purpose of this function is to synchronize software versions of every SVC device with Netbox in one pass
+def sync_platform_versions(token, username, password, sites=None, workers=16):
+    """Ensure the NetBox platform of every MX, QFX and EX matches its software version, for all sites at once.
+
+    Behavior mirrors the sync_*_platform_version functions, with the NetBox traffic batched for the fleet:
+    - Reads every device, its platform and 'upgrade' flag with one paginated dcim/devices query.
+    - Reads the platforms once.
+    - Reads the software versions from the device facts, `workers` devices at a time.
+    - Creates the missing platforms with one bulk POST and updates the devices with one bulk PATCH.
+
+    Parameters
+    ----------
+    token : str
+        NetBox API token.
+    username : str
+        Juniper device username.
+    password : str
+        Juniper device password.
+    sites : list[str], optional
+        Site identifiers, by default netbox.netbox_get_sites().
+    workers : int, optional
+        Number of devices read at the same time.
+
+    Returns
+    -------
+    dict[str, str]
+        Devices whose version could not be read (name -> error), they are left unchanged.
+
+    Raises
+    ------
+    RuntimeError
+        NetBox rejected a bulk write (HTTP status 400 or above). The devices are not patched when the platforms
+        could not be created.
+    """
+    changes, errors = plan_platform_versions(token, username, password, sites, workers)
+
+    platforms = [item['payload'] for item in changes if item['object_type'] == 'platform']
+    devices = [dict({'id': item['object_id']}, **item['payload']) for item in changes if item['object_type'] == 'device']
+    # platforms first, the device patches refer to them by name
+    if platforms:
+        status = netbox.netbox_post_platforms(token, platforms)
+        if status >= 400:
+            raise RuntimeError('NetBox rejected the creation of %d platforms: HTTP %d' % (len(platforms), status))
+    if devices:
+        status = netbox.netbox_patch_devices(token, devices)
+        if status >= 400:
+            raise RuntimeError('NetBox rejected the platform update of %d devices: HTTP %d' % (len(devices), status))
+    return errors
+
+
+def plan_platform_versions(token, username, password, sites=None, workers=16):
+    """Return the changes sync_platform_versions would write, without writing them.
+
+    Returns
+    -------
+    tuple[list[dict], dict[str, str]]
+        Planned changes (see `change`, a missing platform is created once) and the devices whose version could not
+        be read (name -> error).
+    """
+    sites = netbox.netbox_get_sites() if sites is None else sites
+
+    # the first device of each site and role, in name order, as netbox_get_fqdn returns it
+    targets = {}
+    for item in sorted(netbox.netbox_get_devices(token, sites), key=lambda item: item['name']):
+        for role in _PLATFORM_ROLES:
+            if netbox.netbox_device_matches(item['name'], role) and (item['site'], role) not in targets:
+                targets[(item['site'], role)] = item
+
+    # get versions from the device facts, concurrently
+    def read_version(item):
+        try:
+            return juniper.juniper_get_version(item['name'], username, password, max_age=facts.RECENT), None
+        except Exception as e:
+            return None, repr(e)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        versions = list(executor.map(read_version, targets.values()))
 
     # get all platform versions from Netbox
     all_platforms = netbox.netbox_get_platforms(token)
 
-    # if version on ex switch not in Netbox, add it to Netbox platform table
-    if ex_version not in all_platforms:
-        slug_version = ex_version.replace('.', '-')
-        new_platform = {'name': ex_version, 'slug': slug_version}
-        netbox.netbox_post_platform(token, new_platform)
-
-    # update Netbox device with version currently on the juniper ex
-    if ex_version != ex_platform_netbox:
-        if ex_platform_upgrade == None:
-            payload = {'platform': {'name': ex_version}}
-            netbox.netbox_patch_device_platform(token, device_id, payload)
-
-    # remove upgrade flag if versions match
-    elif ex_version == ex_platform_netbox:
-        if ex_platform_upgrade != None:
-            payload = {'custom_fields': {'upgrade': None}}
-            netbox.netbox_patch_device_platform(token, device_id, payload)
\ No newline at end of file
+    changes = []
+    errors = {}
+    for ((site, role), item), (version, error) in zip(targets.items(), versions):
+        if error is not None:
+            errors[item['name']] = error
+            continue
+        changes.extend(_platform_changes(site, role, item['id'], version, item['platform'], item['upgrade'],
+                                         all_platforms))
+    return changes, errors
+
+
+# planner of every sync_* function, in the order a full site run applies them
+PLANNERS = {
+    'sync_mx_qfx_netbox_vlans': plan_mx_qfx_netbox_vlans,
+    'sync_qfx_interfaces': plan_qfx_interfaces,
+    'sync_mx_interfaces': plan_mx_interfaces,
+    'sync_ex_interfaces': plan_ex_interfaces,
+    'sync_mx_netbox_public_ipv4_routes': plan_mx_netbox_public_ipv4_routes,
+    'sync_netbox_mx_vrfs': plan_netbox_mx_vrfs,
+    'sync_mx_platform_version': plan_mx_platform_version,
+    'sync_qfx_platform_version': plan_qfx_platform_version,
+    'sync_ex_platform_version': plan_ex_platform_version,
+}
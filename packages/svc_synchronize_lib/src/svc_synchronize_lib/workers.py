@@ -0,0 +1,491 @@
+"""
+Distributed sync workers: processes on one or more hosts lease (site, sync function) jobs from a shared queue
+
+    python -m svc_synchronize_lib.workers enqueue --queue fleet.db
+    NETBOX_TOKEN=... JUNOS_USERNAME=... JUNOS_PASSWORD=... python -m svc_synchronize_lib.workers work --queue fleet.db \\
+        --regions apac --exit-when-empty
+    python -m svc_synchronize_lib.workers status --queue fleet.db
+
+A worker leases one job at a time for `lease` seconds and renews the lease every `heartbeat` seconds while the sync
+runs. The lease of a worker that dies or hangs expires and the job is leased again by another worker. A failed job is
+queued again until it has been tried `max_attempts` times. The sync functions plan from the current device and
+NetBox state, so a job taken over halfway through its writes only writes what is left.
+
+A queue backend is any object with the methods of `SQLiteQueue`. SQLiteQueue serves the processes of one host (or a
+file system with working locks), `FileQueue` is a JSON file under a lock file for tests.
+"""
+import argparse
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from svc_juniper_lib import facts
+from svc_juniper_lib import sessions
+from svc_netbox_lib import netbox
+
+from . import cli
+from . import synchronize
+
+logger = logging.getLogger(__name__)
+
+# sites of each region, a worker started with --regions only leases the jobs of those sites
+REGIONS = {
+    'amer': ['at1', 'ch3', 'da6', 'dc6', 'la3', 'mi1', 'ny5', 'se3', 'sv5', 'tr2'],
+    'emea': ['am3', 'fr4', 'ld5'],
+    'apac': ['hk2', 'os1', 'sg2', 'sy4', 'ty4'],
+}
+
+# job states: queued -> leased -> done, or back to queued until the attempts run out, then failed
+_OPEN_STATES = ('queued', 'leased')
+
+
+def region_of(site):
+    """Return the region of a site, None for a site of no region (leased by any worker)."""
+    for region, sites in REGIONS.items():
+        if site in sites:
+            return region
+    return None
+
+
+def _outcome(job, ok, max_attempts):
+    """Return the state a finished job moves to."""
+    if ok:
+        return 'done'
+    return 'queued' if job['attempts'] < max_attempts else 'failed'
+
+
+class SQLiteQueue:
+    """Job queue in an SQLite database, every operation is one IMMEDIATE transaction.
+
+    Parameters
+    ----------
+    path : str
+        Database file, created if it does not exist.
+    max_attempts : int, optional
+        Leases of a job before it is failed, counting the leases that expired.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, site TEXT NOT NULL, '
+                       'sync TEXT NOT NULL, region TEXT, state TEXT NOT NULL, worker TEXT, lease_until REAL, '
+                       'attempts INTEGER NOT NULL DEFAULT 0, result TEXT, updated REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)')
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def enqueue(self, tasks):
+        """Queue (site, sync) tasks, a task already queued or leased is not queued again.
+
+        Parameters
+        ----------
+        tasks : list[tuple]
+            (site, sync function name) pairs, names are keys of `synchronize.PLANNERS`.
+
+        Returns
+        -------
+        int
+            Number of jobs added.
+        """
+        added = 0
+        now = time.time()
+        with self._transaction() as db:
+            for site, sync in tasks:
+                open_job = db.execute('SELECT 1 FROM jobs WHERE site = ? AND sync = ? AND state IN (?, ?)',
+                                      (site, sync) + _OPEN_STATES).fetchone()
+                if open_job is None:
+                    db.execute('INSERT INTO jobs (site, sync, region, state, updated) VALUES (?, ?, ?, ?, ?)',
+                               (site, sync, region_of(site), 'queued', now))
+                    added += 1
+        return added
+
+    def lease(self, worker, seconds, regions=None):
+        """Lease the oldest queued job, or one whose lease expired.
+
+        Parameters
+        ----------
+        worker : str
+            Name of the worker.
+        seconds : float
+            Lease duration.
+        regions : list[str], optional
+            Lease only jobs of these regions (and of sites without a region), None for any job.
+
+        Returns
+        -------
+        dict or None
+            The job ('id', 'site', 'sync', 'region', 'attempts'), None if there is none to lease.
+        """
+        now = time.time()
+        where = "(state = 'queued' OR (state = 'leased' AND lease_until < ?))"
+        parameters = [now]
+        if regions is not None:
+            where += ' AND (region IS NULL OR region IN (%s))' % ', '.join('?' for _ in regions)
+            parameters.extend(regions)
+        with self._transaction() as db:
+            for row in db.execute('SELECT * FROM jobs WHERE %s ORDER BY id' % where, parameters).fetchall():
+                job = dict(row)
+                if job['attempts'] >= self.max_attempts:
+                    # leased as often as allowed and the last lease expired
+                    db.execute("UPDATE jobs SET state = 'failed', worker = NULL, result = ?, updated = ? WHERE id = ?",
+                               (json.dumps({'error': 'lease of %s expired' % job['worker']}), now, job['id']))
+                    continue
+                db.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                           "updated = ? WHERE id = ?", (worker, now + seconds, now, job['id']))
+                return {'id': job['id'], 'site': job['site'], 'sync': job['sync'], 'region': job['region'],
+                        'attempts': job['attempts'] + 1}
+        return None
+
+    def heartbeat(self, job_id, worker, seconds):
+        """Extend the lease of a job by `seconds` from now, returns False if the worker no longer holds it."""
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND worker = ? "
+                                "AND state = 'leased'", (now + seconds, now, job_id, worker))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, ok, result=None):
+        """Record the outcome of a leased job: done, queued again or failed (see `max_attempts`).
+
+        Returns
+        -------
+        bool
+            False if the worker no longer holds the lease, the outcome is then dropped.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ? AND worker = ? AND state = 'leased'",
+                             (job_id, worker)).fetchone()
+            if row is None:
+                return False
+            state = _outcome(dict(row), ok, self.max_attempts)
+            db.execute('UPDATE jobs SET state = ?, worker = ?, lease_until = NULL, result = ?, updated = ? WHERE id = ?',
+                       (state, worker if state != 'queued' else None, json.dumps(result, default=str), now, job_id))
+            return True
+
+    def release(self, job_id, worker):
+        """Hand a leased job back to the queue without counting the attempt, e.g. when the worker is stopped."""
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET state = 'queued', worker = NULL, lease_until = NULL, attempts = attempts - 1, "
+                       "updated = ? WHERE id = ? AND worker = ? AND state = 'leased'", (time.time(), job_id, worker))
+
+    def status(self):
+        """Summarize the queue.
+
+        Returns
+        -------
+        dict
+            Job count per state, 'leased' ({'id', 'site', 'sync', 'worker', 'lease_until'} per leased job) and
+            'failed' ({'id', 'site', 'sync', 'attempts', 'result'} per failed job).
+        """
+        with self._transaction() as db:
+            jobs = [dict(row) for row in db.execute('SELECT * FROM jobs ORDER BY id').fetchall()]
+        for job in jobs:
+            job['result'] = None if job['result'] is None else json.loads(job['result'])
+        return _status(jobs)
+
+
+def _status(jobs):
+    counts = dict((state, 0) for state in ('queued', 'leased', 'done', 'failed'))
+    for job in jobs:
+        counts[job['state']] += 1
+    counts['leased_jobs'] = [dict((key, job[key]) for key in ('id', 'site', 'sync', 'worker', 'lease_until'))
+                             for job in jobs if job['state'] == 'leased']
+    counts['failed_jobs'] = [dict((key, job[key]) for key in ('id', 'site', 'sync', 'attempts', 'result'))
+                             for job in jobs if job['state'] == 'failed']
+    return counts
+
+
+class FileQueue:
+    """Job queue in a JSON file, every operation holds an exclusive lock on <path>.lock. For tests and single
+    host runs without SQLite, see `SQLiteQueue` for the methods.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                document = {'next_id': 1, 'jobs': []}
+                if os.path.exists(self.path):
+                    with open(self.path) as f:
+                        document = json.load(f)
+                yield document
+                temporary = '%s.%d.tmp' % (self.path, os.getpid())
+                with open(temporary, 'w') as f:
+                    json.dump(document, f)
+                os.replace(temporary, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _find(self, document, job_id, worker):
+        for job in document['jobs']:
+            if job['id'] == job_id and job['worker'] == worker and job['state'] == 'leased':
+                return job
+        return None
+
+    def enqueue(self, tasks):
+        added = 0
+        with self._transaction() as document:
+            open_tasks = set((job['site'], job['sync']) for job in document['jobs'] if job['state'] in _OPEN_STATES)
+            for site, sync in tasks:
+                if (site, sync) in open_tasks:
+                    continue
+                document['jobs'].append({'id': document['next_id'], 'site': site, 'sync': sync,
+                                         'region': region_of(site), 'state': 'queued', 'worker': None,
+                                         'lease_until': None, 'attempts': 0, 'result': None, 'updated': time.time()})
+                document['next_id'] += 1
+                open_tasks.add((site, sync))
+                added += 1
+        return added
+
+    def lease(self, worker, seconds, regions=None):
+        now = time.time()
+        with self._transaction() as document:
+            for job in document['jobs']:
+                if not (job['state'] == 'queued' or (job['state'] == 'leased' and job['lease_until'] < now)):
+                    continue
+                if regions is not None and job['region'] is not None and job['region'] not in regions:
+                    continue
+                if job['attempts'] >= self.max_attempts:
+                    job.update(state='failed', result={'error': 'lease of %s expired' % job['worker']},
+                               worker=None, updated=now)
+                    continue
+                job.update(state='leased', worker=worker, lease_until=now + seconds, attempts=job['attempts'] + 1,
+                           updated=now)
+                return dict((key, job[key]) for key in ('id', 'site', 'sync', 'region', 'attempts'))
+        return None
+
+    def heartbeat(self, job_id, worker, seconds):
+        with self._transaction() as document:
+            job = self._find(document, job_id, worker)
+            if job is not None:
+                job.update(lease_until=time.time() + seconds, updated=time.time())
+            return job is not None
+
+    def complete(self, job_id, worker, ok, result=None):
+        with self._transaction() as document:
+            job = self._find(document, job_id, worker)
+            if job is None:
+                return False
+            state = _outcome(job, ok, self.max_attempts)
+            job.update(state=state, worker=worker if state != 'queued' else None, lease_until=None,
+                       result=json.loads(json.dumps(result, default=str)), updated=time.time())
+            return True
+
+    def release(self, job_id, worker):
+        with self._transaction() as document:
+            job = self._find(document, job_id, worker)
+            if job is not None:
+                job.update(state='queued', worker=None, lease_until=None, attempts=job['attempts'] - 1,
+                           updated=time.time())
+
+    def status(self):
+        with self._transaction() as document:
+            jobs = document['jobs']
+        return _status(jobs)
+
+
+def fleet_tasks(sites, syncs=None):
+    """Return the (site, sync function name) task of every sync function for every site.
+
+    Parameters
+    ----------
+    sites : list[str]
+        Site identifiers, e.g. netbox.netbox_get_sites().
+    syncs : list[str], optional
+        Names of the sync functions, by default every key of `synchronize.PLANNERS`.
+
+    Returns
+    -------
+    list[tuple]
+    """
+    return [(site, sync) for site in sites for sync in syncs or synchronize.PLANNERS]
+
+
+class Worker:
+    """Lease jobs from a queue and run them, one at a time, while renewing the lease.
+
+    While running, NETCONF sessions are borrowed from a shared `SessionPool`, NetBox device lookups are cached and
+    device facts are kept for `facts.RECENT`, as in the sync daemon. Start one worker per process, as many processes per host as the devices and NetBox allow.
+
+    Parameters
+    ----------
+    queue : SQLiteQueue or FileQueue
+        The shared queue.
+    token : str
+        NetBox API token.
+    username : str
+        Juniper device username.
+    password : str
+        Juniper device password.
+    name : str, optional
+        Worker name recorded with its leases, by default <hostname>:<pid>.
+    regions : list[str], optional
+        Lease only jobs of these regions (keys of REGIONS), None for any job.
+    lease : float, optional
+        Lease duration in seconds, a job of a worker that stops renewing is leased again after this.
+    heartbeat : float, optional
+        Seconds between lease renewals, well below `lease`.
+    dry_run : bool, optional
+        Only plan, see `cli.run`.
+    facts_cache : str, optional
+        JSON file the device facts are kept in, see `facts.set_facts_cache`.
+    """
+
+    def __init__(self, queue, token, username, password, name=None, regions=None, lease=300, heartbeat=60,
+                 dry_run=False, facts_cache=None):
+        self.queue = queue
+        self.token = token
+        self.username = username
+        self.password = password
+        self.name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.regions = regions
+        self.lease = lease
+        self.heartbeat = heartbeat
+        self.dry_run = dry_run
+        self.facts_cache = facts_cache
+        self.stats = {'done': 0, 'failed': 0, 'lost': 0}
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """Stop after the running job, from another thread or a signal handler."""
+        self._stopping.set()
+
+    def _renew(self, job, finished, lost):
+        while not finished.wait(self.heartbeat):
+            if not self.queue.heartbeat(job['id'], self.name, self.lease):
+                logger.warning('%s lost the lease of job %d (%s %s)', self.name, job['id'], job['site'], job['sync'])
+                lost.set()
+                return
+
+    def run_job(self, job):
+        """Run one leased job, renewing its lease, and record the outcome.
+
+        Returns
+        -------
+        dict
+            The `cli.run` result of the sync.
+        """
+        finished = threading.Event()
+        lost = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(job, finished, lost), daemon=True)
+        renewer.start()
+        try:
+            result = cli.run(self.token, job['site'], job['sync'], self.username, self.password, self.dry_run)
+        finally:
+            finished.set()
+            renewer.join()
+        ok = result['error'] is None and result['failed'] == 0
+        summary = dict((key, result[key]) for key in ('planned', 'failed', 'error', 'seconds'))
+        if lost.is_set() or not self.queue.complete(job['id'], self.name, ok, summary):
+            self.stats['lost'] += 1
+        else:
+            self.stats['done' if ok else 'failed'] += 1
+        logger.info('%s %s %s %s in %.2fs', self.name, job['sync'], job['site'], 'done' if ok else 'failed',
+                    result['seconds'])
+        return result
+
+    def run(self, exit_when_empty=False, poll=5):
+        """Lease and run jobs until stopped.
+
+        Parameters
+        ----------
+        exit_when_empty : bool, optional
+            Return once no job can be leased, instead of polling for new ones.
+        poll : float, optional
+            Seconds between lease attempts while the queue is empty.
+
+        Returns
+        -------
+        dict
+            'done', 'failed' and 'lost' (jobs whose lease was taken over before they finished) job counts.
+        """
+        pool = sessions.SessionPool(size=2, max_idle=300)
+        previous = sessions.set_session_pool(pool)
+        netbox.netbox_set_lookup_cache(3600)
+        facts.set_facts_cache(self.facts_cache, facts.RECENT)
+        try:
+            while not self._stopping.is_set():
+                job = self.queue.lease(self.name, self.lease, self.regions)
+                if job is None:
+                    if exit_when_empty:
+                        break
+                    self._stopping.wait(poll)
+                    continue
+                try:
+                    self.run_job(job)
+                except BaseException:
+                    # interrupted (KeyboardInterrupt): hand the job to another worker right away
+                    self.queue.release(job['id'], self.name)
+                    raise
+        finally:
+            sessions.set_session_pool(previous)
+            pool.close()
+        return dict(self.stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Distributed SVC sync workers')
+    parser.add_argument('--queue', required=True, help='queue file')
+    parser.add_argument('--backend', choices=['sqlite', 'file'], default='sqlite')
+    commands = parser.add_subparsers(dest='command', required=True)
+    enqueue = commands.add_parser('enqueue', help='queue a job per site and sync function')
+    enqueue.add_argument('--sites', nargs='+', help='site identifiers, by default every SVC site')
+    enqueue.add_argument('--syncs', nargs='+', choices=list(synchronize.PLANNERS),
+                         help='sync functions, by default all of them')
+    work = commands.add_parser('work', help='lease and run jobs')
+    work.add_argument('--name', help='worker name, by default <hostname>:<pid>')
+    work.add_argument('--regions', nargs='+', choices=list(REGIONS), help='lease only jobs of these regions')
+    work.add_argument('--lease', type=float, default=300, help='lease duration in seconds')
+    work.add_argument('--heartbeat', type=float, default=60, help='seconds between lease renewals')
+    work.add_argument('--dry-run', action='store_true', help='plan only')
+    work.add_argument('--exit-when-empty', action='store_true', help='stop when no job is left')
+    work.add_argument('--response-cache', metavar='DIRECTORY', help='keep and revalidate NetBox list responses here')
+    work.add_argument('--facts-cache', metavar='FILE', help='keep the device facts in this file')
+    commands.add_parser('status', help='print the job counts, leases and failures')
+    args = parser.parse_args(argv)
+
+    queue = (SQLiteQueue if args.backend == 'sqlite' else FileQueue)(args.queue)
+    if args.command == 'enqueue':
+        result = {'queued': queue.enqueue(fleet_tasks(args.sites or netbox.netbox_get_sites(), args.syncs))}
+    elif args.command == 'work':
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+        if args.response_cache:
+            netbox.netbox_set_response_cache(args.response_cache)
+        worker = Worker(queue, os.environ['NETBOX_TOKEN'], os.environ['JUNOS_USERNAME'],
+                        os.environ['JUNOS_PASSWORD'], args.name, args.regions, args.lease, args.heartbeat,
+                        args.dry_run, args.facts_cache)
+        result = worker.run(args.exit_when_empty)
+    else:
+        result = queue.status()
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()